@@ -0,0 +1,119 @@
+'''
+Throughput benchmark for loading and storing meta.json files with MetaData
+Compares MetaData.load/store with orjson, when it is installed, and with the json module,
+against the json.load + copy.deepcopy and json.dump it replaced, in files/sec
+The meta data is shaped like the meta data of a module after wfgen, with the code of benchmarks.corpus and a list of wavedroms
+Run from the repository root: python -m benchmarks.bench_meta --count 2000
+'''
+import argparse
+import copy
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+from scripts import meta_data
+from benchmarks import corpus
+
+_MODULE_REGEX = re.compile(r'^module\s+(\w+)', re.MULTILINE)
+_PORT_REGEX = re.compile(r'\b(input|output)\s+(?:wire|reg)\s+(?:\[[^\]]*\]\s*)?(\w+)')
+
+
+def generate_meta(code, rng, max_wavedroms):
+    '''
+    Create the meta data of a module after wfgen from its code
+    '''
+    ports = [{"name": name, "mode": mode, "type": "wire"} for mode, name in _PORT_REGEX.findall(code)]
+    wavedroms = []
+    for i in range(rng.randint(1, max_wavedroms)):
+        post = rng.sample(ports, len(ports))
+        wavedroms.append({"index": i, "json": f"wavedrom_{i}.json", "applied_variation": "shuffled",
+                          "shuffled": {"pre": ports, "post": post}, "png": f"wavedrom_{i}.png"})
+    return {
+        "module_name": _MODULE_REGEX.search(code).group(1),
+        "parameters": [],
+        "clocks": [port["name"] for port in ports if port["name"] == "clk"],
+        "resets": [port["name"] for port in ports if port["name"] == "rst"],
+        "ports": ports,
+        "code": code,
+        "testbench": "tb_instrumented.v",
+        "wavedroms": wavedroms,
+    }
+
+
+def _legacy_store(folder, meta):
+    with open(os.path.join(folder, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+
+def _legacy_load(folder):
+    with open(os.path.join(folder, "meta.json"), "r") as f:
+        return copy.deepcopy(json.load(f))
+
+
+def _store(folder, meta):
+    meta_data.MetaData.from_dict(meta).store(folder)
+
+
+def _load(folder):
+    return meta_data.MetaData().load(folder)
+
+
+def _time(folders, metas, store, load):
+    start = time.perf_counter()
+    for folder, meta in zip(folders, metas):
+        store(folder, meta)
+    stored = time.perf_counter() - start
+    start = time.perf_counter()
+    for folder in folders:
+        load(folder)
+    loaded = time.perf_counter() - start
+    return {"store": len(folders) / stored, "load": len(folders) / loaded}
+
+
+def run(count, max_wavedroms=8, seed=0):
+    '''
+    Store and load the meta data of count modules with every codec
+    Returns a dict with the store and load throughput of every codec in files/sec
+    '''
+    rng = random.Random(seed)
+    metas = [generate_meta(code, rng, max_wavedroms) for code in corpus.generate_corpus(count, seed=seed)]
+    path = tempfile.mkdtemp(prefix="bench_meta_")
+    orjson = meta_data.orjson
+    try:
+        folders = []
+        for i in range(count):
+            folders.append(os.path.join(path, f"ds_{i}"))
+            os.mkdir(folders[-1])
+            # every codec replaces existing files, creating them is not part of the measurement
+            _legacy_store(folders[-1], metas[i])
+        results = {"legacy json": _time(folders, metas, _legacy_store, _legacy_load)}
+        # the codec is picked when meta_data is imported, it is switched to compare both
+        meta_data.orjson = None
+        results["json"] = _time(folders, metas, _store, _load)
+        if orjson is not None:
+            meta_data.orjson = orjson
+            results["orjson"] = _time(folders, metas, _store, _load)
+        return results
+    finally:
+        meta_data.orjson = orjson
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Compare the load and store throughput of meta.json files")
+    parser.add_argument("--count", help="Number of meta.json files", type=int, default=2000)
+    parser.add_argument("--max_wavedroms", help="Maximum number of wavedroms in the meta data of a module", type=int, default=8)
+    args = parser.parse_args()
+
+    results = run(args.count, args.max_wavedroms)
+    for name, result in results.items():
+        print(f"{name:12} store {result['store']:8.0f} files/s, load {result['load']:8.0f} files/s")
+    if "orjson" not in results:
+        print("orjson skipped, not installed")
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,75 @@
+'''
+Throughput benchmark for parsing verilog modules into the dataset folder
+Compares submitting one module per task (main.parse_verilog_module) with
+batched parsing on workers that reuse their VerilogExtractor (main.parse_verilog_modules)
+Run from the repository root: python -m benchmarks.bench_parse --modules 5000
+'''
+import argparse
+import concurrent.futures
+import os
+import shutil
+import tempfile
+import time
+import main
+from scripts import meta_data
+from scripts import storage
+from benchmarks import corpus
+
+
+def _per_module(modules, processes):
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(main.parse_verilog_module, id, m) for id, m in enumerate(modules)]
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+
+
+def _batched(modules, processes, batch_size):
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes, initializer=meta_data.init_worker) as executor:
+        futures = []
+        for start in range(0, len(modules), batch_size):
+            batch = [(id, None, modules[id]) for id in range(start, min(start + batch_size, len(modules)))]
+            futures.append(executor.submit(main.parse_verilog_modules, batch))
+        for future in concurrent.futures.as_completed(futures):
+            _, results = future.result()
+            for id, digest, meta in results:
+                main.store_verilog_module(id, meta)
+
+
+def run(num_modules, processes, batch_size):
+    '''
+    Run both parse strategies on the same synthetic corpus
+    Returns a dict with the throughput of both strategies in modules/sec
+    '''
+    modules = corpus.generate_corpus(num_modules, max_ports=main.MAX_PORTS)
+    results = {}
+    for name, strategy in [("per_module", lambda: _per_module(modules, processes)),
+                           ("batched", lambda: _batched(modules, processes, batch_size))]:
+        folder = tempfile.mkdtemp(prefix="bench_parse_")
+        # the worker processes are forked after this, so they write to the temporary folder as well
+        main.FOLDER = folder
+        main.STORAGE = storage.Storage(folder, "flat")
+        try:
+            start = time.perf_counter()
+            strategy()
+            elapsed = time.perf_counter() - start
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+        results[name] = num_modules / elapsed
+    return results
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Compare per-module and batched parsing throughput")
+    parser.add_argument("--modules", help="Number of synthetic modules to parse", type=int, default=5000)
+    parser.add_argument("--num_processes", help="Number of worker processes", type=int, default=max(os.cpu_count() - 1, 1))
+    parser.add_argument("--batch_size", help="Number of modules per batch", type=int, default=main.PARSE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    results = run(args.modules, args.num_processes, args.batch_size)
+    print(f"Per-module submission: {results['per_module']:.0f} modules/sec")
+    print(f"Batched submission:    {results['batched']:.0f} modules/sec")
+    print(f"Speedup: {results['batched'] / results['per_module']:.2f}x")
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,77 @@
+'''
+Microbenchmark for generate_wavedroms._get_signal_permutations
+Times generating the signal orders of modules with a growing number of ports, limited to MAX_WAVEDROMS like extract_wavedroms does
+Without sampling the time would grow with the factorial of the number of ports, with it the time should stay flat
+Modules with 32 ports are always included, their number of permutations is larger than sys.maxsize
+The samples drawn with different seeds are compared as well, they have to differ
+Run from the repository root: python -m benchmarks.bench_permutations --max_ports 12
+'''
+import argparse
+import time
+import scripts.generate_wavedroms
+
+# numbers of ports which are always timed, their number of permutations does not fit in 64 bits
+WIDE_PORTS = [32]
+
+
+def generate_ports(num_ports, clocked):
+    '''
+    Create the port list of a module like MetaData stores it, half inputs and half outputs
+    Clocked modules get a clk port, which is returned as the only clock
+    '''
+    ports = [{"name": "clk", "mode": "input"}] if clocked else []
+    for i in range(num_ports - len(ports)):
+        mode = "input" if i % 2 == 0 else "output"
+        ports.append({"name": f"{mode[:-3]}_{i}", "mode": mode})
+    return ports, ["clk"] if clocked else []
+
+
+def check_seeds(num_ports, limit):
+    '''
+    Check that sampling the permutations with another PERMUTATION_SEED gives other permutations
+    Raises a ValueError when two seeds sample the same permutations
+    '''
+    ports, clocks = generate_ports(num_ports, False)
+    samples = []
+    default_seed = scripts.generate_wavedroms.PERMUTATION_SEED
+    try:
+        for seed in [0, 1]:
+            scripts.generate_wavedroms.PERMUTATION_SEED = seed
+            samples.append([[port["name"] for port in perm] for perm in scripts.generate_wavedroms._get_signal_permutations(ports, clocks, limit=limit)])
+    finally:
+        scripts.generate_wavedroms.PERMUTATION_SEED = default_seed
+    if samples[0] == samples[1]:
+        raise ValueError(f"the seeds 0 and 1 sample the same {limit} permutations of {num_ports} ports")
+
+
+def run(max_ports, limit, repeat):
+    '''
+    Time generating the permutations for 2 up to max_ports ports and for WIDE_PORTS
+    Returns a dict with, per number of ports, the number of permutations and the microseconds per call
+    Raises a ValueError when the seed does not change the sampled permutations
+    '''
+    check_seeds(max(WIDE_PORTS), limit)
+    results = {}
+    for num_ports in sorted(set(range(2, max_ports + 1)) | set(WIDE_PORTS)):
+        ports, clocks = generate_ports(num_ports, num_ports % 2 == 1)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            count = sum(1 for _ in scripts.generate_wavedroms._get_signal_permutations(ports, clocks, limit=limit))
+        results[num_ports] = {"permutations": count, "microseconds": (time.perf_counter() - start) / repeat * 1e6}
+    return results
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Time generating the signal permutations of the wavedroms")
+    parser.add_argument("--max_ports", help="Largest number of ports", type=int, default=12)
+    parser.add_argument("--limit", help="Maximum number of permutations per module", type=int, default=scripts.generate_wavedroms.MAX_WAVEDROMS)
+    parser.add_argument("--repeat", help="Number of calls per number of ports", type=int, default=20)
+    args = parser.parse_args()
+
+    results = run(args.max_ports, args.limit, args.repeat)
+    for num_ports, result in results.items():
+        print(f"{num_ports:3} ports: {result['permutations']:6} permutations in {result['microseconds']:10.1f} us")
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,92 @@
+'''
+Throughput benchmark for the stages of the pipeline on a synthetic corpus
+Creates a dataset from benchmarks.corpus with main.gather_verilog_data, then times precheck_modules, generate_testbenches, perform_simulations and generate_waveforms
+Tools which are not installed are replaced by the deterministic stand-ins of benchmarks.stub_tools, so the benchmark runs offline;
+the results then measure the overhead of the pipeline itself rather than the speed of the tools
+The caches are disabled, every run does all the work
+Run from the repository root: python -m benchmarks.bench_pipeline --modules 200
+'''
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import main
+import scripts.catalog
+import scripts.generate_wavedroms
+import scripts.simulate
+import scripts.tb_gen
+from benchmarks import corpus
+from benchmarks import stub_tools
+
+
+def _completed(folder, stage):
+    '''
+    Number of modules which successfully completed the stage
+    '''
+    stages = scripts.catalog.STAGES
+    with scripts.catalog.open_catalog(folder) as catalog:
+        return sum(count for (status, module_stage), count in catalog.count().items()
+                   if status == "ok" and stages.index(module_stage) >= stages.index(stage))
+
+
+def run(num_modules, max_ports=6, clocked_ratio=0.5, processes=None, max_sim_time=100, max_wavedroms=8, seed=0, stubs=False):
+    '''
+    Create a dataset from a synthetic corpus and run it through the stages one at a time
+    With stubs all tools are replaced by the stand-ins, otherwise only the ones that are not installed
+    Returns a dict with the tools used and, per stage, the seconds it took, the number of modules that completed it and the modules/sec
+    '''
+    modules = corpus.generate_corpus(num_modules, max_ports=max_ports, clocked_ratio=clocked_ratio, seed=seed)
+    path = tempfile.mkdtemp(prefix="bench_pipeline_")
+    path_env = os.environ["PATH"]
+    try:
+        tools = stub_tools.install(os.path.join(path, "bin"), force=stubs)
+        os.environ["PATH"] = os.path.join(path, "bin") + os.pathsep + path_env
+        main.FOLDER = os.path.join(path, "data")
+        main.DEDUP_INDEX = os.path.join(path, "dedup.txt")
+        main.STORAGE = None
+        main.MAX_PORTS = max_ports
+        main.MAX_PROCESSES = processes or main.MAX_PROCESSES
+        main.ADAPTIVE_CONCURRENCY = False
+        scripts.simulate.SIM_CACHE = None
+        scripts.generate_wavedroms.RENDER_CACHE = None
+        scripts.generate_wavedroms.RENDERER = "cli"
+        scripts.generate_wavedroms.MAX_WAVEDROMS = max_wavedroms
+        scripts.tb_gen.init(max_sim_time)
+
+        results = {"tools": tools, "stages": {}}
+        for stage, func in [("create", lambda: main.gather_verilog_data(sources=modules)),
+                            ("precheck", main.precheck_modules),
+                            ("tbgen", main.generate_testbenches),
+                            ("sim", main.perform_simulations),
+                            ("wfgen", main.generate_waveforms)]:
+            start = time.perf_counter()
+            func()
+            seconds = time.perf_counter() - start
+            completed = _completed(main.FOLDER, stage)
+            results["stages"][stage] = {"seconds": seconds, "completed": completed, "modules_per_second": completed / seconds}
+        return results
+    finally:
+        os.environ["PATH"] = path_env
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Time the stages of the pipeline on a synthetic corpus")
+    parser.add_argument("--modules", help="Number of synthetic modules", type=int, default=200)
+    parser.add_argument("--max_ports", help="Maximum number of ports of the synthetic modules, clk and rst included", type=int, default=main.MAX_PORTS)
+    parser.add_argument("--clocked_ratio", help="Fraction of the synthetic modules with a clock and reset", type=float, default=0.5)
+    parser.add_argument("--num_processes", help="Number of processes", type=int, default=main.MAX_PROCESSES)
+    parser.add_argument("--max_sim_time", help="Maximum simulation time for testbenches in ns", type=int, default=100)
+    parser.add_argument("--max_wavedroms", help="Maximum number of wavedroms per module", type=int, default=8)
+    parser.add_argument("--stubs", help="Use the stand-ins even for the tools that are installed", action="store_true")
+    args = parser.parse_args()
+
+    results = run(args.modules, args.max_ports, args.clocked_ratio, args.num_processes, args.max_sim_time, args.max_wavedroms, stubs=args.stubs)
+    print(f"Tools: {', '.join(f'{tool} ({kind})' for tool, kind in results['tools'].items())}")
+    for stage, result in results["stages"].items():
+        print(f"{stage:8} {result['seconds']:8.2f}s {result['completed']:6} modules {result['modules_per_second']:8.1f} modules/sec")
+
+
+if __name__ == "__main__":
+    main_bench()
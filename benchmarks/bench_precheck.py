@@ -0,0 +1,40 @@
+'''
+Throughput benchmark for precheck.scan, the check for code which keeps a module from compiling on its own
+Every module of benchmarks.corpus compiles on its own but has commented out includes, instances and SystemVerilog,
+so any module which is rejected is a false reject and fails the benchmark
+Run from the repository root: python -m benchmarks.bench_precheck --modules 2000
+'''
+import argparse
+import time
+from scripts import precheck
+from benchmarks import corpus
+
+
+def run(num_modules, seed=0):
+    '''
+    Scan a synthetic corpus
+    Returns a dict with the throughput in modules/sec
+    Raises a ValueError when a module of the corpus is rejected
+    '''
+    modules = corpus.generate_corpus(num_modules, seed=seed)
+    start = time.perf_counter()
+    reasons = [precheck.scan(code) for code in modules]
+    elapsed = time.perf_counter() - start
+    rejected = [(index, reason) for index, reason in enumerate(reasons) if reason is not None]
+    if rejected:
+        index, reason = rejected[0]
+        raise ValueError(f"{len(rejected)} modules of the corpus were rejected, module {index}: {reason}")
+    return {"modules_per_second": num_modules / elapsed}
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Time the precheck scan of the code of modules")
+    parser.add_argument("--modules", help="Number of synthetic modules", type=int, default=2000)
+    args = parser.parse_args()
+
+    results = run(args.modules)
+    print(f"scan {results['modules_per_second']:10.0f} modules/sec, no false rejects")
+
+
+if __name__ == "__main__":
+    main_bench()
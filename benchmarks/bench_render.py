@@ -0,0 +1,148 @@
+'''
+Throughput and visual parity benchmark for rendering wavedrom jsons
+Renders a fixed corpus of jsons, shaped like the ones scripts.generate_wavedroms emits, with scripts.wavedrom_svg and with wavedrom-cli
+Parity is the mean absolute pixel difference of both pngs, which needs Pillow, and is skipped for a renderer that is not installed
+Run from the repository root: python -m benchmarks.bench_render --count 200
+'''
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from scripts import renderer
+from scripts import wavedrom_svg
+
+
+def generate_wavejson(rng, clocked):
+    '''
+    Create a wavedrom json like the ones of utils.vcd2json, after extract_wavedroms split up its groups
+    Clocked jsons have a tock header, a "p" clock and space separated data, unclocked jsons have data lists and no header
+    '''
+    length = rng.randint(8, 24)
+    signals = []
+    if clocked:
+        signals.append({"name": "clk", "wave": "p" + "." * (length - 1)})
+    for i in range(rng.randint(2, 6)):
+        bus = rng.random() < 0.4
+        wave = ""
+        data = []
+        previous = None
+        for _ in range(length):
+            if bus:
+                value = rng.choice([None, str(rng.randint(0, 255)), "x"])
+            else:
+                value = rng.choice("01xz.")
+            if value is None or value == "." or value == previous:
+                wave += "."
+                continue
+            previous = value
+            if bus and value != "x":
+                wave += "="
+                data.append(value)
+            else:
+                wave += value
+        signal = {"name": f"{'bus' if bus else 'sig'}_{i}", "wave": wave}
+        if data:
+            signal["data"] = " ".join(data) if clocked else data
+        signals.append(signal)
+    if clocked:
+        return {"head": {"tock": 1}, "signal": signals}
+    return {"signal": signals}
+
+
+def generate_corpus(path, count, seed=0):
+    '''
+    Write count wavedrom jsons into the folder, returns their paths
+    '''
+    rng = random.Random(seed)
+    files = []
+    for i in range(count):
+        json_file = os.path.join(path, f"wavedrom_{i}.json")
+        with open(json_file, "w") as f:
+            json.dump(generate_wavejson(rng, i % 2 == 0), f)
+        files.append(json_file)
+    return files
+
+
+def _time(render, files, suffix):
+    start = time.perf_counter()
+    done = 0
+    for json_file in files:
+        try:
+            if render(json_file, json_file[:-len(".json")] + suffix):
+                done += 1
+        except Exception as e:
+            continue
+    return done, time.perf_counter() - start
+
+
+def _render_svg(json_file, svg_file):
+    with open(json_file, "r") as f:
+        svg = wavedrom_svg.render_svg(json.load(f))
+    with open(svg_file, "w") as f:
+        f.write(svg)
+    return True
+
+
+def _difference(first, second):
+    '''
+    Mean absolute difference of two pngs in grayscale, scaled to 0 (identical) to 1
+    The second image is scaled to the size of the first
+    '''
+    from PIL import Image, ImageChops, ImageStat
+    a = Image.open(first).convert("L")
+    b = Image.open(second).convert("L").resize(a.size)
+    return ImageStat.Stat(ImageChops.difference(a, b)).mean[0] / 255
+
+
+def run(count, seed=0):
+    '''
+    Render the same corpus with every available renderer
+    Returns a dict with the images per second of every renderer, and the mean pixel difference when it could be measured
+    '''
+    path = tempfile.mkdtemp(prefix="bench_render_")
+    try:
+        files = generate_corpus(path, count, seed)
+        results = {}
+        done, seconds = _time(_render_svg, files, "_python.svg")
+        results["python svg"] = done / seconds
+        if wavedrom_svg.png_available():
+            done, seconds = _time(renderer.render_python, files, "_python.png")
+            results["python png"] = done / seconds if done else None
+        if shutil.which("wavedrom-cli"):
+            done, seconds = _time(renderer.render_cli, files, "_cli.png")
+            results["wavedrom-cli png"] = done / seconds if done else None
+        try:
+            differences = [_difference(f[:-len(".json")] + "_cli.png", f[:-len(".json")] + "_python.png") for f in files
+                           if os.path.exists(f[:-len(".json")] + "_cli.png") and os.path.exists(f[:-len(".json")] + "_python.png")]
+        except ImportError as e:
+            differences = []
+        if differences:
+            results["difference"] = sum(differences) / len(differences)
+        return results
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Compare the in process wavedrom renderer with wavedrom-cli")
+    parser.add_argument("--count", help="Number of wavedrom jsons in the corpus", type=int, default=200)
+    parser.add_argument("--seed", help="Seed of the corpus", type=int, default=0)
+    args = parser.parse_args()
+
+    results = run(args.count, args.seed)
+    for name in ["python svg", "python png", "wavedrom-cli png"]:
+        if results.get(name) is None:
+            print(f"{name:17} skipped, not available")
+        else:
+            print(f"{name:17} {results[name]:.1f} images/s")
+    if "difference" in results:
+        print(f"Mean pixel difference python vs wavedrom-cli: {results['difference'] * 100:.2f}%")
+    else:
+        print("Visual parity skipped, needs the pngs of both renderers and Pillow")
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,159 @@
+'''
+Throughput benchmark for reading VCD files in utils.vcd2json
+Compares the block based tokenizer (_VcdReader) with the line by line reader it replaced, in MB/s
+Run from the repository root: python -m benchmarks.bench_vcd --size 300
+'''
+import argparse
+import os
+import random
+import tempfile
+import time
+from utils import vcd2json
+
+
+def generate_vcd(path, size_mb, num_signals=64, seed=0):
+    '''
+    Write a synthetic VCD file of roughly size_mb megabytes
+    The testbench scope contains a clock, num_signals single and multi bit signals, and an instance scope with the same signals
+    '''
+    rng = random.Random(seed)
+    signals = [("clk", 1)] + [(f"sig_{i}", rng.choice([1, 1, 4, 8, 16])) for i in range(num_signals)]
+    ids = {}
+    with open(path, "w") as f:
+        f.write("$date today $end\n$version bench $end\n$timescale 1ns $end\n")
+        f.write("$scope module testbench $end\n")
+        for scope in ["testbench", "inst"]:
+            if scope == "inst":
+                f.write("$scope module inst $end\n")
+            for name, width in signals:
+                sid = _identifier(len(ids))
+                ids[(scope, name)] = (sid, width)
+                f.write(f"$var wire {width} {sid} {name} $end\n" if width == 1 else f"$var wire {width} {sid} {name} [{width - 1}:0] $end\n")
+            if scope == "inst":
+                f.write("$upscope $end\n")
+        f.write("$upscope $end\n$enddefinitions $end\n$dumpvars\n")
+        for (sid, width) in ids.values():
+            f.write(f"x{sid}\n" if width == 1 else f"bx {sid}\n")
+        f.write("$end\n")
+        now = 0
+        clock = 0
+        limit = size_mb * 1024 * 1024
+        while f.tell() < limit:
+            now += 5
+            clock = 1 - clock
+            lines = [f"#{now}\n"]
+            for (scope, name), (sid, width) in ids.items():
+                if name == "clk":
+                    lines.append(f"{clock}{sid}\n")
+                elif rng.random() < 0.3:
+                    if width == 1:
+                        lines.append(f"{rng.choice('01')}{sid}\n")
+                    else:
+                        lines.append(f"b{rng.getrandbits(width):b} {sid}\n")
+            f.write("".join(lines))
+    return [f"testbench/inst/{name}" for name, _ in signals[:7]]
+
+
+def _identifier(index):
+    chars = [chr(c) for c in range(33, 127)]
+    identifier = ""
+    while True:
+        identifier += chars[index % len(chars)]
+        index //= len(chars)
+        if index == 0:
+            return identifier
+
+
+def _legacy_read(vcd_file, sids):
+    '''
+    The line by line reader used by the samplers before _VcdReader
+    '''
+    value_dict = {sid: 'x' for sid in sids}
+    with open(vcd_file, 'rt') as fin:
+        while True:
+            line = fin.readline()
+            if not line:
+                raise EOFError('Can\'t find word "$enddefinitions".')
+            words = line.split()
+            if words and words[0] == '$enddefinitions':
+                break
+        now = 0
+        while True:
+            line = fin.readline()
+            if not line:
+                return now
+            words = line.split()
+            if not words:
+                continue
+            char = words[0][0]
+            if char == '$':
+                continue
+            if char == '#':
+                now = int(words[0][1:])
+                continue
+            if char in ('0', '1', 'x', 'z'):
+                sid = words[0][1:]
+                if sid in value_dict:
+                    value_dict[sid] = char
+                continue
+            if char in ('b', 'B', 'r', 'R'):
+                sid = words[1]
+                if sid in value_dict:
+                    value_dict[sid] = words[0][1:]
+                continue
+
+
+def _tokenizer_read(vcd_file, sids):
+    value_dict = {sid: 'x' for sid in sids}
+    reader = vcd2json._VcdReader(vcd_file)
+    try:
+        reader.read_header()
+        now = 0
+        for sid, value in reader.changes(sids):
+            if sid is None:
+                now = value
+            else:
+                value_dict[sid] = value
+        return now
+    finally:
+        reader.close()
+
+
+def run(size_mb, num_signals):
+    '''
+    Read the same synthetic VCD with both readers
+    Returns a dict with the throughput of both readers in MB/s
+    '''
+    fd, path = tempfile.mkstemp(suffix=".vcd", prefix="bench_vcd_")
+    os.close(fd)
+    try:
+        paths = generate_vcd(path, size_mb, num_signals)
+        reader = vcd2json._VcdReader(path)
+        _, path_dict = reader.read_header()
+        reader.close()
+        sids = [path_dict[p]._sid for p in paths]
+        size = os.path.getsize(path) / (1024 * 1024)
+        results = {}
+        for name, read in [("legacy", _legacy_read), ("tokenizer", _tokenizer_read)]:
+            start = time.perf_counter()
+            read(path, sids)
+            results[name] = size / (time.perf_counter() - start)
+        return results
+    finally:
+        os.remove(path)
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Compare the VCD reading throughput of utils.vcd2json")
+    parser.add_argument("--size", help="Size of the synthetic VCD file in MB", type=int, default=300)
+    parser.add_argument("--signals", help="Number of signals in the synthetic VCD file, only a few of them are tracked", type=int, default=64)
+    args = parser.parse_args()
+
+    results = run(args.size, args.signals)
+    print(f"Line by line reader: {results['legacy']:.1f} MB/s")
+    print(f"Block tokenizer:     {results['tokenizer']:.1f} MB/s")
+    print(f"Speedup: {results['tokenizer'] / results['legacy']:.2f}x")
+
+
+if __name__ == "__main__":
+    main_bench()
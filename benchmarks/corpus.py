@@ -0,0 +1,65 @@
+'''
+Synthetic verilog corpus used by the benchmarks
+The generated modules follow the 2001 syntax which is supported by MetaData.analyze_code
+'''
+import random
+
+_WIDTHS = [1, 1, 1, 2, 4, 8, 16]
+
+
+def generate_module(index, num_inputs, num_outputs, clocked, rng):
+    '''
+    Generate a single module with the given number of (non clock/reset) inputs and outputs
+    Clocked modules get a clk and rst port and register their outputs
+    '''
+    name = f"bench_module_{index}"
+    ports = []
+    if clocked:
+        ports.append("input wire clk")
+        ports.append("input wire rst")
+    inputs = []
+    for i in range(num_inputs):
+        width = rng.choice(_WIDTHS)
+        inputs.append((f"in_{i}", width))
+        ports.append(f"input wire [{width - 1}:0] in_{i}" if width > 1 else f"input wire in_{i}")
+    outputs = []
+    for i in range(num_outputs):
+        width = rng.choice(_WIDTHS)
+        outputs.append((f"out_{i}", width))
+        kind = "reg" if clocked else "wire"
+        ports.append(f"output {kind} [{width - 1}:0] out_{i}" if width > 1 else f"output {kind} out_{i}")
+
+    # the comments hold code which would keep the module from compiling, precheck has to ignore them
+    lines = [f"// generated module {index}", "// `include \"bench_defs.vh\"", f"module {name} ("]
+    lines.append(",\n".join(f"    {p}" for p in ports))
+    lines.append(");")
+    lines.append(f"    /* bench_helper helper_{index} (.clk(clk));\n       always_ff @(posedge clk) logic valid; */")
+    for o, (out, _) in enumerate(outputs):
+        operands = [inputs[(o + k) % len(inputs)][0] for k in range(min(2, len(inputs)))] if inputs else ["1'b0"]
+        operator = rng.choice(["&", "|", "^", "+"])
+        expression = f" {operator} ".join(operands)
+        if clocked:
+            lines.append("    always @(posedge clk) begin")
+            lines.append(f"        if (rst) {out} <= 0;")
+            lines.append(f"        else {out} <= {expression};")
+            lines.append("    end")
+        else:
+            lines.append(f"    assign {out} = {expression}; /* {operator} */")
+    lines.append("endmodule")
+    return "\n".join(lines) + "\n"
+
+
+def generate_corpus(num_modules, max_ports=6, clocked_ratio=0.5, seed=0):
+    '''
+    Generate a list of num_modules verilog modules
+    The total number of ports of every module is at most max_ports, clk and rst included
+    '''
+    rng = random.Random(seed)
+    modules = []
+    for index in range(num_modules):
+        clocked = rng.random() < clocked_ratio and max_ports >= 4
+        available = max_ports - 2 if clocked else max_ports
+        num_inputs = rng.randint(1, max(1, available - 1))
+        num_outputs = rng.randint(1, max(1, available - num_inputs))
+        modules.append(generate_module(index, num_inputs, num_outputs, clocked, rng))
+    return modules
@@ -0,0 +1,206 @@
+'''
+Deterministic stand-ins for gentbvlog, iverilog, vvp and wavedrom-cli
+They accept the arguments the pipeline passes to the real tools and create the files the pipeline expects,
+derived only from their inputs, so benchmarks can run on machines without the tools and give the same output every time.
+install() puts wrappers for the tools which are not installed into a bin folder, which is then put in front of PATH.
+Every wrapper runs this file as python benchmarks/stub_tools.py <tool> <arguments>.
+'''
+import os
+import re
+import sys
+import json
+import zlib
+import random
+import shutil
+import struct
+
+TOOLS = ["gentbvlog", "iverilog", "vvp", "wavedrom-cli"]
+
+_MODULE_REGEX = re.compile(r'\bmodule\s+(\w+)')
+_PORT_REGEX = re.compile(r'\b(input|output|inout)\s+(?:wire\s+|reg\s+)?(?:\[\s*(\d+)\s*:\s*(\d+)\s*\]\s*)?(\w+)')
+_HEADER_REGEX = re.compile(r'// stub testbench top=(\w+) max_sim_time=(\d+) clocks=([\w,]*) resets=([\w,]*)')
+
+
+def _ports(code):
+    '''
+    Get the (mode, name, width) of the ports of the first module in the code
+    '''
+    end = code.find("endmodule")
+    ports = []
+    for mode, msb, lsb, name in _PORT_REGEX.findall(code[:end if end >= 0 else len(code)]):
+        width = abs(int(msb) - int(lsb)) + 1 if msb else 1
+        ports.append((mode, name, width))
+    return ports
+
+
+def _option(args, name, default=None):
+    return args[args.index(name) + 1] if name in args else default
+
+
+def gentbvlog(args):
+    '''
+    Write a testbench driving the inputs of the module with seeded random values
+    '''
+    with open(_option(args, "-in"), "r") as f:
+        code = f.read()
+    top = _option(args, "-top")
+    max_sim_time = int(_option(args, "-max_sim_time", "400"))
+    clocks = [args[i + 1] for i, arg in enumerate(args) if arg == "-clk"]
+    resets = [args[i + 1] for i, arg in enumerate(args) if arg == "-rst"]
+    ports = _ports(code)
+    rng = random.Random(zlib.crc32(code.encode("utf-8")))
+    lines = [f"// stub testbench top={top} max_sim_time={max_sim_time} clocks={','.join(clocks)} resets={','.join(resets)}",
+             "module testbench;"]
+    for mode, name, width in ports:
+        kind = "reg" if mode == "input" else "wire"
+        lines.append(f"  {kind} [{width - 1}:0] {name};" if width > 1 else f"  {kind} {name};")
+    lines.append(f"  {top} inst ({', '.join(f'.{name}({name})' for _, name, _ in ports)});")
+    for clock in clocks:
+        lines.append(f"  initial {clock} = 0;")
+        lines.append(f"  always #5 {clock} = ~{clock};")
+    lines.append("  initial begin")
+    for mode, name, width in ports:
+        if mode == "input" and name not in clocks:
+            lines.append(f"    {name} = {1 if name in resets else 0};")
+    for time in range(10, max_sim_time, 10):
+        lines.append("    #10;")
+        for mode, name, width in ports:
+            if mode == "input" and name not in clocks:
+                value = 0 if name in resets else rng.getrandbits(width)
+                lines.append(f"    {name} = {width}'d{value};")
+    lines.append("    $finish;")
+    lines.append("  end")
+    lines.append("endmodule")
+    with open(_option(args, "-out"), "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return 0
+
+
+def iverilog(args):
+    '''
+    "Compile" by bundling the sources into the output file, which is all the vvp stand-in needs
+    '''
+    if "-V" in args:
+        print("Icarus Verilog version 0.0 (benchmark stub)")
+        return 0
+    output = _option(args, "-o", "a.out")
+    sources = [arg for i, arg in enumerate(args) if not arg.startswith("-") and (i == 0 or args[i - 1] not in ["-o", "-t"])]
+    contents = []
+    for source in sources:
+        with open(source, "r") as f:
+            contents.append(f.read())
+    if _option(args, "-t") == "null":
+        return 0
+    with open(output, "w") as f:
+        f.write(json.dumps(contents))
+    return 0
+
+
+def _identifier(index):
+    chars = [chr(c) for c in range(33, 127)]
+    identifier = ""
+    while True:
+        identifier += chars[index % len(chars)]
+        index //= len(chars)
+        if index == 0:
+            return identifier
+
+
+def vvp(args):
+    '''
+    "Simulate" by writing dump.vcd with a toggling clock and seeded random values for the other ports
+    '''
+    if "-V" in args:
+        print("Icarus Verilog runtime version 0.0 (benchmark stub)")
+        return 0
+    with open(args[-1], "r") as f:
+        contents = json.loads(f.read())
+    testbench = next(content for content in contents if _HEADER_REGEX.search(content))
+    top, max_sim_time, clocks, _ = _HEADER_REGEX.search(testbench).groups()
+    clocks = [clock for clock in clocks.split(",") if clock]
+    module = next((content for content in contents if re.search(rf'\bmodule\s+{top}\b', content)), contents[0])
+    ports = _ports(module)
+    rng = random.Random(zlib.crc32(testbench.encode("utf-8")))
+    ids = {}
+    lines = ["$timescale 1ns $end", "$scope module testbench $end"]
+    for scope in ["testbench", "inst"]:
+        if scope == "inst":
+            lines.append("$scope module inst $end")
+        for mode, name, width in ports:
+            sid = _identifier(len(ids))
+            ids[(scope, name)] = (sid, width)
+            lines.append(f"$var wire {width} {sid} {name} $end" if width == 1 else f"$var wire {width} {sid} {name} [{width - 1}:0] $end")
+        if scope == "inst":
+            lines.append("$upscope $end")
+    lines += ["$upscope $end", "$enddefinitions $end", "$dumpvars"]
+    for (scope, name), (sid, width) in ids.items():
+        lines.append(f"x{sid}" if width == 1 else f"bx {sid}")
+    lines.append("$end")
+    values = {name: 0 for _, name, _ in ports}
+    for time in range(0, int(max_sim_time) + 1, 5):
+        lines.append(f"#{time}")
+        for mode, name, width in ports:
+            if name in clocks:
+                values[name] = (time // 5) % 2
+            elif time % 10 == 0:
+                values[name] = rng.getrandbits(width)
+            else:
+                continue
+            for scope in ["testbench", "inst"]:
+                sid, _ = ids[(scope, name)]
+                lines.append(f"{values[name]}{sid}" if width == 1 else f"b{values[name]:b} {sid}")
+    with open("dump.vcd", "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return 0
+
+
+def _png(width, height):
+    '''
+    Create a white png of the given size
+    '''
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+    rows = b"".join(b"\x00" + b"\xff" * width for _ in range(height))
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b""))
+
+
+def wavedrom_cli(args):
+    '''
+    "Render" by writing a blank png sized after the wavedrom json
+    '''
+    if "--version" in args:
+        print("0.0.0-stub")
+        return 0
+    with open(_option(args, "-i"), "r") as f:
+        source = json.load(f)
+    signals = source.get("signal", [])
+    length = max([len(signal.get("wave", "")) for signal in signals if isinstance(signal, dict)] + [1])
+    with open(_option(args, "-p"), "wb") as f:
+        f.write(_png(40 * length, 30 * max(len(signals), 1)))
+    return 0
+
+
+def install(bin_dir, force=False):
+    '''
+    Write wrappers for the tools which are not on PATH, or for all tools with force, into bin_dir
+    Returns a dict telling for every tool whether the real tool or the stand-in is used
+    '''
+    os.makedirs(bin_dir, exist_ok=True)
+    used = {}
+    for tool in TOOLS:
+        if not force and shutil.which(tool) is not None:
+            used[tool] = "real"
+            continue
+        wrapper = os.path.join(bin_dir, tool)
+        with open(wrapper, "w") as f:
+            f.write(f"#!/bin/sh\nexec \"{sys.executable}\" \"{os.path.realpath(__file__)}\" {tool} \"$@\"\n")
+        os.chmod(wrapper, 0o755)
+        used[tool] = "stub"
+    return used
+
+
+if __name__ == "__main__":
+    tool = sys.argv[1]
+    handlers = {"gentbvlog": gentbvlog, "iverilog": iverilog, "vvp": vvp, "wavedrom-cli": wavedrom_cli}
+    sys.exit(handlers[tool](sys.argv[2:]))
@@ -0,0 +1,89 @@
+'''
+Runs all benchmarks and writes their results to a json file, so regressions can be found by comparing the files of two commits
+The file holds the commit, the time, the configuration, the tools used by the pipeline (real or stand-in) and the results of every benchmark
+Every benchmark runs offline, on synthetic inputs generated from a fixed seed
+Run from the repository root: python -m benchmarks.suite --out bench_results.json
+'''
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+from benchmarks import bench_meta
+from benchmarks import bench_parse
+from benchmarks import bench_permutations
+from benchmarks import bench_precheck
+from benchmarks import bench_pipeline
+from benchmarks import bench_render
+from benchmarks import bench_vcd
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.realpath(__file__))).stdout.strip()
+    except Exception as e:
+        return None
+
+
+def run(config):
+    '''
+    Run every benchmark with the configuration and return the results by benchmark name
+    '''
+    results = {}
+    print("Running the pipeline benchmark")
+    results["pipeline"] = bench_pipeline.run(config["modules"], config["max_ports"], config["clocked_ratio"], config["num_processes"],
+                                             config["max_sim_time"], config["max_wavedroms"], config["seed"], config["stubs"])
+    print("Running the parse benchmark")
+    results["parse"] = bench_parse.run(config["modules"], config["num_processes"], config["parse_batch_size"])
+    print("Running the precheck benchmark")
+    results["precheck"] = bench_precheck.run(config["modules"], config["seed"])
+    print("Running the vcd benchmark")
+    results["vcd"] = bench_vcd.run(config["vcd_size"], config["vcd_signals"])
+    print("Running the permutations benchmark")
+    results["permutations"] = bench_permutations.run(config["permutation_ports"], config["max_wavedroms"], config["permutation_repeat"])
+    print("Running the meta data benchmark")
+    results["meta"] = bench_meta.run(config["meta_count"], config["max_wavedroms"], config["seed"])
+    print("Running the render benchmark")
+    results["render"] = bench_render.run(config["render_count"], config["seed"])
+    return results
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Run all benchmarks and store their results in a json file")
+    parser.add_argument("--out", help="File the results are written to", default="bench_results.json")
+    parser.add_argument("--modules", help="Number of synthetic modules for the pipeline, parse and precheck benchmarks", type=int, default=200)
+    parser.add_argument("--max_ports", help="Maximum number of ports of the synthetic modules, clk and rst included", type=int, default=6)
+    parser.add_argument("--clocked_ratio", help="Fraction of the synthetic modules with a clock and reset", type=float, default=0.5)
+    parser.add_argument("--num_processes", help="Number of processes", type=int, default=max(os.cpu_count() - 1, 1))
+    parser.add_argument("--parse_batch_size", help="Number of modules per batch in the parse benchmark", type=int, default=256)
+    parser.add_argument("--max_sim_time", help="Maximum simulation time for testbenches in ns", type=int, default=100)
+    parser.add_argument("--max_wavedroms", help="Maximum number of wavedroms per module", type=int, default=8)
+    parser.add_argument("--vcd_size", help="Size of the synthetic VCD file in MB", type=int, default=50)
+    parser.add_argument("--vcd_signals", help="Number of signals in the synthetic VCD file", type=int, default=64)
+    parser.add_argument("--permutation_ports", help="Largest number of ports in the permutations benchmark", type=int, default=12)
+    parser.add_argument("--permutation_repeat", help="Number of calls per number of ports in the permutations benchmark", type=int, default=20)
+    parser.add_argument("--meta_count", help="Number of meta.json files in the meta data benchmark", type=int, default=2000)
+    parser.add_argument("--render_count", help="Number of wavedrom jsons in the render benchmark", type=int, default=100)
+    parser.add_argument("--seed", help="Seed of the synthetic inputs", type=int, default=0)
+    parser.add_argument("--stubs", help="Use the stand-ins even for the tools that are installed", action="store_true")
+    args = parser.parse_args()
+
+    config = {key: value for key, value in vars(args).items() if key != "out"}
+    results = run(config)
+    report = {
+        "commit": _commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "config": config,
+        "tools": results["pipeline"].pop("tools"),
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main_bench()
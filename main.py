@@ -4,16 +4,25 @@ import concurrent.futures
 import scripts.generate_wavedroms
 import scripts.meta_data as meta_data
 import shutil
-import re
-import threading
 import argparse
-import glob
+import time
 import scripts.meta_data
 import scripts.simulate
 import scripts.tb_gen
-from scripts.simulate import compile, run_simulation
+import scripts.precheck
 import scripts.generate_wavedroms
 import scripts.counter
+import scripts.catalog
+import scripts.scheduler
+import scripts.renderer
+import scripts.concurrency
+import scripts.shard
+import scripts.export
+import scripts.storage
+import scripts.telemetry
+import scripts.report
+from scripts import verilog_lexer
+from scripts import dedup
 
 FOLDER = os.path.dirname(os.path.realpath(__file__)) + "/data"
 MAX_PROCESSES = os.cpu_count() - 2 if os.cpu_count() > 2 else 1
@@ -23,39 +32,94 @@ DATASETS = ["wangxinze/Verilog_data", "shailja/Verilog_Github"]
 
 DEBUG = False
 
-# used to limit access to the tb_gen script which uses subprocess to run gentbvlog
-# too many processes can cause the system to hang
-TB_GEN_SEMAPHORE = threading.Semaphore((MAX_PROCESSES/2) - 1)
-SIM_SEMAPHORE = threading.Semaphore(MAX_PROCESSES - 1)
+# stream the datasets instead of downloading and loading them fully before parsing
+STREAMING = True
+# number of modules sent to a worker process at once while parsing the datasets
+PARSE_BATCH_SIZE = 256
+# number of batches that are allowed to be in flight per process while parsing the datasets
+MAX_IN_FLIGHT_PER_PROCESS = 2
+
+# remove the comments from the code of the modules before they are stored, by default module.v keeps the code as it was found
+STRIP_COMMENTS = False
+
+# drop modules which are already in the dataset, based on a hash of their normalized code
+DEDUP = True
+# path of the persistent dedup index, defaults to a file next to FOLDER
+DEDUP_INDEX = None
+
+# layout of the module folders of new datasets, see scripts.storage, None uses the default layout
+LAYOUT = None
+# storage of the dataset in FOLDER, opened on first use
+STORAGE = None
+
+# (i, N) to only process the modules of shard i out of N, see scripts.shard, None processes all modules
+SHARD = None
+
+# folder the finished modules are exported to as Parquet files, defaults to a folder next to FOLDER, see scripts.export
+EXPORT_DIR = None
+# size of the exported Parquet files in MB
+EXPORT_SHARD_SIZE = 256
+
+# adjust the number of external tools running at once to the load of the machine, see scripts.concurrency
+ADAPTIVE_CONCURRENCY = True
+# ceilings for the resource classes which replace the defaults of _resource_limits
+MAX_CONCURRENCY = {}
+
+# cache of rendered waveform images which survives recreating the dataset, defaults to a folder next to FOLDER
+RENDER_CACHE = None
+# maximum size of the render cache in MB, 0 disables the cache
+RENDER_CACHE_SIZE = 1024
+# cache of compiled testbenches and simulation outputs which survives recreating the dataset, defaults to a folder next to FOLDER
+SIM_CACHE = None
+# maximum size of the simulation cache in MB, 0 disables the cache
+SIM_CACHE_SIZE = 4096
+
+
+def _resource_limits():
+    '''
+    Maximum number of pipeline steps of every resource class that can run at once
+    With ADAPTIVE_CONCURRENCY these are the ceilings, the classes running external tools start lower and follow the load of the machine
+    '''
+    limits = {
+        # too many gentbvlog processes can cause the system to hang
+        "tbgen": max(MAX_PROCESSES // 2 - 1, 1),
+        # every simulation runs in its own scratch workspace, so they can use all cores
+        "sim": MAX_PROCESSES,
+        "parse": MAX_PROCESSES,
+        "render": MAX_PROCESSES,
+    }
+    limits.update(MAX_CONCURRENCY)
+    return limits
+
+
+def _parse_concurrency(value):
+    '''
+    Parse the --max_concurrency argument, a comma separated list of class=limit
+    '''
+    limits = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        resource, _, limit = item.partition("=")
+        if resource.strip() not in ["tbgen", "sim", "parse", "render"] or not limit.strip().isdigit() or int(limit) < 1:
+            raise argparse.ArgumentTypeError(f"invalid concurrency limit: {item}")
+        limits[resource.strip()] = int(limit)
+    return limits
 
 def remove_comments(code):
     '''
     Remove comments from the code
     This makes parsing and splitting the code into individual modules easier
     '''
-    # remove block comments
-    regex=r'/\*.*?\*/'
-    matches = re.findall(regex, code, re.DOTALL)
-    for match in matches:
-        code = code.replace(match, '')
-    # remove line comments
-    regex=r'//.*$'
-    code = re.sub(regex, '', code, flags=re.MULTILINE)
-    return code
+    return verilog_lexer.strip_comments(code)
 
 
 def split_modules(code):
     '''
     Split the code into individual modules
+    Comments are only removed from the modules with STRIP_COMMENTS, the modules are generated one by one
     '''
-    code = remove_comments(code)
-    code = code.split("endmodule")
-    modules = []
-    for c in code:
-        modules.append(c + "endmodule")
-    # remove last module, this only contains the endmodule keyword
-    modules = modules[:-1]
-    return modules
+    return verilog_lexer.iter_modules(code, strip_comments=STRIP_COMMENTS)
 
 def parse_verilog_module(id, data):
     '''
@@ -65,22 +129,76 @@ def parse_verilog_module(id, data):
     meta = meta_data.MetaData()
     if meta.analyze_code(data) is not None:
         if len(meta.meta["ports"]) <= MAX_PORTS:
-            os.makedirs(f"{FOLDER}/ds_{id}")
-            meta.store(f"{FOLDER}/ds_{id}")
-            # write the code to a file
-            with open(f"{FOLDER}/ds_{id}/module.v", "w") as f:
-                f.write(meta.meta["code"])
+            store_verilog_module(id, meta.meta)
             return True
     return False
 
+
+def parse_verilog_modules(batch):
+    '''
+    Parse a batch of (id, digest, code) tuples
+    Used by the concurrent.futures.ProcessPoolExecutor for multiprocessing, the workers should be initialized with meta_data.init_worker
+    Returns the number of modules in the batch and a list of (id, digest, meta) tuples for the modules which can be used in the dataset
+    The modules are not stored, this is left to the parent process with store_verilog_module
+    '''
+    results = []
+    for id, digest, code in batch:
+        meta = meta_data.MetaData()
+        try:
+            if meta.analyze_code(code) is None:
+                continue
+        except Exception as e:
+            continue
+        if len(meta.meta["ports"]) <= MAX_PORTS:
+            results.append((id, digest, meta.meta))
+    return len(batch), results
+
+
+def store_verilog_module(id, meta):
+    '''
+    Store the meta data and the code of a parsed module in its own folder
+    '''
+    folder = get_storage().create_module(id)
+    meta_data.MetaData.from_dict(meta).store(folder)
+    # write the code to a file
+    with open(os.path.join(folder, "module.v"), "w") as f:
+        f.write(meta["code"])
+
+def migrate_modules(batch):
+    '''
+    Convert the meta.json of a batch of (id, folder) tuples to the current format
+    Used by the concurrent.futures.ProcessPoolExecutor for multiprocessing, the workers should be initialized with meta_data.init_worker
+    Returns the number of modules in the batch and the ids of the modules that could not be converted
+    '''
+    failed = []
+    for id, folder in batch:
+        try:
+            if not meta_data.migrate(folder):
+                failed.append(id)
+        except Exception as e:
+            failed.append(id)
+    return len(batch), failed
+
+
+def precheck_module(folder):
+    '''
+    Check that the module can be compiled on its own, so no testbench is generated for a module that can not be simulated
+    Used as a step of the pipeline, the reason a module is rejected is recorded in the catalog
+    '''
+    reason = scripts.precheck.precheck(folder)
+    if reason is not None:
+        if not DEBUG:
+            shutil.rmtree(folder)
+        raise ValueError(reason)
+    return True
+
+
 def generate_testbench(folder):
     '''
     Generate a testbench for the module
-    Used by the concurrent.futures.ThreadPoolExecutor for multithreading
+    Used as a step of the pipeline
     '''
-    TB_GEN_SEMAPHORE.acquire()
     success = scripts.tb_gen.generate_testbench(folder)
-    TB_GEN_SEMAPHORE.release()
     if not success:
         if not DEBUG:
             shutil.rmtree(folder)
@@ -91,26 +209,16 @@ def generate_testbench(folder):
 def perform_simulation(folder):
     '''
     Perform a simulation on the module
-    Used by the concurrent.futures.ThreadPoolExecutor for multithreading
+    Used as a step of the pipeline, whether iverilog or vvp failed is recorded in the catalog as the reason
     '''
-    SIM_SEMAPHORE.acquire()
     try:
-        success = compile(folder)
-    except Exception as e:
-        SIM_SEMAPHORE.release()
-        return False
-    SIM_SEMAPHORE.release()
-    if not success:
+        success = scripts.simulate.simulate(folder)
+    except scripts.simulate.SimulationError as e:
         if not DEBUG:
             shutil.rmtree(folder)
-        return False
-    SIM_SEMAPHORE.acquire()
-    try:
-        success = run_simulation(folder)
+        raise
     except Exception as e:
-        SIM_SEMAPHORE.release()
         return False
-    SIM_SEMAPHORE.release()
     if not success:
         if not DEBUG:
             shutil.rmtree(folder)
@@ -130,73 +238,369 @@ def generate_waveform(folder):
     return True
 
 
-def gather_verilog_data():
-    if os.path.exists(FOLDER):
-        shutil.rmtree(FOLDER, ignore_errors=True)
-    print(f"Creating directory {FOLDER}")
-    os.makedirs(FOLDER)
-    id = 0
-    futures = []
+def _iter_dataset_code():
+    '''
+    Iterate over the verilog code of all datasets in DATASETS
+    When STREAMING is set, the datasets are streamed instead of being downloaded and loaded fully
+    '''
     for dataset in DATASETS:
-        i = 0
         print(f"Loading dataset {dataset}")
-        ds = load_dataset(dataset, num_proc=MAX_PROCESSES)
+        if STREAMING:
+            ds = load_dataset(dataset, split="train", streaming=True)
+        else:
+            ds = load_dataset(dataset, split="train", num_proc=MAX_PROCESSES)
         print(f"Dataset {dataset} loaded")
         print(f"Parsing dataset {dataset} using {MAX_PROCESSES} processes")
-        executor = concurrent.futures.ProcessPoolExecutor(max_workers=MAX_PROCESSES-1)
-        for data in ds['train']:
-            i += 1
+        for data in ds:
             # datasets put their code under various names
-            code = data if type(data) == str else data['text'] if 'text' in data else data['module_content']
-            # the MetaData class only supports one module at a time for now
-            if code.count("endmodule") > 1:
-                modules = split_modules(code)
-            else:
-                modules = [code]
-            for m in modules:
-                futures.append(executor.submit(parse_verilog_module, id, m))
-                id += 1
-                if id % 1000 == 0:
-                    print(f"Submitted a total of {id} modules to the pool", end="\r")
-    print("")
+            yield data if type(data) == str else data['text'] if 'text' in data else data['module_content']
+
+
+def _dedup_index_path():
+    '''
+    Path of the persistent dedup index, kept next to the dataset folder so it survives recreating the folder
+    '''
+    if DEDUP_INDEX is not None:
+        return DEDUP_INDEX
+    return os.path.realpath(FOLDER) + "_dedup.txt"
+
+
+def _render_cache_path():
+    '''
+    Path of the render cache, kept next to the dataset folder so it survives recreating the folder
+    '''
+    if RENDER_CACHE is not None:
+        return RENDER_CACHE
+    return os.path.realpath(FOLDER) + "_render_cache"
+
+
+def _sim_cache_path():
+    '''
+    Path of the simulation cache, kept next to the dataset folder so it survives recreating the folder
+    '''
+    if SIM_CACHE is not None:
+        return SIM_CACHE
+    return os.path.realpath(FOLDER) + "_sim_cache"
+
+
+def gather_verilog_data(append=False, sources=None):
+    '''
+    Create the dataset from the verilog code in DATASETS, or from the iterable of verilog code in sources when given
+    Unless append is set, the old dataset and its dedup index are removed first
+    When appending, modules which are already in the dataset are dropped by the dedup index
+    A digest is added to the dedup index once its module is stored, so modules which fail to parse or have too many ports are tried again by a later run
+    Duplicates within the run are dropped as soon as the first copy is submitted
+    With SHARD only the modules belonging to the shard are added, the folder should not hold the modules of another shard
+    '''
+    scripts.shard.check_folder(FOLDER, SHARD)
+    if not append:
+        if os.path.exists(FOLDER):
+            shutil.rmtree(FOLDER, ignore_errors=True)
+        if os.path.exists(_dedup_index_path()):
+            os.remove(_dedup_index_path())
+        scripts.catalog.remove_catalog(FOLDER)
+    global STORAGE
+    catalog = scripts.catalog.open_catalog(FOLDER)
+    if not os.path.exists(FOLDER):
+        print(f"Creating directory {FOLDER}")
+        os.makedirs(FOLDER)
+    STORAGE = catalog.storage(LAYOUT)
+    print(f"Using the {STORAGE.layout} layout")
+    # a new dataset only gets meta.json files in the current format
+    if catalog.next_id() == 0:
+        catalog.set_setting("meta_format", meta_data.META_FORMAT)
+        # the shard the folder belongs to, see scripts.shard.check_folder
+        catalog.set_setting("shard", scripts.shard.format_shard(SHARD))
+    id = catalog.next_id()
+    submitted = 0
+    duplicates = 0
     success = 0
     i = 0
-    for future in concurrent.futures.as_completed(futures):
-        if future.result():
-            success += 1
-        i += 1
-        if i % 1000 == 0:
-            print(f"Completed {i}/{len(futures)} files, success rate: {success}/{i}", end="\r")
-    print(f"Completed {i}/{len(futures)} files, success rate: {success}/{i}")
+    # modules are sent to the workers in batches and only a bounded number of batches is kept in flight at once
+    # this keeps memory flat, no matter how large the datasets are
+    max_in_flight = MAX_IN_FLIGHT_PER_PROCESS * MAX_PROCESSES
+    pending = set()
+    batch = []
+
+    def collect(done):
+        nonlocal success, i
+        for future in done:
+            count, results = future.result()
+            for module_id, digest, meta in results:
+                store_verilog_module(module_id, meta)
+                catalog.add_module(module_id, meta["module_name"], digest)
+                if dedup_index is not None:
+                    dedup_index.add(digest)
+            success += len(results)
+            i += count
+            print(f"Completed {i}/{submitted} files, success rate: {success}/{i}, duplicates dropped: {duplicates}", end="\r")
+
+    def submit(executor):
+        nonlocal pending, batch
+        if len(pending) >= max_in_flight:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            collect(done)
+        pending.add(executor.submit(parse_verilog_modules, batch))
+        batch = []
+
+    dedup_index = dedup.DedupIndex(_dedup_index_path()) if DEDUP else None
+    # digests of the modules submitted in this run, they only reach the dedup index after they are stored
+    submitted_digests = set()
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max(MAX_PROCESSES-1, 1), initializer=meta_data.init_worker) as executor:
+            for code in sources if sources is not None else _iter_dataset_code():
+                # the MetaData class only supports one module at a time for now
+                for m in split_modules(code):
+                    digest = dedup.module_digest(m)
+                    if not scripts.shard.in_shard(digest, None, SHARD):
+                        continue
+                    # drop duplicates before they reach any of the expensive stages
+                    if dedup_index is not None:
+                        if digest in submitted_digests or digest in dedup_index:
+                            duplicates += 1
+                            continue
+                        submitted_digests.add(digest)
+                    batch.append((id, digest, m))
+                    id += 1
+                    submitted += 1
+                    if len(batch) >= PARSE_BATCH_SIZE:
+                        submit(executor)
+            if len(batch) > 0:
+                submit(executor)
+            collect(concurrent.futures.as_completed(pending))
+    finally:
+        if dedup_index is not None:
+            dedup_index.close()
+        catalog.close()
+    print(f"Completed {i}/{submitted} files, success rate: {success}/{i}, duplicates dropped: {duplicates}")
     print("Dataset created")
 
-def generate_testbenches():
-    total = 0
-    executor = concurrent.futures.ThreadPoolExecutor(max_workers=2*MAX_PROCESSES)
-    futures = []
-    i = 0
-    for folder in os.listdir(FOLDER):
-        # only add directories which dont have a tb.v file and don't have an error file
-        if os.path.exists(f"{FOLDER}/{folder}/tb.v") or os.path.exists(f"{FOLDER}/{folder}/gentbvlog_err.txt") or os.path.exists(f"{FOLDER}/{folder}/meta_load_err.txt"):
-            continue
+def get_storage():
+    '''
+    Get the storage of the dataset, which follows the layout stored in its catalog
+    '''
+    global STORAGE
+    if STORAGE is None or STORAGE.root != FOLDER:
+        with scripts.catalog.open_catalog(FOLDER) as catalog:
+            STORAGE = catalog.storage(LAYOUT)
+    return STORAGE
 
-        futures.append(executor.submit(generate_testbench, f"{FOLDER}/{folder}"))
-        i += 1
-        total += 1
-        if i % 1000 == 0:
-            print(f"Submitted {i} testbench generations to the pool", end="\r")
-    print("")
-    success = 0
-    i = 0
-    print("Waiting for testbenches to be generated")
+
+def migrate_dataset():
+    '''
+    Convert the meta.json files of the modules to the current format, see scripts.meta_data.migrate
+    This is done once per dataset, the catalog remembers the format of the dataset
+    Modules whose meta.json can not be converted are marked as failed
+    '''
+    with scripts.catalog.open_catalog(FOLDER) as catalog:
+        if catalog.get_setting("meta_format") == meta_data.META_FORMAT:
+            return
+        print(f"Converting the meta.json files to format {meta_data.META_FORMAT}")
+        max_in_flight = MAX_IN_FLIGHT_PER_PROCESS * MAX_PROCESSES
+        pending = set()
+        batch = []
+        done_count = 0
+        failed_count = 0
+
+        def collect(done):
+            nonlocal done_count, failed_count
+            for future in done:
+                count, failed = future.result()
+                for id in failed:
+                    catalog.record(id, "create", False, "meta.json could not be migrated")
+                done_count += count
+                failed_count += len(failed)
+            print(f"Converted {done_count} modules, {failed_count} failed", end="\r")
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=MAX_PROCESSES, initializer=meta_data.init_worker) as executor:
+            for module in catalog.iter_modules():
+                if module["status"] != "ok":
+                    continue
+                batch.append((module["id"], module_folder(module["id"])))
+                if len(batch) >= PARSE_BATCH_SIZE:
+                    if len(pending) >= max_in_flight:
+                        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                        collect(done)
+                    pending.add(executor.submit(migrate_modules, batch))
+                    batch = []
+            if batch:
+                pending.add(executor.submit(migrate_modules, batch))
+            collect(concurrent.futures.as_completed(pending))
+        print(f"Converted {done_count} modules, {failed_count} failed")
+        catalog.set_setting("meta_format", meta_data.META_FORMAT)
+
+
+def module_folder(id):
+    '''
+    Get the folder of the module with the given id
+    '''
+    return get_storage().module_folder(id)
+
+
+def _timed(func, folder, *args):
+    '''
+    Run a step of the pipeline on the folder and measure it
+    Returns whether it succeeded, the reason if it did not, the start time, the duration in seconds, the usage, see scripts.telemetry,
+    and what the step returned, see scripts.scheduler.Step
+    '''
+    started = time.time()
+    reason = None
+    size = scripts.telemetry.folder_size(folder)
+    scripts.telemetry.begin()
+    value = None
+    try:
+        value = func(folder, *args)
+        success = bool(value)
+        if not success:
+            reason = f"{func.__name__} failed"
+    except Exception as e:
+        success = False
+        reason = str(e)
+    seconds = time.time() - started
+    usage = scripts.telemetry.end()
+    # failed modules can be removed, they did not leave anything behind
+    usage["bytes_written"] = max(scripts.telemetry.folder_size(folder) - size, 0)
+    return success, reason, started, seconds, usage, value
+
+
+def stage_fingerprints():
+    '''
+    Fingerprints of the parameters of the stages, a module which completed a stage with other parameters is redone from that stage
+    '''
+    return {
+        "tbgen": scripts.tb_gen.fingerprint(),
+        "sim": scripts.simulate.fingerprint(),
+        "wfgen": scripts.generate_wavedroms.fingerprint(),
+    }
+
+
+# the steps every module goes through after it was created
+# the python parsing of the simulation output and the rendering of the images are separate steps,
+# so both get their own limit and can overlap with the external tools of other modules
+PIPELINE = [
+    scripts.scheduler.Step("precheck", precheck_module, "sim"),
+    scripts.scheduler.Step("tbgen", generate_testbench, "tbgen"),
+    scripts.scheduler.Step("sim", scripts.simulate.instrument_testbench, "sim"),
+    scripts.scheduler.Step("sim", perform_simulation, "sim"),
+    scripts.scheduler.Step("wfgen", scripts.generate_wavedroms.extract_wavedroms, "parse"),
+    scripts.scheduler.Step("wfgen", scripts.generate_wavedroms.render_wavedroms, "render", pass_result=True),
+]
+
+
+def run_pipeline(first="precheck", last="wfgen"):
+    '''
+    Move the modules through the stages from first up to and including last
+    Every module continues where it left off, a module starts with the stage after the last one it completed,
+    or with the first stage it completed with other parameters, see stage_fingerprints
+    A module moves on to its next step as soon as its previous step finished, there is no waiting for the other modules
+    '''
+    stages = scripts.catalog.STAGES
+    steps = [step for step in PIPELINE if stages.index(first) <= stages.index(step.stage) <= stages.index(last)]
+    first_step = {}
+    for i, step in reversed(list(enumerate(steps))):
+        first_step[step.stage] = i
+    migrate_dataset()
+    limits = _resource_limits()
+    controller = None
+    if ADAPTIVE_CONCURRENCY:
+        controller = scripts.concurrency.AdaptiveLimits(limits)
+        print(f"Running stages {first} to {last} with ceilings {limits}, starting at {controller.limits}")
+    else:
+        print(f"Running stages {first} to {last} with limits {limits}")
+
+    fingerprints = stage_fingerprints()
+    with scripts.catalog.open_catalog(FOLDER) as catalog:
+        # a stage can consist of multiple steps, their timings are combined until the stage is done
+        timings = {}
+        stats = {stage: [0, 0] for stage in first_step}
+        finished_modules = 0
+
+        def modules():
+            for id, stage in catalog.iter_ready(first, last, shard=SHARD, fingerprints=fingerprints):
+                yield id, module_folder(id), first_step[stages[stages.index(stage) + 1]]
+
+        def on_step_done(id, step, result, finished):
+            nonlocal finished_modules
+            success, reason, started, seconds, usage, _ = result
+            catalog.record_telemetry(id, step.stage, step.func.__name__, success, started, seconds, usage)
+            stage_started, stage_seconds = timings.pop(id, (started, 0))
+            stage_seconds += seconds
+            if not finished and steps[steps.index(step) + 1].stage == step.stage:
+                timings[id] = (stage_started, stage_seconds)
+                return
+            catalog.record(id, step.stage, success, reason, stage_started, stage_seconds, fingerprints.get(step.stage))
+            stats[step.stage][1] += 1
+            if success:
+                stats[step.stage][0] += 1
+            if finished:
+                finished_modules += 1
+                if finished_modules % 10 == 0:
+                    progress = ", ".join(f"{stage}: {ok}/{total}" for stage, (ok, total) in stats.items())
+                    print(f"Finished {finished_modules} modules, success rate per stage: {progress}", end="\r")
+
+        # the python renderer does its work in the python process, so it needs processes to run in parallel
+        process_resources = ["parse", "render"] if scripts.generate_wavedroms.RENDERER == "python" else ["parse"]
+        pipeline = scripts.scheduler.Scheduler(steps, limits, _timed, process_resources=process_resources, controller=controller)
+        pipeline.run(modules(), on_step_done)
+    progress = ", ".join(f"{stage}: {ok}/{total}" for stage, (ok, total) in stats.items())
+    print(f"Finished {finished_modules} modules, success rate per stage: {progress}")
+    sim_cache = scripts.simulate.get_sim_cache()
+    if sim_cache is not None:
+        print(f"Simulation cache: {sim_cache.stats()}")
+    render_cache = scripts.generate_wavedroms.get_render_cache()
+    # the render steps of the python renderer run in other processes, which keep their own counters
+    if render_cache is not None and "render" not in process_resources:
+        print(f"Render cache: {render_cache.stats()}")
+
+
+def _export_dir():
+    '''
+    Path of the folder the dataset is exported to
+    '''
+    if EXPORT_DIR is not None:
+        return EXPORT_DIR
+    return os.path.realpath(FOLDER) + "_export"
+
+
+def export_dataset():
+    '''
+    Export the modules which completed wfgen and were not exported yet to Parquet files
+    '''
+    out = _export_dir()
+    print(f"Exporting the dataset to {out}")
+    exported = 0
+    failed = 0
+    with scripts.catalog.open_catalog(FOLDER) as catalog:
+        def modules():
+            for id, stage in catalog.iter_ready("export", "export", shard=SHARD):
+                yield id, module_folder(id)
+
+        def on_done(id, success, reason, started, seconds):
+            nonlocal exported, failed
+            catalog.record(id, "export", success, reason, started, seconds)
+            if success:
+                exported += 1
+            else:
+                failed += 1
+
+        shards = scripts.export.export(modules(), out, EXPORT_SHARD_SIZE * 1024 * 1024, MAX_PROCESSES, on_done)
+    print(f"Exported {exported} modules into {shards} files, {failed} modules failed")
+
+
+def precheck_modules():
+    '''
+    Check the modules which were not checked yet
+    '''
+    run_pipeline("precheck", "precheck")
+    print("Modules checked")
+
+
+def generate_testbenches():
+    '''
+    Generate testbenches for the modules which do not have one yet
+    '''
     print("This uses the gentbvlog command, which can be slow. Depending on the number of modules, this can take a while")
-    for future in concurrent.futures.as_completed(futures):
-        if future.result():
-            success += 1
-        i += 1
-        if i % 10 == 0:
-            print(f"Completed {i}/{total} testbench generations, success rate: {success}/{i}", end="\r")
-    print(f"Completed {i}/{total} testbench generations, success rate: {success}/{i}")
+    run_pipeline("tbgen", "tbgen")
     print("Testbenches generated")
 
 
@@ -204,28 +608,7 @@ def perform_simulations():
     '''
     Perform simulations on the testbenches
     '''
-    total = len([folder for folder in os.listdir(FOLDER)])
-    print(f"Performing simulations on {total} modules using {MAX_PROCESSES} threads")
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_PROCESSES) as executor:
-        futures = []
-        for i, folder in enumerate(os.listdir(FOLDER), 1):
-            futures.append(executor.submit(perform_simulation, f"{FOLDER}/{folder}"))
-            i += 1
-            if i % 10 == 0:
-                print(f"Submitted {i} simulations to the pool", end="\r")
-        print("")
-        success = 0
-        print("Waiting for simulations to complete")
-        for i, future in enumerate(concurrent.futures.as_completed(futures), 1):
-            try:
-                if future.result():
-                    success += 1
-            except Exception as e:
-                pass
-            if i % 10 == 0:
-                print(f"Completed {i}/{total} simulations, success rate: {success}/{i}", end="\r")
-    print(f"Completed {i}/{total} simulations, success rate: {success}/{i}")
+    run_pipeline("sim", "sim")
     print("Simulations completed")
 
 
@@ -233,30 +616,7 @@ def generate_waveforms():
     '''
     Generate waveforms for the simulations
     '''
-    total = 0
-    for folder in os.listdir(FOLDER):
-        total += 1
-    print(f"Generating waveforms for {total} modules using {MAX_PROCESSES} threads")
-    executor = concurrent.futures.ThreadPoolExecutor(max_workers=2*MAX_PROCESSES)
-    futures = []
-    i = 0
-    for folder in os.listdir(FOLDER):
-        if os.path.exists(f"{FOLDER}/{folder}/img") and len(glob.glob(f"{FOLDER}/{folder}/img/*.png")) > 0: # skip if waveforms already exist
-            continue
-        futures.append(executor.submit(scripts.generate_wavedroms.generate_wavedrom, os.path.join(FOLDER, folder)))
-        i += 1
-        if i % 1000 == 0:
-            print(f"Submitted {i} waveform generations to the pool", end="\r")
-    print("")
-    success = 0
-    i = 0
-    for future in concurrent.futures.as_completed(futures):
-        if future.result():
-            success += 1
-        i += 1
-        if i % 10 == 0:
-            print(f"Completed {i}/{total} waveform generations, success rate: {success}/{i}", end="\r")
-    print(f"Completed {i}/{total} waveform generations, success rate: {success}/{i}")
+    run_pipeline("wfgen", "wfgen")
     print("Waveforms generated")
 
 
@@ -267,20 +627,57 @@ def main():
     global FOLDER
     global MAX_PROCESSES
     global MAX_PORTS
+    global STREAMING
+    global PARSE_BATCH_SIZE
+    global DEDUP
+    global STRIP_COMMENTS
+    global DEDUP_INDEX
+    global SHARD
+    global LAYOUT
+    global EXPORT_DIR
+    global EXPORT_SHARD_SIZE
+    global ADAPTIVE_CONCURRENCY
+    global MAX_CONCURRENCY
+    global RENDER_CACHE
+    global RENDER_CACHE_SIZE
+    global SIM_CACHE
+    global SIM_CACHE_SIZE
     print("Parsing arguments")
     parser = argparse.ArgumentParser(description="Gathers data to form the dataset")
     parser.add_argument("--folder", help="Folder to store the dataset in", default=FOLDER)
     parser.add_argument("--start-at", help="""
                         Starting point for the data gathering
-                        create = Creates a new dataset from scratch, gathers verilog from sources and stores them alongside some basic information. (deletes the old one if present)
-                        tbgen = Generate the testbenches. Generates testbenches for the verilog files in the dataset. If interrupted, will try to start where previously left off
+                        create = Creates a new dataset from scratch, gathers verilog from sources and stores them alongside some basic information. (deletes the old one if present, unless --append is given)
+                        precheck = Check that the modules can be compiled on their own, using a quick scan of the code and iverilog, so no testbenches are generated for modules which can not be simulated. If interrupted, will try to start where previously left off
+                        tbgen = Generate the testbenches. Generates testbenches for the verilog files in the dataset, modules which were not prechecked yet skip the precheck. If interrupted, will try to start where previously left off
                         sim = Run the testbenches. Runs the testbenches to get the output waveforms. If interrupted, will try to start where previously left off
                         wfgen = Generate waveforms. If interrupted, will try to start where previously left off
-                        """, default="tbgen")
+                        export = Export the finished modules which were not exported yet to Parquet files (unless --no-export is given)
+                        The stages after the starting point run as a pipeline, every module moves on to its next stage as soon as it finished the previous one
+                        """, default="precheck")
     parser.add_argument("--num_processes", help="Number of processes to use for data gathering", default=MAX_PROCESSES)
     parser.add_argument("--max_ports", help="Only use modules with less than or equal to this number of ports", default=MAX_PORTS)
+    parser.add_argument("--parse_batch_size", help="Number of modules sent to a worker process at once while creating the dataset", default=PARSE_BATCH_SIZE)
+    parser.add_argument("--no-streaming", help="Download and load each dataset fully instead of streaming it", action="store_true")
+    parser.add_argument("--append", help="Add modules to the existing dataset when creating it, instead of starting from scratch", action="store_true")
+    parser.add_argument("--no-dedup", help="Keep duplicate modules when creating the dataset", action="store_true")
+    parser.add_argument("--strip-comments", help="Remove the comments from the code of the modules when creating the dataset", action="store_true")
+    parser.add_argument("--dedup_index", help="File used to store the hashes of the modules in the dataset, defaults to a file next to the dataset folder", default=DEDUP_INDEX)
+    parser.add_argument("--renderer", help="Backend used to render the waveform images: server keeps wavedrom renderers running, cli starts wavedrom-cli for every image, python renders in process (needs cairosvg)", choices=["server", "cli", "python"], default=scripts.generate_wavedroms.RENDERER)
+    parser.add_argument("--layout", help="Layout of the module folders: flat puts all of them directly in the dataset folder, fanout spreads them over two levels of subfolders. Only used for new datasets, existing datasets keep their layout", choices=scripts.storage.LAYOUTS, default=LAYOUT)
+    parser.add_argument("--shard", help="Only process shard i out of N, given as i/N. Modules are assigned to the shards by a hash of their content, in every stage. Every shard needs its own --folder", default=None)
+    parser.add_argument("--merge", help="Merge the dataset folders of shards into the dataset folder, renumbering their modules", nargs="+", metavar="SHARD_FOLDER", default=None)
+    parser.add_argument("--export_dir", help="Folder the finished modules are exported to as Parquet files, defaults to a folder next to the dataset folder", default=EXPORT_DIR)
+    parser.add_argument("--export_shard_size", help="Size of the exported Parquet files in MB", default=EXPORT_SHARD_SIZE)
+    parser.add_argument("--no-export", help="Do not export the dataset to Parquet files after the waveforms are generated", action="store_true")
+    parser.add_argument("--max_concurrency", help="Ceilings for the number of steps running at once per class, e.g. tbgen=4,sim=16 (classes: tbgen, sim, parse, render)", type=_parse_concurrency, default={})
+    parser.add_argument("--fixed-concurrency", help="Always run the external tools at their ceilings instead of adapting to the load of the machine", action="store_true")
+    parser.add_argument("--render_cache", help="Folder used to cache the rendered waveform images across runs, defaults to a folder next to the dataset folder", default=RENDER_CACHE)
+    parser.add_argument("--render_cache_size", help="Maximum size of the render cache in MB, 0 disables the cache", default=RENDER_CACHE_SIZE)
+    parser.add_argument("--sim_cache", help="Folder used to cache the compiled testbenches and simulation outputs across runs, defaults to a folder next to the dataset folder", default=SIM_CACHE)
+    parser.add_argument("--sim_cache_size", help="Maximum size of the simulation cache in MB, 0 disables the cache", default=SIM_CACHE_SIZE)
     parser.add_argument("--max_sim_time", help="Maximum simulation time for testbenches in ns", default=100)
-    parser.add_argument("count", help="Gives details on the total amount of data available in the dataset", nargs="?", default=False)
+    parser.add_argument("command", help="count = gives details on the total amount of data available in the dataset, report = prints the time and resources used per stage and the slowest modules, migrate = converts the meta.json files of an older dataset to the current format (also done before running the pipeline)", nargs="?", choices=["count", "report", "migrate"], default=None)
     parser.add_argument("-D", "--debug", help="Enable debug mode", action="store_true")
 
     args = parser.parse_args()
@@ -290,41 +687,79 @@ def main():
     print(f"Folder: {FOLDER}")
     MAX_PROCESSES = int(args.num_processes)
     MAX_PORTS = int(args.max_ports)
+    STREAMING = not args.no_streaming
+    PARSE_BATCH_SIZE = int(args.parse_batch_size)
+    DEDUP = not args.no_dedup
+    STRIP_COMMENTS = args.strip_comments
+    DEDUP_INDEX = args.dedup_index
     
     max_sim_time = int(args.max_sim_time)
+    if args.shard is not None:
+        try:
+            SHARD = scripts.shard.parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+    LAYOUT = args.layout
+    EXPORT_DIR = args.export_dir
+    EXPORT_SHARD_SIZE = int(args.export_shard_size)
+    ADAPTIVE_CONCURRENCY = not args.fixed_concurrency
+    MAX_CONCURRENCY = args.max_concurrency
+    scripts.generate_wavedroms.RENDERER = args.renderer
+    scripts.generate_wavedroms.RENDER_WORKERS = _resource_limits()["render"]
+    RENDER_CACHE = args.render_cache
+    RENDER_CACHE_SIZE = int(args.render_cache_size)
+    if RENDER_CACHE_SIZE > 0:
+        scripts.generate_wavedroms.RENDER_CACHE = _render_cache_path()
+        scripts.generate_wavedroms.RENDER_CACHE_SIZE = RENDER_CACHE_SIZE * 1024 * 1024
+    SIM_CACHE = args.sim_cache
+    SIM_CACHE_SIZE = int(args.sim_cache_size)
+    if SIM_CACHE_SIZE > 0:
+        scripts.simulate.SIM_CACHE = _sim_cache_path()
+        scripts.simulate.SIM_CACHE_SIZE = SIM_CACHE_SIZE * 1024 * 1024
 
-    if args.count:
+    if args.command == "count":
         print("Counting...")
         scripts.counter.count(FOLDER)
         return
+    if args.command == "report":
+        scripts.report.report(FOLDER)
+        return
+    if args.command == "migrate":
+        migrate_dataset()
+        return
+
+    if args.merge:
+        merged, skipped = scripts.shard.merge(args.merge, FOLDER, _dedup_index_path(), LAYOUT)
+        print(f"Merged {merged} modules into {FOLDER}, skipped {skipped} duplicates")
+        return
 
     print(f"Start at: {start_at}")
     print(f"Number of processes: {MAX_PROCESSES}")
     print(f"Max ports: {MAX_PORTS}")
+    if SHARD is not None:
+        print(f"Shard: {SHARD[0]}/{SHARD[1]}")
 
     if args.debug:
         global DEBUG
         DEBUG = True
         scripts.tb_gen.DEBUG = True
+        scripts.precheck.DEBUG = True
         scripts.simulate.DEBUG = True
         scripts.meta_data.DEBUG = True
         scripts.generate_wavedroms.DEBUG = True
+        scripts.renderer.DEBUG = True
 
     if start_at == "create":
         print("Creating dataset")
-        gather_verilog_data()
-        start_at = "tbgen"
-    if start_at == "tbgen":
-        print("Generating testbenches")
+        gather_verilog_data(append=args.append)
+        start_at = "precheck"
+    if start_at in ["precheck", "tbgen"]:
         scripts.tb_gen.init(max_sim_time)
-        generate_testbenches()
-        start_at = "sim"
-    if start_at == "sim":
-        print("Performing simulations")
-        perform_simulations()
-        start_at = "wfgen"
-    if start_at == "wfgen":
-        generate_waveforms()
+    if start_at in scripts.catalog.STAGES and start_at != "export":
+        print(f"Running the pipeline from {start_at}")
+        run_pipeline(start_at)
+    if start_at in scripts.catalog.STAGES and not args.no_export:
+        export_dataset()
     
 
 if __name__ == "__main__":
@@ -0,0 +1,155 @@
+import os
+import uuid
+import shutil
+import hashlib
+import threading
+
+'''
+Content addressed cache of generated files, shared by all runs using the same cache folder
+An entry is a folder named after the hash of everything the files were created from, it holds one or more named files.
+Files are hardlinked between the cache and the dataset folders when they are on the same file system, and copied otherwise.
+The cache is bounded in size, when it grows too large the least recently used entries are removed.
+'''
+
+
+def cache_key(*parts):
+    '''
+    Hash the parts, strings or bytes, into a cache key
+    '''
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8", "surrogatepass")
+        # the length keeps ("ab", "c") and ("a", "bc") apart
+        h.update(len(part).to_bytes(8, "little"))
+        h.update(part)
+    return h.hexdigest()
+
+
+def file_digest(path):
+    '''
+    Hash the contents of a file
+    '''
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _link(src, dst):
+    '''
+    Hardlink src to dst, replacing dst, copies when linking is not possible
+    dst is only replaced once src was linked or copied
+    '''
+    tmp = f"{dst}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        os.link(src, tmp)
+    except OSError as e:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+class ContentCache:
+    '''
+    Cache folder with entries of named files, limited to max_size bytes
+    Hits and misses of this process are counted, the cache can be shared by threads and processes
+    '''
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size = None
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(path, "tmp"), exist_ok=True)
+
+    def _entry(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, key, files):
+        '''
+        Place the files of the entry at their paths, files maps the names in the entry to the paths
+        Returns False when the entry does not exist or misses one of the files
+        '''
+        entry = self._entry(key)
+        try:
+            for name, path in files.items():
+                _link(os.path.join(entry, name), path)
+            # the modification time of the entry tells when it was used last
+            os.utime(entry)
+        except OSError as e:
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def put(self, key, files):
+        '''
+        Store the files, mapping the names in the entry to the paths they are read from, under the key
+        '''
+        entry = self._entry(key)
+        if os.path.isdir(entry):
+            return
+        # the entry is created next to the cache and moved into place, so a reader never sees half of it
+        tmp = os.path.join(self.path, "tmp", uuid.uuid4().hex)
+        os.makedirs(tmp)
+        size = 0
+        try:
+            for name, path in files.items():
+                _link(path, os.path.join(tmp, name))
+                size += os.path.getsize(path)
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            os.rename(tmp, entry)
+        except OSError as e:
+            # another thread or process stored the same entry first
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += size
+            if self._size > self.max_size:
+                self._evict()
+
+    def _entries(self):
+        '''
+        List the entries as (last used, size, path)
+        '''
+        entries = []
+        for prefix in os.scandir(self.path):
+            if not prefix.is_dir() or prefix.name == "tmp":
+                continue
+            for entry in os.scandir(prefix.path):
+                try:
+                    size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                    entries.append((entry.stat().st_mtime, size, entry.path))
+                except OSError as e:
+                    continue
+        return entries
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        '''
+        Remove the least recently used entries until the cache is below 90% of its maximum size
+        The size is recounted, other processes using the cache may have added entries
+        '''
+        entries = sorted(self._entries())
+        size = sum(size for _, size, _ in entries)
+        for _, entry_size, path in entries:
+            if size <= self.max_size * 0.9:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            size -= entry_size
+            self.evictions += 1
+        self._size = size
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
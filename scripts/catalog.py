@@ -0,0 +1,367 @@
+import os
+import glob
+import time
+import sqlite3
+import scripts.shard
+import scripts.storage
+
+'''
+The catalog is an SQLite database kept next to the dataset folder.
+It records for every module which stages it went through, how long they took and why a module failed.
+Resuming, counting and selecting the modules for a stage are queries on the catalog instead of walks over the dataset folder.
+'''
+
+# the stages every module goes through, in order
+STAGES = ["create", "precheck", "tbgen", "sim", "wfgen", "export"]
+
+# stages which only filter out modules, a run starting after one of them also takes the modules which did not go through it
+SKIPPABLE_STAGES = ["precheck"]
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS modules (
+    id INTEGER PRIMARY KEY,
+    module_name TEXT,
+    digest TEXT,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    failed_stage TEXT,
+    reason TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS modules_status_stage ON modules (status, stage);
+CREATE TABLE IF NOT EXISTS stage_runs (
+    module_id INTEGER NOT NULL,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    reason TEXT,
+    started REAL,
+    seconds REAL,
+    fingerprint TEXT,
+    PRIMARY KEY (module_id, stage)
+);
+CREATE TABLE IF NOT EXISTS telemetry (
+    module_id INTEGER NOT NULL,
+    stage TEXT NOT NULL,
+    step TEXT NOT NULL,
+    status TEXT NOT NULL,
+    started REAL,
+    wall REAL,
+    cpu REAL,
+    child_cpu REAL,
+    max_rss INTEGER,
+    bytes_written INTEGER,
+    PRIMARY KEY (module_id, step)
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+
+def catalog_path(folder):
+    '''
+    Path of the catalog belonging to the dataset folder
+    '''
+    return os.path.realpath(folder) + "_catalog.db"
+
+
+def remove_catalog(folder):
+    '''
+    Remove the catalog belonging to the dataset folder, if it exists
+    '''
+    path = catalog_path(folder)
+    for file in [path, path + "-wal", path + "-shm"]:
+        if os.path.exists(file):
+            os.remove(file)
+
+
+def open_catalog(folder):
+    '''
+    Open the catalog of the dataset folder
+    If the dataset predates the catalog, the catalog is filled by probing the folder once
+    '''
+    rebuild = not os.path.exists(catalog_path(folder)) and os.path.exists(folder)
+    catalog = Catalog(folder)
+    if rebuild:
+        print(f"No catalog found for {folder}, building it from the dataset folder")
+        catalog.rebuild()
+    return catalog
+
+
+class Catalog:
+    '''
+    Catalog of the modules in a dataset folder
+    Modules are stored with the last stage they completed successfully and their status, which is either "ok" or "failed"
+    Every update is done in its own transaction, so an interrupted run leaves a consistent catalog behind
+    The catalog should only be used from the thread that opened it
+    '''
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = catalog_path(folder)
+        self._db = sqlite3.connect(self.path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        # catalogs created before the fingerprints were recorded lack their column
+        if "fingerprint" not in [row[1] for row in self._db.execute("PRAGMA table_info(stage_runs)")]:
+            with self._db:
+                self._db.execute("ALTER TABLE stage_runs ADD COLUMN fingerprint TEXT")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._db.close()
+
+    def get_setting(self, key, default=None):
+        row = self._db.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def set_setting(self, key, value):
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
+
+    def storage(self, layout=None):
+        '''
+        Get the storage of the dataset, following the layout stored in the catalog
+        A dataset without a stored layout gets the given layout when it has no modules yet, or is flat as datasets created before the layouts
+        Raises ValueError if a layout is given which differs from the layout of the dataset
+        '''
+        stored = self.get_setting("layout")
+        if stored is None:
+            stored = (layout or scripts.storage.DEFAULT_LAYOUT) if self.next_id() == 0 else "flat"
+            self.set_setting("layout", stored)
+        if layout is not None and layout != stored:
+            raise ValueError(f"the dataset in {self.folder} uses the {stored} layout, not {layout}")
+        return scripts.storage.Storage(self.folder, stored)
+
+    def add_module(self, id, module_name, digest=None):
+        '''
+        Register a module which was just created
+        '''
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO modules (id, module_name, digest, stage, status, updated) VALUES (?, ?, ?, 'create', 'ok', ?)",
+                             (id, module_name, digest, time.time()))
+
+    def record(self, id, stage, success, reason=None, started=None, seconds=None, fingerprint=None):
+        '''
+        Record the outcome of a stage for a module
+        fingerprint identifies the parameters the stage ran with, see iter_ready
+        '''
+        status = "ok" if success else "failed"
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO stage_runs (module_id, stage, status, reason, started, seconds, fingerprint) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (id, stage, status, reason, started, seconds, fingerprint))
+            if success:
+                self._db.execute("UPDATE modules SET stage = ?, status = 'ok', failed_stage = NULL, reason = NULL, updated = ? WHERE id = ?",
+                                 (stage, time.time(), id))
+            else:
+                self._db.execute("UPDATE modules SET status = 'failed', failed_stage = ?, reason = ?, updated = ? WHERE id = ?",
+                                 (stage, reason, time.time(), id))
+
+    def record_telemetry(self, id, stage, step, success, started, wall, usage):
+        '''
+        Record the measurements of a step of a module, usage as returned by scripts.telemetry.end() extended with bytes_written
+        '''
+        usage = usage or {}
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO telemetry (module_id, stage, step, status, started, wall, cpu, child_cpu, max_rss, bytes_written) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             (id, stage, step, "ok" if success else "failed", started, wall, usage.get("cpu"),
+                              usage.get("child_user", 0) + usage.get("child_system", 0), usage.get("max_rss"), usage.get("bytes_written")))
+
+    def telemetry_steps(self):
+        '''
+        Get the (stage, step) pairs that have telemetry, in the order of the stages
+        '''
+        rows = self._db.execute("SELECT DISTINCT stage, step FROM telemetry").fetchall()
+        return sorted(rows, key=lambda row: (STAGES.index(row[0]) if row[0] in STAGES else len(STAGES), row[1]))
+
+    def telemetry_values(self, step, column):
+        '''
+        Get the sorted values of a telemetry column for all runs of a step
+        '''
+        if column not in ["wall", "cpu", "child_cpu", "max_rss", "bytes_written"]:
+            raise ValueError(f"unknown telemetry column {column}")
+        return [row[0] for row in self._db.execute(f"SELECT {column} FROM telemetry WHERE step = ? AND {column} IS NOT NULL ORDER BY {column}", (step,))]
+
+    def telemetry_outcomes(self, step):
+        '''
+        Count the runs of a step per status
+        '''
+        return dict(self._db.execute("SELECT status, COUNT(*) FROM telemetry WHERE step = ? GROUP BY status", (step,)).fetchall())
+
+    def slowest_modules(self, limit=10):
+        '''
+        Get the modules with the largest total wall time over all steps, as (id, total wall time, slowest step, its wall time)
+        '''
+        return self._db.execute('''
+            SELECT module_id, SUM(wall), (SELECT step FROM telemetry t WHERE t.module_id = telemetry.module_id ORDER BY wall DESC LIMIT 1), MAX(wall)
+            FROM telemetry GROUP BY module_id ORDER BY SUM(wall) DESC LIMIT ?''', (limit,)).fetchall()
+
+    def iter_ready(self, first, last, page_size=10000, shard=None, fingerprints=None):
+        '''
+        Iterate over the modules that are ready for one of the stages from first up to and including last
+        A module is ready for a stage when it successfully completed the stage before it
+        When the stage before first is skippable, modules that did not complete it are ready for first as well, they are yielded as if they did
+        e.g. a run from tbgen takes the modules of datasets created before the precheck stage existed
+        Yields (id, stage) tuples, with stage being the last stage the module completed
+        With a shard, a (i, N) tuple, only the modules of that shard are yielded, see scripts.shard
+        With fingerprints, a dict with the current fingerprint of the parameters of every stage, a module that completed one of the stages
+        from first to last with another fingerprint is outdated; it is yielded with the stage before the first outdated stage, so it is redone from there
+        This includes modules which failed one of these stages with other parameters, as long as their folder was kept
+        Exported modules are never outdated, redoing them would leave their old row in the exported files next to the new one
+        Stage runs recorded without a fingerprint are never outdated
+        The modules are fetched in pages, so the catalog can be updated while iterating
+        '''
+        previous = STAGES.index(first) - 1
+        start = previous
+        while start > 0 and STAGES[start] in SKIPPABLE_STAGES:
+            start -= 1
+        ready = STAGES[start:STAGES.index(last)]
+        checked = [stage for stage in STAGES[STAGES.index(first):STAGES.index(last) + 1] if fingerprints and fingerprints.get(stage) is not None]
+        # outdated modules can be in any later stage but export
+        stages = STAGES[start:STAGES.index("export")] if checked else ready
+        placeholders = ", ".join("?" for _ in stages)
+        # failed modules are only retried when the parameters of the stage they failed changed
+        failed_placeholders = ", ".join("?" for _ in checked)
+        storage = None
+        last_id = -1
+        while True:
+            rows = self._db.execute(f"SELECT id, stage, status, failed_stage, digest FROM modules WHERE ((status = 'ok' AND stage IN ({placeholders})) OR (status = 'failed' AND failed_stage IN ({failed_placeholders}))) AND id > ? ORDER BY id LIMIT ?",
+                                    (*stages, *checked, last_id, page_size)).fetchall()
+            if len(rows) == 0:
+                return
+            outdated = self._outdated(rows[0][0], rows[-1][0], checked, fingerprints) if checked else {}
+            for id, stage, status, failed_stage, digest in rows:
+                if not scripts.shard.in_shard(digest, id, shard):
+                    continue
+                if status == "failed":
+                    if id not in outdated or STAGES.index(outdated[id]) > STAGES.index(failed_stage):
+                        continue
+                    # without DEBUG the folders of failed modules are removed, there is nothing left to redo
+                    storage = storage or self.storage()
+                    if os.path.isdir(storage.module_folder(id)):
+                        yield id, STAGES[STAGES.index(outdated[id]) - 1]
+                elif id in outdated and STAGES.index(outdated[id]) <= STAGES.index(stage):
+                    yield id, STAGES[STAGES.index(outdated[id]) - 1]
+                elif stage in ready:
+                    yield id, STAGES[max(STAGES.index(stage), previous)]
+            last_id = rows[-1][0]
+
+    def _outdated(self, first_id, last_id, stages, fingerprints):
+        '''
+        Get the first stage with another fingerprint for the modules in the id range that have one, as a dict of id to stage
+        Both successful and failed stage runs are compared
+        '''
+        outdated = {}
+        rows = self._db.execute(f"SELECT module_id, stage, fingerprint FROM stage_runs WHERE module_id BETWEEN ? AND ? AND fingerprint IS NOT NULL AND stage IN ({', '.join('?' for _ in stages)})",
+                                (first_id, last_id, *stages))
+        for id, stage, fingerprint in rows:
+            if fingerprint != fingerprints[stage] and (id not in outdated or STAGES.index(stage) < STAGES.index(outdated[id])):
+                outdated[id] = stage
+        return outdated
+
+    def iter_modules(self, page_size=10000):
+        '''
+        Iterate over all modules in order of their id, yields a dict with the columns of the modules table for every module
+        '''
+        last_id = -1
+        while True:
+            cursor = self._db.execute("SELECT * FROM modules WHERE id > ? ORDER BY id LIMIT ?", (last_id, page_size))
+            columns = [column[0] for column in cursor.description]
+            rows = cursor.fetchall()
+            if len(rows) == 0:
+                return
+            for row in rows:
+                yield dict(zip(columns, row))
+            last_id = rows[-1][0]
+
+    def stage_runs(self, id):
+        '''
+        Get the recorded stage runs of a module, as dicts with the columns of the stage_runs table
+        '''
+        cursor = self._db.execute("SELECT * FROM stage_runs WHERE module_id = ?", (id,))
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def telemetry(self, id):
+        '''
+        Get the telemetry of a module, as dicts with the columns of the telemetry table
+        '''
+        cursor = self._db.execute("SELECT * FROM telemetry WHERE module_id = ?", (id,))
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def digests(self):
+        '''
+        Get the set of the digests of all modules
+        '''
+        return {row[0] for row in self._db.execute("SELECT digest FROM modules WHERE digest IS NOT NULL")}
+
+    def import_module(self, id, module, stage_runs, telemetry=()):
+        '''
+        Add a module taken from another catalog under a new id
+        module, stage_runs and telemetry as returned by iter_modules, stage_runs and telemetry
+        '''
+        with self._db:
+            columns = [column for column in module if column != "id"]
+            self._db.execute(f"INSERT OR REPLACE INTO modules (id, {', '.join(columns)}) VALUES (?, {', '.join('?' for _ in columns)})",
+                             (id, *(module[column] for column in columns)))
+            for table, rows in [("stage_runs", stage_runs), ("telemetry", telemetry)]:
+                for row in rows:
+                    columns = [column for column in row if column != "module_id"]
+                    self._db.execute(f"INSERT OR REPLACE INTO {table} (module_id, {', '.join(columns)}) VALUES (?, {', '.join('?' for _ in columns)})",
+                                     (id, *(row[column] for column in columns)))
+
+    def next_id(self):
+        '''
+        Get the first free module id
+        '''
+        row = self._db.execute("SELECT MAX(id) FROM modules").fetchone()
+        return 0 if row[0] is None else row[0] + 1
+
+    def count(self):
+        '''
+        Count the modules per status and stage
+        Returns a dict of the form {(status, stage): count}
+        '''
+        cursor = self._db.execute("SELECT status, stage, COUNT(*) FROM modules GROUP BY status, stage")
+        return {(status, stage): count for status, stage, count in cursor}
+
+    def failures(self):
+        '''
+        Count the failed modules per failed stage and reason
+        Returns a dict of the form {(failed_stage, reason): count}
+        '''
+        cursor = self._db.execute("SELECT failed_stage, reason, COUNT(*) FROM modules WHERE status = 'failed' GROUP BY failed_stage, reason")
+        return {(stage, reason): count for stage, reason, count in cursor}
+
+    def rebuild(self):
+        '''
+        Fill the catalog by probing the dataset folder
+        Only needed once, for datasets without a catalog such as the ones created before the catalog existed
+        '''
+        layout = scripts.storage.detect_layout(self.folder)
+        if layout is not None:
+            self.set_setting("layout", layout)
+        with self._db:
+            for id, path in scripts.storage.find_modules(self.folder):
+                if len(glob.glob(os.path.join(path, "img/*.png"))) > 0:
+                    stage = "wfgen"
+                elif os.path.exists(os.path.join(path, "dump.vcd")):
+                    stage = "sim"
+                elif os.path.exists(os.path.join(path, "tb.v")):
+                    stage = "tbgen"
+                else:
+                    stage = "create"
+                if os.path.exists(os.path.join(path, "gentbvlog_err.txt")) or os.path.exists(os.path.join(path, "meta_load_err.txt")):
+                    status, failed_stage = "failed", "tbgen"
+                else:
+                    status, failed_stage = "ok", None
+                self._db.execute("INSERT OR REPLACE INTO modules (id, stage, status, failed_stage, updated) VALUES (?, ?, ?, ?, ?)",
+                                 (id, stage, status, failed_stage, time.time()))
@@ -0,0 +1,128 @@
+import os
+import time
+import statistics
+import collections
+
+'''
+Adaptive limits for the resource classes of the pipeline running external tools
+gentbvlog, iverilog/vvp and the renderers can overload the machine, too many gentbvlog processes can even make it hang.
+Instead of fixed limits, the controller starts low and grows the limit of a class while the machine has room,
+and shrinks it when the load average is high, memory runs low or the steps of the class get slower than they used to be.
+The limits never exceed the configured ceilings, the decisions are logged.
+'''
+
+# load average per cpu above which the limits shrink, and below which they are allowed to grow
+LOAD_HIGH = 1.25
+LOAD_LOW = 0.9
+# fraction of the memory that is available below which the limits shrink, and above which they are allowed to grow
+MEMORY_LOW = 0.1
+MEMORY_HIGH = 0.25
+# a class whose recent steps take this many times longer than its best window is considered to be contended
+LATENCY_RATIO = 2.0
+# number of recent step durations of a class used to judge its latency
+LATENCY_WINDOW = 20
+
+
+def load_per_cpu():
+    '''
+    One minute load average divided by the number of cpus, None where it is not available
+    '''
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (OSError, AttributeError) as e:
+        return None
+
+
+def available_memory():
+    '''
+    Fraction of the memory that is available according to /proc/meminfo, None where it is not available
+    '''
+    try:
+        values = {}
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                name, value = line.split(":", 1)
+                values[name] = int(value.split()[0])
+        return values["MemAvailable"] / values["MemTotal"]
+    except (OSError, KeyError, ValueError, ZeroDivisionError) as e:
+        return None
+
+
+class AdaptiveLimits:
+    '''
+    Controller of the number of steps of every resource class that can run at once
+    ceilings maps every resource class to its maximum limit, only the classes in adaptive are adjusted,
+    the others always run at their ceiling
+    The scheduler reports the duration of every step with observe() and asks for the current limits with update()
+    '''
+
+    def __init__(self, ceilings, adaptive=("tbgen", "sim", "render"), interval=5.0, log=print):
+        self.ceilings = dict(ceilings)
+        self.adaptive = [resource for resource in adaptive if resource in self.ceilings]
+        self.interval = interval
+        self.log = log
+        self.limits = dict(self.ceilings)
+        for resource in self.adaptive:
+            # start at half of the ceiling and grow while the machine has room
+            self.limits[resource] = max(1, self.ceilings[resource] // 2)
+        self._durations = {resource: collections.deque(maxlen=LATENCY_WINDOW) for resource in self.adaptive}
+        self._best_latency = {resource: None for resource in self.adaptive}
+        self._saturated = set()
+        self._last_update = time.monotonic()
+
+    def observe(self, resource, seconds):
+        '''
+        Record how long a step of the resource class took
+        '''
+        if resource in self._durations:
+            self._durations[resource].append(seconds)
+
+    def _latency_ratio(self, resource):
+        '''
+        How many times slower the recent steps of the class are than its best window so far, None until a window is full
+        '''
+        durations = self._durations[resource]
+        if len(durations) < durations.maxlen:
+            return None
+        latency = statistics.median(durations)
+        best = self._best_latency[resource]
+        if best is None or latency < best:
+            self._best_latency[resource] = latency
+            return 1.0
+        return latency / best if best > 0 else None
+
+    def update(self, saturated=()):
+        '''
+        Adjust the limits, at most once every interval seconds, and return them
+        saturated are the resource classes which have steps waiting because they reached their limit, only those grow
+        '''
+        # a class counts as saturated if it was saturated at any moment since the last adjustment
+        self._saturated.update(saturated)
+        now = time.monotonic()
+        if now - self._last_update < self.interval:
+            return self.limits
+        self._last_update = now
+        saturated, self._saturated = self._saturated, set()
+        load = load_per_cpu()
+        memory = available_memory()
+        for resource in self.adaptive:
+            limit = self.limits[resource]
+            ratio = self._latency_ratio(resource)
+            if load is not None and load > LOAD_HIGH:
+                new, reason = limit - max(1, limit // 4), f"load {load:.2f} per cpu"
+            elif memory is not None and memory < MEMORY_LOW:
+                new, reason = limit - max(1, limit // 4), f"{memory:.0%} memory available"
+            elif ratio is not None and ratio > LATENCY_RATIO:
+                new, reason = limit - 1, f"steps {ratio:.1f}x slower"
+                # the slower steps become the new reference, otherwise the class would keep shrinking
+                self._best_latency[resource] = None
+            elif (resource in saturated and (load is None or load < LOAD_LOW) and (memory is None or memory > MEMORY_HIGH)
+                  and (ratio is None or ratio < LATENCY_RATIO)):
+                new, reason = limit + 1, "room available"
+            else:
+                continue
+            new = min(max(new, 1), self.ceilings[resource])
+            if new != limit:
+                self.limits[resource] = new
+                self.log(f"Concurrency of {resource}: {limit} -> {new} ({reason})")
+        return self.limits
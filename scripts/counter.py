@@ -1,27 +1,26 @@
-import os
+import scripts.catalog
+import scripts.simulate
 
 def count(folder):
-    total = 0
-    modules = 0
-    testbenches = 0
-    compilations = 0
-    simulations = 0
-    for subfolder in os.listdir(folder):
-        total += 1
-        if os.path.exists(f"{folder}/{subfolder}/module.v"):
-            modules += 1
-        if os.path.exists(f"{folder}/{subfolder}/tb.v"):
-            testbenches += 1
-        if os.path.exists(f"{folder}/{subfolder}/iverilog_out"):
-            compilations += 1
-        if os.path.exists(f"{folder}/{subfolder}/dump.vcd"):
-            simulations += 1
-    
-    print(f"Total dataset folders: {total}")
-    print(f"Total modules: {modules}")
-    print(f"Total testbenches: {testbenches}")
-    print(f"Total compilations: {compilations}")
-    print(f"Total simulations: {simulations}")
+    with scripts.catalog.open_catalog(folder) as catalog:
+        counts = catalog.count()
+        failures = catalog.failures()
 
+    def reached(stage):
+        # modules which completed the stage, and possibly later stages as well, also when they failed one of the later stages
+        stages = scripts.catalog.STAGES[scripts.catalog.STAGES.index(stage):]
+        return sum(counts.get((status, s), 0) for status in ["ok", "failed"] for s in stages)
 
-    
+    total = sum(counts.values())
+    print(f"Total dataset folders: {total}")
+    print(f"Total modules: {reached('create')}")
+    print(f"Total compilable modules: {reached('precheck')}")
+    print(f"Total testbenches: {reached('tbgen')}")
+    # compiling is part of the sim stage, modules which failed in vvp were compiled as well
+    print(f"Total compilations: {reached('sim') + failures.get(('sim', scripts.simulate.SIMULATION_FAILED), 0)}")
+    print(f"Total simulations: {reached('sim')}")
+    print(f"Total waveforms: {reached('wfgen')}")
+    print(f"Total exported: {reached('export')}")
+    print(f"Total failed modules: {sum(failures.values())}")
+    for (stage, reason), number in sorted(failures.items(), key=lambda item: -item[1]):
+        print(f"  {stage}: {reason}: {number}")
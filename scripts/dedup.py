@@ -0,0 +1,63 @@
+import os
+import re
+import hashlib
+from scripts import verilog_lexer
+
+'''
+Content based deduplication of verilog modules
+The datasets overlap heavily and contain the same modules many times, every duplicate would otherwise go through every stage again
+'''
+
+_WHITESPACE_REGEX = re.compile(r'\s+')
+
+
+def module_digest(code):
+    '''
+    Hash the normalized form of the module, which is the code without comments and without any whitespace
+    '''
+    normalized = _WHITESPACE_REGEX.sub("", verilog_lexer.strip_comments(code))
+    return hashlib.blake2b(normalized.encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+
+
+class DedupIndex:
+    '''
+    Persistent index of the digests of the modules that were added to the dataset
+    The digests are kept in memory and appended to a text file, one digest per line, so the index survives across runs
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._digests = set()
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        self._digests.add(line)
+        self._file = open(path, "a")
+
+    def __len__(self):
+        return len(self._digests)
+
+    def __contains__(self, digest):
+        return digest in self._digests
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add(self, digest):
+        '''
+        Add the digest to the index
+        Returns False if the digest was already present, meaning the module is a duplicate
+        '''
+        if digest in self._digests:
+            return False
+        self._digests.add(digest)
+        self._file.write(digest + "\n")
+        return True
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,177 @@
+import os
+import time
+import concurrent.futures
+import pyarrow as pa
+import pyarrow.parquet as pq
+from scripts import meta_data
+
+'''
+Export of the finished modules into Parquet files
+The dataset folder holds several small files per module, which is slow to load for training.
+The export packs the code, testbench, meta data, wavedrom jsons and images of many modules into one Parquet file,
+so the dataset can be loaded with datasets.load_dataset("parquet", data_files=f"{out}/train-*.parquet").
+The files are written in parallel, one shard per worker, and are numbered after the shards already in the output folder,
+so exporting again only adds the modules that were not exported yet.
+Exported modules are final, they are not redone when the parameters of an earlier stage change (see scripts.catalog.Catalog.iter_ready),
+so no module ends up in two files.
+'''
+
+SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("module_name", pa.string()),
+    ("code", pa.string()),
+    ("testbench", pa.string()),
+    ("meta", pa.string()),
+    ("wavedroms", pa.list_(pa.struct([
+        ("index", pa.int64()),
+        ("wavejson", pa.string()),
+        ("png", pa.binary()),
+    ]))),
+])
+
+
+def _read_text(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return f.read()
+
+
+def _testbench(folder, meta):
+    '''
+    Name of the testbench file of a module which ends up in the export
+    '''
+    # modules which got their testbench before it was recorded by tbgen only have tb_instrumented.v
+    testbench = meta.get("testbench")
+    if testbench is None:
+        testbench = "tb_instrumented.v" if os.path.exists(os.path.join(folder, "tb_instrumented.v")) else "tb.v"
+    return testbench
+
+
+def _read_meta(folder):
+    with open(os.path.join(folder, "meta.json"), "rb") as f:
+        return meta_data.loads(f.read())
+
+
+def _read_module(id, folder):
+    '''
+    Read the files of a module into a row of the export
+    '''
+    meta = _read_meta(folder)
+    wavedroms = []
+    for wavedrom in meta.get("wavedroms", []):
+        if "png" not in wavedrom:
+            continue
+        with open(os.path.join(folder, "img", wavedrom["png"]), "rb") as f:
+            png = f.read()
+        wavedroms.append({"index": wavedrom["index"], "wavejson": _read_text(os.path.join(folder, "img", wavedrom["json"])), "png": png})
+    testbench = _testbench(folder, meta)
+    return {
+        "id": id,
+        "module_name": meta.get("module_name"),
+        "code": _read_text(os.path.join(folder, "module.v")),
+        "testbench": _read_text(os.path.join(folder, testbench)),
+        "meta": meta_data.dumps(meta).decode("utf-8"),
+        "wavedroms": wavedroms,
+    }
+
+
+def write_shard(path, modules):
+    '''
+    Write the modules, a list of (id, folder), into a single Parquet file
+    Returns a list of (id, success, reason, started, seconds), a module that can not be read is left out of the file
+    When none of the modules can be read no file is written
+    '''
+    rows = []
+    results = []
+    for id, folder in modules:
+        started = time.time()
+        try:
+            rows.append(_read_module(id, folder))
+            results.append((id, True, None, started, time.time() - started))
+        except Exception as e:
+            results.append((id, False, str(e), started, time.time() - started))
+    if not rows:
+        return results
+    started = time.time()
+    # the file only appears under its final name once it is complete
+    pq.write_table(pa.Table.from_pylist(rows, schema=SCHEMA), path + ".tmp")
+    os.replace(path + ".tmp", path)
+    # the time of writing the file is divided over its modules
+    seconds = (time.time() - started) / max(len(rows), 1)
+    return [(id, success, reason, module_started, module_seconds + (seconds if success else 0))
+            for id, success, reason, module_started, module_seconds in results]
+
+
+def _module_size(folder):
+    '''
+    Size of the files of a module that end up in the export, used to divide the modules over the shards
+    '''
+    try:
+        testbench = _testbench(folder, _read_meta(folder))
+    except Exception as e:
+        # write_shard leaves the module out, its size does not matter
+        return 0
+    size = 0
+    for name in ["meta.json", "module.v", testbench]:
+        try:
+            size += os.path.getsize(os.path.join(folder, name))
+        except OSError as e:
+            continue
+    try:
+        for entry in os.scandir(os.path.join(folder, "img")):
+            size += entry.stat().st_size
+    except OSError as e:
+        pass
+    return size
+
+
+def _next_shard_index(out):
+    indexes = [int(name[6:11]) for name in os.listdir(out)
+               if name.startswith("train-") and name.endswith(".parquet") and name[6:11].isdigit()]
+    return max(indexes) + 1 if indexes else 0
+
+
+def export(modules, out, shard_size, workers, on_done):
+    '''
+    Export the modules, an iterable of (id, folder), into Parquet shards of about shard_size bytes in the out folder
+    The shards are written by worker processes, on_done(id, success, reason, started, seconds) is called for every module
+    Returns the number of shards written, shards of which none of the modules could be read are skipped
+    '''
+    os.makedirs(out, exist_ok=True)
+    index = _next_shard_index(out)
+    written = 0
+    pending = set()
+    shard = []
+    size = 0
+
+    def collect(done):
+        nonlocal written
+        for future in done:
+            results = future.result()
+            if any(success for id, success, reason, started, seconds in results):
+                written += 1
+            for result in results:
+                on_done(*result)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        def submit():
+            nonlocal pending, shard, size, index, written
+            # only a bounded number of shards is kept in memory at once
+            if len(pending) >= 2 * workers:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                collect(done)
+            pending.add(executor.submit(write_shard, os.path.join(out, f"train-{index:05d}.parquet"), shard))
+            index += 1
+            shard = []
+            size = 0
+
+        for id, folder in modules:
+            shard.append((id, folder))
+            size += _module_size(folder)
+            if size >= shard_size:
+                submit()
+        if shard:
+            submit()
+        collect(concurrent.futures.as_completed(pending))
+    return written
@@ -2,37 +2,55 @@ import os
 from scripts import meta_data
 import subprocess
 import json
+import math
+import random
 from utils.vcd2json import WaveExtractor
+from scripts import renderer
+from scripts import cache
 
 DEBUG = False
 
 MAX_WAVEDROMS = 1000
 
-def _permute(arr):
+# backend used to render the images, see scripts.renderer
+# server = long lived node workers rendering many images each, falls back to wavedrom-cli
+# cli = one wavedrom-cli process per image
+# python = rendered in process by scripts.wavedrom_svg, falls back to wavedrom-cli when cairosvg is missing
+RENDERER = "server"
+# maximum number of renderer workers in a process
+RENDER_WORKERS = 1
+
+# folder of the render cache, images of identical wavedrom jsons are rendered once and hardlinked, None disables the cache
+RENDER_CACHE = None
+# maximum size of the render cache in bytes
+RENDER_CACHE_SIZE = 1024 * 1024 * 1024
+_render_cache = None
+
+# seed for sampling the signal orders when a module has more than MAX_WAVEDROMS of them
+PERMUTATION_SEED = 0
+
+def _unrank(arr, rank):
     '''
-    Get all possible permutations of the array
+    Get the permutation of the array with the given rank, permutations are ranked in lexicographic order of the element positions
+    Only this permutation is created, the ones before it are skipped
     '''
-    if len(arr) == 0:
-        return []
-    if len(arr) == 1:
-        return [arr]
-    
-    perms = []
-    for i in range(len(arr)):
-        current = arr[i]
-        remaining = arr[:i] + arr[i+1:]
-        for p in _permute(remaining):
-            perms.append([current] + p)
-    
-    return perms
+    remaining = list(arr)
+    perm = []
+    for i in range(len(remaining), 0, -1):
+        index, rank = divmod(rank, math.factorial(i - 1))
+        perm.append(remaining.pop(index))
+    return perm
 
 
-def _get_signal_permutations(signals, clocks):
+def _get_signal_permutations(signals, clocks, limit=None, seed=None):
     '''
-    Get all possible permutations of the signals following certain rules
+    Generate permutations of the signals following certain rules
     - clock signals are put on top,
     - input signals are grouped together and come next
     - output signals are grouped together and come last
+    The first permutation is always the original order of the signals within their groups
+    If there are more than limit permutations, limit of them are sampled uniformly using the seed, PERMUTATION_SEED when it is None,
+    without enumerating the others, so the cost only depends on the limit
     '''
     inputs = []
     outputs = []
@@ -46,26 +64,69 @@ def _get_signal_permutations(signals, clocks):
         else:
             outputs.append(signal)
 
-    inputs_pers = _permute(inputs) # of the form [[input1, input2], [input2, input1], ... ]
-    outputs_pers = _permute(outputs)
+    # every permutation has a rank, following the order of first fixing one permutation of the inputs
+    # and combining it with all permutations of the outputs
+    output_count = math.factorial(len(outputs))
+    total = math.factorial(len(inputs)) * output_count
+    if limit is None or total <= limit:
+        ranks = range(total)
+    else:
+        # rank 0 is the original order, the others are sampled without creating the full range
+        # random.sample can not sample from ranges longer than sys.maxsize, which modules with 26 ports already exceed, randrange has no such limit
+        rng = random.Random(PERMUTATION_SEED if seed is None else seed)
+        sampled = set()
+        while len(sampled) < limit - 1:
+            sampled.add(rng.randrange(1, total))
+        ranks = [0] + sorted(sampled)
 
-    perms = []
-
-    # create permutations by first adding the clock signals,
-    # then fixing one permutation of the inputs and combining it with all permutations of the outputs
-    for iperm in inputs_pers:
-        combination = clock_signals + iperm
-        for operm in outputs_pers:
-            perms.append(combination + operm)
-    
-    return perms
+    for rank in ranks:
+        input_rank, output_rank = divmod(rank, output_count)
+        yield clock_signals + _unrank(inputs, input_rank) + _unrank(outputs, output_rank)
     
 
 
+def get_render_cache():
+    '''
+    Get the render cache of this process, None when the cache is disabled
+    '''
+    global _render_cache
+    if RENDER_CACHE is None:
+        return None
+    if _render_cache is None or _render_cache.path != RENDER_CACHE:
+        _render_cache = cache.ContentCache(RENDER_CACHE, RENDER_CACHE_SIZE)
+    return _render_cache
+
+
+def _canonical_json(json_file):
+    '''
+    Canonical form of a wavedrom json, hashed together with the version of the renderer which created the image as its key in the render cache
+    '''
+    with open(json_file, "r") as f:
+        source = json.load(f)
+    return json.dumps(source, sort_keys=True, separators=(",", ":"))
+
+
+def fingerprint():
+    '''
+    Fingerprint of the parameters the wavedroms are generated with, see scripts.catalog.Catalog.iter_ready
+    '''
+    return cache.cache_key("max_wavedroms", str(MAX_WAVEDROMS), "permutation_seed", str(PERMUTATION_SEED))
+
+
 def generate_wavedrom(folder):
     '''
     Generate wavedrom for the verilog module in the folder
     '''
+    meta = extract_wavedroms(folder)
+    return bool(meta) and render_wavedroms(folder, meta)
+
+
+def extract_wavedroms(folder):
+    '''
+    Extract the wavedrom jsons from the simulation of the verilog module in the folder
+    This is the CPU heavy part of generating wavedroms, the jsons are registered in the meta data so render_wavedroms can turn them into images
+    Returns the stored meta data, which can be handed to render_wavedroms, or False if the wavedroms could not be extracted
+    '''
     try:
         meta = meta_data.MetaData()
         meta.load(folder)
@@ -84,7 +145,8 @@ def generate_wavedrom(folder):
         single_clk_module = len(meta.meta["clocks"]) == 1
 
         # shuffle the signals around to get waveforms with the signals in different orders
-        signal_permutations = _get_signal_permutations(meta.meta["ports"], meta.meta["clocks"])
+        # the number of permutations grows very large with the number of signals, so they are limited to MAX_WAVEDROMS
+        signal_permutations = _get_signal_permutations(meta.meta["ports"], meta.meta["clocks"], limit=MAX_WAVEDROMS)
 
         if os.path.exists(os.path.join(folder, "img")):
             os.system(f"rm -r {os.path.join(folder, 'img')}")
@@ -168,11 +230,33 @@ def generate_wavedrom(folder):
                 'json': f"wavedrom_{i}.json",
                 'applied_variation': 'shuffled',
                 'shuffled': {'pre': meta.meta["ports"], 'post': perm}})
-            
-            if i > MAX_WAVEDROMS: # limit the number of permutations since it grows very large with the number of signals
-                break
 
-        success_count = 0
+        meta.store()
+        return meta.meta
+    except Exception as e:
+        if DEBUG:
+            error_file = open(os.path.join(folder, "wavedrom_err.txt"), "w")
+            error_file.write(str(e))
+            error_file.close()
+        return False
+
+
+def render_wavedroms(folder, meta=None):
+    '''
+    Render the wavedrom jsons registered in the meta data of the folder to images
+    meta is the meta data returned by extract_wavedroms, when it is not given it is loaded from the folder
+    All images of the module are rendered as one batch by the RENDERER backend
+    Images found in the render cache are hardlinked instead of rendered, the cache key of every image is kept in the meta data
+    The key holds the version of the renderer which created the image, which is wavedrom-cli when it rendered in place of the RENDERER backend
+    '''
+    try:
+        if meta is None:
+            meta = meta_data.MetaData()
+            if meta.load(folder) is None:
+                return False
+        else:
+            meta = meta_data.MetaData.from_dict(meta)
+            meta.set_dir(folder)
         # start creating the corresponding images
         if DEBUG:
             err_out = open(os.path.join(folder, "wavedrom_cli_stderr"), "w")
@@ -180,21 +264,45 @@ def generate_wavedrom(folder):
         else:
             err_out = subprocess.DEVNULL
             out = subprocess.DEVNULL
-        for i in range(len(meta.meta["wavedroms"])):
-            try:
-                wavedrom = meta.meta["wavedroms"][i]
-                wavedrom_json = os.path.join(folder, f"img/{wavedrom['json']}")
-                wavedrom_png = os.path.join(folder, f"img/wavedrom_{wavedrom['index']}.png")
-                subprocess_args = ["wavedrom-cli", "-i", wavedrom_json, "-p", wavedrom_png]
-                subprocess.run(subprocess_args, shell=False, timeout=10, stdout=out, stderr=err_out)
-                meta.meta["wavedroms"][i]['png'] = f"wavedrom_{wavedrom['index']}.png"
-            except Exception as e:
-                if DEBUG:
-                    error_file = open(os.path.join(folder, "wavedrom_img_err.txt"), "w")
-                    error_file.write(str(e))
-                    error_file.close()
-                continue
-            success_count += 1
+        jobs = []
+        for wavedrom in meta.meta["wavedroms"]:
+            wavedrom_json = os.path.join(folder, f"img/{wavedrom['json']}")
+            wavedrom_png = os.path.join(folder, f"img/wavedrom_{wavedrom['index']}.png")
+            jobs.append((wavedrom_json, wavedrom_png))
+        results = [False] * len(jobs)
+        render_cache = get_render_cache()
+        canonical = {}
+        if render_cache is not None:
+            # images of the backend come first, then the ones wavedrom-cli rendered when the backend could not
+            versions = list(dict.fromkeys([renderer.version(RENDERER, RENDER_WORKERS), renderer.version("cli")]))
+            for index, (wavedrom, (wavedrom_json, wavedrom_png)) in enumerate(zip(meta.meta["wavedroms"], jobs)):
+                canonical[index] = _canonical_json(wavedrom_json)
+                for version in versions:
+                    key = cache.cache_key(canonical[index], version)
+                    if render_cache.get(key, {"wavedrom.png": wavedrom_png}):
+                        wavedrom['render_key'] = key
+                        results[index] = True
+                        break
+        pending = [index for index, success in enumerate(results) if not success]
+        for index in pending:
+            meta.meta["wavedroms"][index].pop('render_key', None)
+            # an old image can be a hardlink into the render cache, the renderer must not write into it
+            if os.path.lexists(jobs[index][1]):
+                os.remove(jobs[index][1])
+        rendered = renderer.render([jobs[index] for index in pending], backend=RENDERER, workers=RENDER_WORKERS, out=out, err_out=err_out)
+        for index, rendered_by in zip(pending, rendered):
+            results[index] = rendered_by is not None
+            if rendered_by is not None and render_cache is not None:
+                meta.meta["wavedroms"][index]['render_key'] = cache.cache_key(canonical[index], rendered_by)
+                render_cache.put(meta.meta["wavedroms"][index]['render_key'], {"wavedrom.png": jobs[index][1]})
+        if DEBUG:
+            err_out.close()
+            out.close()
+        success_count = 0
+        for wavedrom, success in zip(meta.meta["wavedroms"], results):
+            if success:
+                wavedrom['png'] = f"wavedrom_{wavedrom['index']}.png"
+                success_count += 1
         meta.store()
         return success_count > 0
     except Exception as e:
@@ -202,4 +310,4 @@ def generate_wavedrom(folder):
             error_file = open(os.path.join(folder, "wavedrom_err.txt"), "w")
             error_file.write(str(e))
             error_file.close()
-        return False
\ No newline at end of file
+        return False
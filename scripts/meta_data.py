@@ -1,14 +1,22 @@
 import os
 import json
 import hdlparse.verilog_parser as vlog
-import copy
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 '''
 This script is used to generate a meta.json file that contains the metadata of the verilog modules, the testbenches, and the waveforms, etc.
+meta.json is read and written with orjson when it is installed, which is several times faster than the json module.
 '''
 
 DEBUG = False
 
+# version of the meta.json format, meta.json files of version 1 list the ports by name only
+# they are converted once for the whole dataset by migrate(), see main.migrate_dataset
+META_FORMAT = "2"
+
 # Shows the outline of the meta data contents
 EMPTY_META = {
     "module_name": "",
@@ -30,6 +38,76 @@ _NOT_CLK_NAMES = ["clk_en", "clock_en", "clk_enable",
                   "clk_enable_i", "clock_enable_i"
                   "clk_enable_n", "clock_enable_n",]
 
+# VerilogExtractor reused by every analysis done in this process
+# building one per module costs more than parsing small modules, see init_worker()
+_extractor = None
+
+
+def _new_meta():
+    '''
+    Create a new empty meta data dict following the outline of EMPTY_META
+    Cheaper than deep copying EMPTY_META for every module
+    '''
+    return {
+        "module_name": "",
+        "parameters": [],
+        "clocks": [],
+        "resets": [],
+        "ports": [],
+        "code": ""
+    }
+
+
+def _get_extractor():
+    '''
+    Get the VerilogExtractor of this process, creating it if needed
+    '''
+    global _extractor
+    if _extractor is None:
+        _extractor = vlog.VerilogExtractor()
+    return _extractor
+
+
+def dumps(meta):
+    '''
+    Serialize the meta data to bytes
+    orjson does not accept lone surrogates, which some of the datasets contain, those are left to the json module
+    '''
+    if orjson is not None:
+        try:
+            return orjson.dumps(meta)
+        except orjson.JSONEncodeError as e:
+            pass
+    return json.dumps(meta, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data):
+    '''
+    Deserialize meta data from bytes
+    '''
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError as e:
+            pass
+    return json.loads(data)
+
+
+def is_legacy(meta):
+    '''
+    Check if the meta data uses the first format, with the ports given by name only
+    '''
+    return len(meta["ports"]) > 0 and type(meta["ports"][0]) == str
+
+
+def init_worker():
+    '''
+    Initializer for worker processes that analyze verilog code
+    Builds the VerilogExtractor once so it can be reused for every module the worker analyzes
+    '''
+    _get_extractor()
+
+
 class MetaData:
     '''
     Class for gathering and storing meta data of verilog modules
@@ -39,48 +117,49 @@ class MetaData:
     It expects only one module in each provided piece of verilog code.
     '''
 
+    __slots__ = ("dir", "meta")
+
     def __init__(self):
         self.dir = None
-        self.meta = copy.deepcopy(EMPTY_META)
+        self.meta = _new_meta()
+
+    @classmethod
+    def from_dict(cls, meta):
+        '''
+        Create MetaData from an already analyzed meta data dict, e.g. one returned by a worker process
+        '''
+        m = cls.__new__(cls)
+        m.dir = None
+        m.meta = meta
+        return m
 
     def load(self, dir):
         '''
         Load the meta data from the directory
         Expects the presents of a meta.json file in the directory
-        Will return None if the file does not exist
+        Will return None, and set meta to None, if the file does not exist, can not be read or still uses the first format, see migrate()
         '''
         self.dir = dir
-        # if meta.json exists, load it
-        if os.path.exists(os.path.join(dir, "meta.json")):
-            with open(os.path.join(dir, "meta.json"), "r") as f:
-                try:
-                    data = json.load(f)
-                    self.meta = copy.deepcopy(data)
-                except Exception as e:
-                    if DEBUG:
-                        error_file = open(f"{dir}/meta_load_err.txt", "w")
-                        error_file.write(str(e))
-                        error_file.close()
-                    return None
-            # temporary fix for old meta.json files
-            if len(self.meta["ports"]) > 0 and type(self.meta["ports"][0]) == str:
-                vlog_ex = vlog.VerilogExtractor()
-                try:
-                    modules = vlog_ex.extract_objects_from_source(self.meta["code"])
-                except Exception as e:
-                    # failed to redo for some reason? return the old meta for now
-                    return self.meta
-                m = modules[0]
-                if hasattr(m, 'ports'):
-                    self.meta["ports"] = []
-                    for signal in m.ports:
-                        self.meta["ports"].append({"name": signal.name, "mode": signal.mode, "type": signal.data_type})
-                self.store(self.dir)
-                
-
-            return self.meta
-        else:
+        self.meta = None
+        try:
+            with open(os.path.join(dir, "meta.json"), "rb") as f:
+                meta = loads(f.read())
+        except FileNotFoundError as e:
+            return None
+        except Exception as e:
+            if DEBUG:
+                error_file = open(f"{dir}/meta_load_err.txt", "w")
+                error_file.write(str(e))
+                error_file.close()
+            return None
+        if is_legacy(meta):
+            if DEBUG:
+                error_file = open(f"{dir}/meta_load_err.txt", "w")
+                error_file.write(f"meta.json uses format 1 instead of {META_FORMAT}, it should be migrated first")
+                error_file.close()
             return None
+        self.meta = meta
+        return self.meta
 
     def set_dir(self, dir):
         '''
@@ -98,16 +177,16 @@ class MetaData:
             dir = self.dir
         if dir is None:
             raise ValueError("No directory provided")
-        with open(os.path.join(dir, "meta.json"), "w") as f:
-            json.dump(self.meta, f)
+        with open(os.path.join(dir, "meta.json"), "wb") as f:
+            f.write(dumps(self.meta))
 
     def analyze_code(self, code):
         '''
         Analyze the provided verilog code
         Will not save the meta data to a meta.json, this requires calling store(dir)
         '''
-        self.meta = copy.deepcopy(EMPTY_META)
-        vlog_ex = vlog.VerilogExtractor()
+        self.meta = _new_meta()
+        vlog_ex = _get_extractor()
         try:
              modules = vlog_ex.extract_objects_from_source(code)
         except Exception as e:
@@ -153,3 +232,27 @@ class MetaData:
             if file.endswith(".v"):
                 self.analyze_file(os.path.join(dir, file))
                 return
+
+
+def migrate(dir):
+    '''
+    Convert the meta.json in the directory to the current format, by analyzing the code again for the modes and types of the ports
+    Returns whether the meta.json is in the current format afterwards
+    '''
+    with open(os.path.join(dir, "meta.json"), "rb") as f:
+        meta = loads(f.read())
+    if not is_legacy(meta):
+        return True
+    try:
+        modules = _get_extractor().extract_objects_from_source(meta["code"])
+    except Exception as e:
+        if DEBUG:
+            error_file = open(f"{dir}/meta_migrate_err.txt", "w")
+            error_file.write(str(e))
+            error_file.close()
+        return False
+    if not modules or not hasattr(modules[0], 'ports'):
+        return False
+    meta["ports"] = [{"name": signal.name, "mode": signal.mode, "type": signal.data_type} for signal in modules[0].ports]
+    MetaData.from_dict(meta).store(dir)
+    return True
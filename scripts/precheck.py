@@ -0,0 +1,95 @@
+import os
+import re
+import subprocess
+from shutil import which
+from scripts import telemetry
+from scripts import verilog_lexer
+
+'''
+Check that a module can be compiled on its own before any time is spent on its testbench
+gentbvlog can take minutes on a module which iverilog rejects later on, mostly because
+- it instantiates modules which were split off into other modules of the dataset by split_modules
+- it includes files which are not part of the dataset
+- it uses SystemVerilog syntax, which iverilog does not accept without -g2012
+The code is scanned for these first, which is cheap and gives the reason, then iverilog parses and elaborates module.v without generating any output.
+'''
+
+DEBUG = False
+
+PRECHECK_ARGS = ["iverilog", "-t", "null", "module.v"]
+
+# iverilog only parses and elaborates, this is a lot faster than gentbvlog
+PRECHECK_TIMEOUT = 30
+
+_STRING_REGEX = re.compile(r'"(?:\\.|[^"\\\n])*"?')
+_MODULE_REGEX = re.compile(r'\b(?:module|macromodule|primitive)\s+([A-Za-z_][\w$]*)')
+_INCLUDE_REGEX = re.compile(r'`include\b')
+# <module type> [#(<parameters>)] <instance name> [<range>] (
+_INSTANCE_REGEX = re.compile(r'(?<![\w$`.\'])([A-Za-z_][\w$]*)(?:\s*#\s*\((?:[^()]|\([^()]*\))*\)\s*|\s+)([A-Za-z_][\w$]*)\s*(?:\[[^\]]*\]\s*)?\(')
+_SYSTEMVERILOG_REGEX = re.compile(r'''
+      \b(?:always_ff|always_comb|always_latch|typedef)\b
+    | \blogic\b\s*(?:\[[^\]]*\]\s*)*[A-Za-z_]
+    | \b(?:enum|struct)\b\s*(?:packed\s*)?(?:\[[^\]]*\]\s*)?\{
+    | \b(?:interface|package)\s+[A-Za-z_]
+    | \bimport\s+[\w$]+::
+    | (?<![\w'])'[01xzXZ](?![\w'])
+''', re.VERBOSE)
+
+# words which can start something that looks like an instance but is not
+_KEYWORDS = {
+    "module", "macromodule", "primitive", "input", "output", "inout", "wire", "reg", "integer", "real", "realtime", "time",
+    "tri", "tri0", "tri1", "triand", "trior", "trireg", "wand", "wor", "supply0", "supply1", "signed", "unsigned",
+    "parameter", "localparam", "defparam", "specparam", "genvar", "assign", "deassign", "force", "release",
+    "always", "initial", "begin", "end", "fork", "join", "if", "else", "case", "casex", "casez", "endcase", "default",
+    "for", "while", "repeat", "forever", "wait", "disable", "function", "endfunction", "task", "endtask", "automatic",
+    "generate", "endgenerate", "specify", "endspecify", "posedge", "negedge", "event", "scalared", "vectored",
+}
+
+# built in gates and switches, instantiated like modules
+_PRIMITIVES = {
+    "and", "nand", "or", "nor", "xor", "xnor", "not", "buf", "bufif0", "bufif1", "notif0", "notif1",
+    "pullup", "pulldown", "nmos", "pmos", "rnmos", "rpmos", "cmos", "rcmos",
+    "tran", "rtran", "tranif0", "tranif1", "rtranif0", "rtranif1",
+}
+
+
+def scan(code):
+    '''
+    Scan the code, without comments, for what keeps it from compiling on its own
+    Returns the reason the module can not be compiled, None if nothing was found
+    '''
+    # commented out instances, includes and SystemVerilog would otherwise be found as well
+    code = _STRING_REGEX.sub('""', verilog_lexer.strip_comments(code))
+    if _INCLUDE_REGEX.search(code):
+        return "includes other files"
+    if _SYSTEMVERILOG_REGEX.search(code):
+        return "uses SystemVerilog syntax"
+    defined = set(_MODULE_REGEX.findall(code))
+    for module_type, name in _INSTANCE_REGEX.findall(code):
+        if module_type in _KEYWORDS or name in _KEYWORDS or module_type in _PRIMITIVES or module_type in defined:
+            continue
+        return "instantiates undefined modules"
+    return None
+
+
+def precheck(folder):
+    '''
+    Check if the module in the folder can be compiled on its own
+    Returns the reason the module can not be compiled, None if it can
+    Without iverilog only the scan of the code is done
+    '''
+    with open(os.path.join(folder, "module.v"), "r") as f:
+        reason = scan(f.read())
+    if reason is not None or which(PRECHECK_ARGS[0]) is None:
+        return reason
+    try:
+        if DEBUG:
+            with open(os.path.join(folder, "precheck_stderr"), "w") as err:
+                returncode = telemetry.run_tool(PRECHECK_ARGS, stdout=subprocess.DEVNULL, stderr=err, timeout=PRECHECK_TIMEOUT, cwd=folder)
+        else:
+            returncode = telemetry.run_tool(PRECHECK_ARGS, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=PRECHECK_TIMEOUT, cwd=folder)
+    except subprocess.TimeoutExpired as e:
+        return "iverilog timed out"
+    if returncode != 0:
+        return "rejected by iverilog"
+    return None
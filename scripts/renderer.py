@@ -0,0 +1,294 @@
+import os
+import json
+import queue
+import threading
+import subprocess
+from shutil import which
+from scripts import wavedrom_svg
+from scripts import telemetry
+
+'''
+Rendering of wavedrom jsons to images
+Starting wavedrom-cli for every image costs the startup of node and the loading of its modules every time.
+The "server" backend keeps long lived node workers (utils/wavedrom_server.js) and streams the jsons of many images through them.
+Workers which crash or time out are restarted, and the per image wavedrom-cli stays available as the "cli" backend and as fallback.
+The "python" backend renders in process with scripts.wavedrom_svg, which needs cairosvg for the png.
+'''
+
+DEBUG = False
+
+# maximum time to render a single image
+TIMEOUT = 10
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "utils", "wavedrom_server.js")
+
+
+class RendererError(Exception):
+    pass
+
+
+def render_cli(json_file, png_file, out=subprocess.DEVNULL, err_out=subprocess.DEVNULL):
+    '''
+    Render a single wavedrom json to a png using wavedrom-cli
+    '''
+    subprocess_args = ["wavedrom-cli", "-i", json_file, "-p", png_file]
+    telemetry.run_tool(subprocess_args, timeout=TIMEOUT, stdout=out, stderr=err_out)
+    return os.path.exists(png_file)
+
+
+def render_python(json_file, png_file):
+    '''
+    Render a single wavedrom json to a png in this process using scripts.wavedrom_svg
+    '''
+    with open(json_file, "r") as f:
+        source = json.load(f)
+    return wavedrom_svg.render_png(source, png_file) and os.path.exists(png_file)
+
+
+_wavedrom_version = None
+
+
+def version(backend, workers=1):
+    '''
+    Get the name and version of the renderer which creates the images of the backend, the images of two renderers are not the same
+    When the backend is not available this is wavedrom-cli, which renders the images instead
+    The server backend uses the wavedrom module installed with wavedrom-cli, but rasterizes with @resvg/resvg-js or sharp,
+    its version is reported by the first worker, which is started for it
+    '''
+    global _wavedrom_version
+    if backend == "python" and wavedrom_svg.png_available():
+        return f"python {wavedrom_svg.RENDERER_VERSION}, {wavedrom_svg.png_version()}"
+    if backend == "server":
+        server_version = get_pool(workers).version()
+        if server_version is not None:
+            return server_version
+    if _wavedrom_version is None:
+        try:
+            output = subprocess.run(["wavedrom-cli", "--version"], capture_output=True, text=True, timeout=TIMEOUT).stdout.strip()
+        except Exception as e:
+            output = ""
+        _wavedrom_version = f"wavedrom-cli {output or 'unknown'}"
+    return _wavedrom_version
+
+
+def _node_path():
+    '''
+    Get the NODE_PATH under which the modules of wavedrom-cli can be found
+    '''
+    paths = []
+    if os.environ.get("NODE_PATH"):
+        paths.append(os.environ["NODE_PATH"])
+    try:
+        root = subprocess.run(["npm", "root", "-g"], capture_output=True, text=True, timeout=TIMEOUT).stdout.strip()
+    except Exception as e:
+        root = ""
+    if root:
+        # the modules wavedrom-cli depends on are either installed next to it or inside of it
+        paths.append(root)
+        paths.append(os.path.join(root, "wavedrom-cli", "node_modules"))
+    return os.pathsep.join(paths)
+
+
+class _RendererWorker:
+    '''
+    A single long lived node process running the wavedrom server
+    '''
+
+    def __init__(self, node_path):
+        env = dict(os.environ)
+        env["NODE_PATH"] = node_path
+        self._process = subprocess.Popen(["node", SERVER_SCRIPT], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         stderr=None if DEBUG else subprocess.DEVNULL, text=True, bufsize=1, env=env)
+        self._responses = queue.Queue()
+        self._next_id = 0
+        # the responses are read by a separate thread, so waiting for them can time out
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+        # the server announces when it loaded its modules, if it does not it will never be able to render
+        try:
+            ready = self._responses.get(timeout=TIMEOUT)
+        except queue.Empty:
+            ready = None
+        if ready is None or not ready.get("ready"):
+            self.kill()
+            raise RendererError("renderer worker did not start")
+        self.version = f"wavedrom server, {ready.get('version', 'unknown')}"
+        # without a rasterizer every png request fails, wavedrom-cli has to render them
+        if not ready.get("png"):
+            self.kill()
+            raise RendererError("renderer worker can not write pngs, install @resvg/resvg-js or sharp")
+
+    def _read(self):
+        for line in self._process.stdout:
+            try:
+                self._responses.put(json.loads(line))
+            except ValueError as e:
+                continue
+        self._responses.put(None) # the process exited
+
+    def render(self, jobs, results):
+        '''
+        Render the (json_file, png_file) jobs whose result is still False
+        Raises RendererError when the worker crashed or timed out, the results of the finished jobs are kept
+        '''
+        ids = {}
+        try:
+            for index, (json_file, png_file) in enumerate(jobs):
+                if results[index]:
+                    continue
+                self._next_id += 1
+                ids[self._next_id] = index
+                self._process.stdin.write(json.dumps({"id": self._next_id, "input": json_file, "png": png_file}) + "\n")
+            self._process.stdin.flush()
+        except OSError as e:
+            raise RendererError(f"renderer worker stopped: {e}")
+        while ids:
+            try:
+                response = self._responses.get(timeout=TIMEOUT)
+            except queue.Empty:
+                raise RendererError("renderer worker timed out")
+            if response is None:
+                raise RendererError("renderer worker crashed")
+            index = ids.pop(response.get("id"), None)
+            if index is not None:
+                results[index] = bool(response.get("ok"))
+
+    def close(self):
+        try:
+            self._process.stdin.close()
+            self._process.wait(timeout=TIMEOUT)
+        except Exception as e:
+            self.kill()
+
+    def kill(self):
+        self._process.kill()
+        self._process.wait()
+
+
+class RendererPool:
+    '''
+    Pool of renderer workers shared by all threads of the process
+    Workers are started when they are first needed, up to size of them
+    '''
+
+    def __init__(self, size):
+        self._size = size
+        self._started = 0
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._node_path = None
+        self._version = None
+        self.available = which("node") is not None and os.path.exists(SERVER_SCRIPT)
+
+    def _acquire(self):
+        while True:
+            with self._lock:
+                if not self._idle.empty():
+                    return self._idle.get_nowait()
+                if self._started < self._size:
+                    if self._node_path is None:
+                        self._node_path = _node_path()
+                    self._started += 1
+                    try:
+                        worker = _RendererWorker(self._node_path)
+                        self._version = worker.version
+                        return worker
+                    except Exception as e:
+                        self._started -= 1
+                        self.available = False
+                        raise RendererError(f"could not start renderer worker: {e}")
+            # all workers are busy, wait for one to be released or discarded
+            try:
+                return self._idle.get(timeout=1)
+            except queue.Empty:
+                continue
+
+    def _release(self, worker):
+        self._idle.put(worker)
+
+    def _discard(self, worker):
+        worker.kill()
+        with self._lock:
+            self._started -= 1
+
+    def version(self):
+        '''
+        Get the version of the renderer the workers run, see version(), a worker is started if none was yet
+        Returns None when no worker can be started
+        '''
+        if self._version is None and self.available:
+            try:
+                self._release(self._acquire())
+            except RendererError as e:
+                return None
+        return self._version if self.available else None
+
+    def render(self, jobs, retries=1):
+        '''
+        Render the (json_file, png_file) jobs, returns a list telling for every job whether its png was created
+        A worker which crashes or times out is replaced and the unfinished jobs are retried on the new worker
+        '''
+        results = [False] * len(jobs)
+        for attempt in range(retries + 1):
+            worker = self._acquire()
+            try:
+                worker.render(jobs, results)
+            except RendererError as e:
+                self._discard(worker)
+                continue
+            self._release(worker)
+            break
+        return results
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get().close()
+        with self._lock:
+            self._started = 0
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(size):
+    '''
+    Get the renderer pool of this process, creating it on first use
+    '''
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = RendererPool(size)
+        return _pool
+
+
+def render(jobs, backend="server", workers=1, out=subprocess.DEVNULL, err_out=subprocess.DEVNULL):
+    '''
+    Render the (json_file, png_file) jobs with the given backend
+    Returns a list with, for every job, the version of the renderer which created its png, see version(), or None if it was not created
+    Jobs the server or python backend could not render are rendered with wavedrom-cli instead
+    '''
+    results = [None] * len(jobs)
+    if backend == "python" and wavedrom_svg.png_available():
+        python_version = version("python")
+        for index, (json_file, png_file) in enumerate(jobs):
+            try:
+                results[index] = python_version if render_python(json_file, png_file) else None
+            except Exception as e:
+                results[index] = None
+    elif backend == "server":
+        pool = get_pool(workers)
+        if pool.available:
+            try:
+                server_version = pool.version()
+                results = [server_version if success else None for success in pool.render(jobs)]
+            except RendererError as e:
+                pass
+    for index, (json_file, png_file) in enumerate(jobs):
+        if results[index]:
+            continue
+        try:
+            results[index] = version("cli") if render_cli(json_file, png_file, out, err_out) else None
+        except Exception as e:
+            results[index] = None
+    return results
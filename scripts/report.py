@@ -0,0 +1,41 @@
+import scripts.catalog
+from scripts import telemetry
+
+'''
+Report of the telemetry recorded in the catalog, printed by `python main.py report`
+'''
+
+_PERCENTILES = [0.5, 0.95, 0.99]
+
+
+def _format(column, value):
+    if value is None:
+        return "-"
+    if column == "max_rss":
+        return f"{value / 1024:.0f}MB"
+    if column == "bytes_written":
+        return f"{value / 1024:.0f}KB"
+    return f"{value:.2f}s"
+
+
+def report(folder, top=10):
+    '''
+    Print the p50/p95/p99 of the measurements of every step, and the slowest modules
+    '''
+    with scripts.catalog.open_catalog(folder) as catalog:
+        steps = catalog.telemetry_steps()
+        if not steps:
+            print("No telemetry recorded yet")
+            return
+        for stage, step in steps:
+            outcomes = catalog.telemetry_outcomes(step)
+            print(f"{stage} / {step}: {outcomes.get('ok', 0)} ok, {outcomes.get('failed', 0)} failed")
+            for column, name in [("wall", "wall time"), ("cpu", "python cpu"), ("child_cpu", "tool cpu"),
+                                 ("max_rss", "peak rss"), ("bytes_written", "bytes written")]:
+                values = catalog.telemetry_values(step, column)
+                percentiles = "  ".join(f"p{round(p * 100)} {_format(column, telemetry.percentile(values, p)):>8}" for p in _PERCENTILES)
+                print(f"  {name:14} {percentiles}")
+        storage = catalog.storage()
+        print(f"Slowest {top} modules:")
+        for id, total, slowest_step, slowest in catalog.slowest_modules(top):
+            print(f"  {storage.module_folder(id)}: {total:.2f}s in total, {slowest:.2f}s in {slowest_step}")
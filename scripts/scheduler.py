@@ -0,0 +1,134 @@
+import os
+import time
+import collections
+import concurrent.futures
+
+'''
+Scheduler which moves every module through the steps of the pipeline as soon as its previous step finished,
+instead of waiting for all modules to finish a stage before the next stage starts.
+Every step belongs to a resource class (e.g. gentbvlog, iverilog/vvp, python parsing, rendering),
+and every resource class has its own limit on the number of steps running at once.
+The limits can be fixed, or be adjusted while running by a controller such as scripts.concurrency.AdaptiveLimits.
+'''
+
+
+class Step:
+    '''
+    A single step of the pipeline
+    stage is the name of the stage the step belongs to, a stage can consist of multiple steps
+    func is called with the folder of the module and should return whether the step succeeded
+    resource is the resource class used to limit the concurrency of the step
+    With pass_result, func is also given what the previous step of the module returned in this run, None if it did not run,
+    e.g. the meta data it already loaded, so it does not have to be loaded again
+    '''
+
+    def __init__(self, stage, func, resource, pass_result=False):
+        self.stage = stage
+        self.func = func
+        self.resource = resource
+        self.pass_result = pass_result
+
+
+class Scheduler:
+    '''
+    Runs the steps of the pipeline for a stream of modules
+    limits maps every resource class to the maximum number of steps of that class running at once
+    Resource classes listed in process_resources run in a process pool, the others in a thread pool,
+    so CPU heavy python code is not limited by the GIL
+    runner is called in the pool as runner(func, folder), or runner(func, folder, previous) for steps with pass_result,
+    and should return a tuple starting with whether the step succeeded and ending with what func returned
+    With a controller the limits are its current limits and the pools are sized to the limits given here, which are the ceilings
+    '''
+
+    def __init__(self, steps, limits, runner, process_resources=(), controller=None):
+        self.steps = steps
+        self.limits = dict(limits)
+        self.runner = runner
+        self.process_resources = set(process_resources)
+        self.controller = controller
+
+    def _create_executors(self):
+        executors = {}
+        # the process resources share one process pool, the limits of the resources are kept by run
+        # its workers are forked right away, before any thread of the thread pools exists, forking a process with threads can deadlock the child
+        process_limit = sum(limit for resource, limit in self.limits.items() if resource in self.process_resources)
+        if process_limit > 0:
+            processes = concurrent.futures.ProcessPoolExecutor(max_workers=process_limit)
+            processes.submit(os.getpid).result()
+            for resource in self.limits:
+                if resource in self.process_resources:
+                    executors[resource] = processes
+        for resource, limit in self.limits.items():
+            if resource not in self.process_resources:
+                executors[resource] = concurrent.futures.ThreadPoolExecutor(max_workers=limit)
+        return executors
+
+    def run(self, modules, on_step_done, max_in_flight=None):
+        '''
+        Run the pipeline for the modules, an iterable of (id, folder, first_step) tuples where first_step is an index into the steps
+        on_step_done(id, step, result, finished) is called from the calling thread whenever a step finished,
+        finished tells whether the module leaves the pipeline, either because the step failed or because it was the last step
+        Only max_in_flight modules are in the pipeline at once, so the modules can be generated lazily
+        '''
+        if max_in_flight is None:
+            max_in_flight = 2 * sum(self.limits.values())
+        modules = iter(modules)
+        exhausted = False
+        in_flight = 0
+        ready = {resource: collections.deque() for resource in self.limits}
+        running = {resource: 0 for resource in self.limits}
+        futures = {}
+        executors = self._create_executors()
+        try:
+            while True:
+                # admit new modules into the pipeline
+                while not exhausted and in_flight < max_in_flight:
+                    try:
+                        id, folder, first_step = next(modules)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    if first_step >= len(self.steps):
+                        continue
+                    ready[self.steps[first_step].resource].append((id, folder, first_step, None))
+                    in_flight += 1
+
+                limits = self.limits
+                if self.controller is not None:
+                    saturated = [resource for resource, queue in ready.items() if queue and running[resource] >= self.controller.limits[resource]]
+                    limits = self.controller.update(saturated)
+
+                # start as many steps as the resource classes allow
+                for resource, queue in ready.items():
+                    while queue and running[resource] < limits[resource]:
+                        id, folder, index, previous = queue.popleft()
+                        step = self.steps[index]
+                        args = (previous,) if step.pass_result else ()
+                        future = executors[resource].submit(self.runner, step.func, folder, *args)
+                        futures[future] = (id, folder, index, time.monotonic())
+                        running[resource] += 1
+
+                if not futures:
+                    if exhausted:
+                        break
+                    continue
+
+                # with a controller, wake up regularly so raised limits are used without waiting for a step to finish
+                timeout = self.controller.interval if self.controller is not None else None
+                done, _ = concurrent.futures.wait(futures, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    id, folder, index, submitted = futures.pop(future)
+                    step = self.steps[index]
+                    running[step.resource] -= 1
+                    if self.controller is not None:
+                        self.controller.observe(step.resource, time.monotonic() - submitted)
+                    result = future.result()
+                    finished = not result[0] or index + 1 == len(self.steps)
+                    on_step_done(id, step, result, finished)
+                    if finished:
+                        in_flight -= 1
+                    else:
+                        ready[self.steps[index + 1].resource].append((id, folder, index + 1, result[-1]))
+        finally:
+            for executor in executors.values():
+                executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,136 @@
+import os
+import shutil
+import hashlib
+import scripts.catalog
+from scripts import dedup
+
+'''
+Sharding of the dataset over multiple machines
+Every module belongs to exactly one of N shards, decided by a stable hash of its content digest, or of its id when it has no digest.
+Duplicates have the same digest and end up in the same shard, so deduplicating every shard separately deduplicates the whole dataset.
+Every machine runs main.py with --shard i/N on its own dataset folder, and merge() combines the folders of the shards into a single dataset afterwards.
+Shards can not share a folder: the SQLite catalog is unreliable on network file systems, creating a shard without --append removes the folder
+and its catalog, and shards adding to the same catalog would take the same ids. A folder records the shard it was created for, see check_folder.
+'''
+
+
+def parse_shard(value):
+    '''
+    Parse a shard given as "i/N" into the tuple (i, N), with 0 <= i < N
+    '''
+    index, _, count = value.partition("/")
+    if not index.strip().isdigit() or not count.strip().isdigit():
+        raise ValueError(f"shard should be given as i/N: {value}")
+    index, count = int(index), int(count)
+    if count < 1 or index >= count:
+        raise ValueError(f"shard index should be between 0 and {count - 1}: {value}")
+    return index, count
+
+
+def shard_of(digest, id, count):
+    '''
+    Get the shard of a module
+    The digest is already a hash, so its first 64 bits are used directly, ids are hashed first
+    '''
+    if not digest:
+        digest = hashlib.blake2b(str(id).encode("utf-8"), digest_size=16).hexdigest()
+    return int(digest[:16], 16) % count
+
+
+def in_shard(digest, id, shard):
+    '''
+    Check if a module belongs to the shard, a (i, N) tuple, None means there is no sharding
+    '''
+    return shard is None or shard_of(digest, id, shard[1]) == shard[0]
+
+
+def format_shard(shard):
+    '''
+    Format a (i, N) tuple as "i/N", None stays None
+    '''
+    return None if shard is None else f"{shard[0]}/{shard[1]}"
+
+
+def check_folder(folder, shard):
+    '''
+    Make sure creating the modules of the shard in the dataset folder does not touch the modules of another shard
+    Raises ValueError if the folder already has modules which were created for another shard or without sharding
+    '''
+    if shard is None or not os.path.exists(scripts.catalog.catalog_path(folder)):
+        return
+    with scripts.catalog.Catalog(folder) as catalog:
+        stored = catalog.get_setting("shard")
+        if catalog.next_id() > 0 and stored != format_shard(shard):
+            owner = f"shard {stored}" if stored is not None else "a run without --shard"
+            raise ValueError(f"{folder} holds the modules of {owner}, every shard needs its own folder, combine them with --merge afterwards")
+
+
+# files of a module folder which the stages only ever replace, never write into, so the merged folder can share them with the shard
+# the images and wavedrom jsons in img/ are replaced as well, wfgen recreates the folder and removes an image before rendering it again
+_LINKED_FILES = {"module.v", "tb_instrumented.v", "iverilog_out", "dump.vcd"}
+
+
+def _link_tree(src, dst):
+    '''
+    Copy a module folder by hardlinking its files, falling back to copying across file systems
+    Only the files in _LINKED_FILES and img/ are hardlinked, the others are copied,
+    e.g. tb.v is written into by gentbvlog, meta.json by every stage, and the debug output of the tools by the next run
+    '''
+    def link(src_file, dst_file):
+        if os.path.basename(src_file) not in _LINKED_FILES and os.path.basename(os.path.dirname(src_file)) != "img":
+            return shutil.copy2(src_file, dst_file)
+        try:
+            os.link(src_file, dst_file)
+        except OSError as e:
+            shutil.copy2(src_file, dst_file)
+        return dst_file
+    shutil.copytree(src, dst, copy_function=link)
+
+
+def merge(sources, target, dedup_index_path=None, layout=None):
+    '''
+    Merge the dataset folders of the shards into the target dataset folder
+    The modules are renumbered after the modules already in the target, in the order of the sources and their ids,
+    their folders are hardlinked and their catalog entries, including failures, stage timings and telemetry, are copied
+    Modules whose digest is already in the target are skipped, with dedup_index_path the target dedup index is updated as well
+    A new target gets the given layout, the folders of the shards are found through their own layouts
+    Returns the number of merged and skipped modules
+    '''
+    merged = 0
+    skipped = 0
+    if os.path.realpath(target) in [os.path.realpath(source) for source in sources]:
+        raise ValueError("the target folder can not be one of the shards")
+    dedup_index = dedup.DedupIndex(dedup_index_path) if dedup_index_path is not None else None
+    with scripts.catalog.open_catalog(target) as target_catalog:
+        os.makedirs(target, exist_ok=True)
+        target_storage = target_catalog.storage(layout)
+        id = target_catalog.next_id()
+        digests = target_catalog.digests()
+        try:
+            for source in sources:
+                print(f"Merging {source} into {target}")
+                with scripts.catalog.open_catalog(source) as source_catalog:
+                    source_storage = source_catalog.storage()
+                    for module in source_catalog.iter_modules():
+                        digest = module["digest"]
+                        if digest is not None and digest in digests:
+                            skipped += 1
+                            continue
+                        src = source_storage.module_folder(module["id"])
+                        dst = target_storage.module_folder(id)
+                        if os.path.exists(dst):
+                            raise FileExistsError(f"{dst} already exists but is not in the catalog of {target}")
+                        if os.path.exists(src):
+                            os.makedirs(os.path.dirname(dst), exist_ok=True)
+                            _link_tree(src, dst)
+                        target_catalog.import_module(id, module, source_catalog.stage_runs(module["id"]), source_catalog.telemetry(module["id"]))
+                        if digest is not None:
+                            digests.add(digest)
+                            if dedup_index is not None:
+                                dedup_index.add(digest)
+                        id += 1
+                        merged += 1
+        finally:
+            if dedup_index is not None:
+                dedup_index.close()
+    return merged, skipped
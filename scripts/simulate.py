@@ -1,57 +1,216 @@
 import os
 from scripts import meta_data
 import subprocess
+import resource
+import shutil
+import tempfile
 from shutil import which
+from scripts import cache
+from scripts import telemetry
 
 DEBUG = False
 
+# scratch workspaces are created on tmpfs when it is available, keeping the small files of the tools off the dataset disk
+TMPFS = "/dev/shm"
+
+# resource limits for the compilation and simulation processes
+MAX_CPU_SECONDS = 15
+MAX_MEMORY = 2 * 1024 * 1024 * 1024 # bytes of address space
+MAX_OUTPUT_SIZE = 256 * 1024 * 1024 # bytes per written file, mostly limits the size of dump.vcd
+
+# testbench with the timescale and the vcd dump added, derived from tb.v by instrument_testbench
+INSTRUMENTED_TESTBENCH = "tb_instrumented.v"
+
+COMPILE_ARGS = ["iverilog", "module.v", "tb.v", "-o", "iverilog_out"]
+SIMULATE_ARGS = ["vvp", "iverilog_out"]
+
+# folder of the simulation cache, which stores iverilog_out and dump.vcd by a hash of everything they are created from, None disables the cache
+SIM_CACHE = None
+# maximum size of the simulation cache in bytes
+SIM_CACHE_SIZE = 4 * 1024 * 1024 * 1024
+_sim_cache = None
+_tool_versions = None
+
+# reasons a simulation fails with, the counter tells compiled modules apart by them
+COMPILE_FAILED = "compilation failed"
+SIMULATION_FAILED = "simulation failed"
+
+
+class SimulationError(Exception):
+    pass
+
+
+def _scratch_dir():
+    '''
+    Create an isolated scratch workspace for a single compile or simulate job
+    '''
+    root = TMPFS if os.path.isdir(TMPFS) and os.access(TMPFS, os.W_OK) else None
+    return tempfile.mkdtemp(prefix="vsim_", dir=root)
+
+
+def _resource_limits():
+    '''
+    Resource limits of the tools, applied by telemetry.run_tool from this process right after a tool started
+    '''
+    return {resource.RLIMIT_CPU: MAX_CPU_SECONDS, resource.RLIMIT_AS: MAX_MEMORY, resource.RLIMIT_FSIZE: MAX_OUTPUT_SIZE}
+
+
+def _copy_back(src, dst):
+    '''
+    Copy a result out of the scratch workspace
+    The old file is removed first, it can be a hardlink into the simulation cache which must not be overwritten
+    '''
+    if os.path.lexists(dst):
+        os.remove(dst)
+    shutil.copyfile(src, dst)
+
+
+def _run_tool(subprocess_args, folder, scratch, name):
+    '''
+    Run a tool inside the scratch workspace with the resource limits applied
+    In debug mode the output of the tool is stored in the dataset folder
+    '''
+    if DEBUG:
+        with open(os.path.join(folder, f"{name}_stderr"), "w") as err:
+            with open(os.path.join(folder, f"{name}_stdout"), "w") as out:
+                telemetry.run_tool(subprocess_args, check=True, stdout=out, stderr=err, timeout=10, cwd=scratch, limits=_resource_limits())
+    else:
+        telemetry.run_tool(subprocess_args, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=10, cwd=scratch, limits=_resource_limits())
+
+
+def get_sim_cache():
+    '''
+    Get the simulation cache of this process, None when the cache is disabled
+    '''
+    global _sim_cache
+    if SIM_CACHE is None:
+        return None
+    if _sim_cache is None or _sim_cache.path != SIM_CACHE:
+        _sim_cache = cache.ContentCache(SIM_CACHE, SIM_CACHE_SIZE)
+    return _sim_cache
+
+
+def _get_tool_versions():
+    '''
+    Get the versions of iverilog and vvp, the first line they print with -V
+    '''
+    global _tool_versions
+    if _tool_versions is None:
+        versions = []
+        for tool in ["iverilog", "vvp"]:
+            try:
+                output = subprocess.run([tool, "-V"], capture_output=True, text=True, timeout=10).stdout
+                versions.append(output.splitlines()[0] if output else f"{tool} unknown")
+            except Exception as e:
+                versions.append(f"{tool} unknown")
+        _tool_versions = "\n".join(versions)
+    return _tool_versions
+
+
+def _simulation_key(folder):
+    '''
+    Key of the simulation results in the cache, a hash of the module, the instrumented testbench, the tool versions and their arguments
+    '''
+    return cache.cache_key(cache.file_digest(os.path.join(folder, "module.v")), cache.file_digest(os.path.join(folder, INSTRUMENTED_TESTBENCH)),
+                           _get_tool_versions(), " ".join(COMPILE_ARGS), " ".join(SIMULATE_ARGS))
+
+
+def fingerprint():
+    '''
+    Fingerprint of the parameters the simulations run with, see scripts.catalog.Catalog.iter_ready
+    The tools themselves are not part of it, a new version of them only misses the simulation cache
+    '''
+    return cache.cache_key(INSTRUMENTED_TESTBENCH, " ".join(COMPILE_ARGS), " ".join(SIMULATE_ARGS))
+
+
+def simulate(folder):
+    '''
+    Compile and run the simulation of the module in the folder
+    When the simulation cache holds the results for the same inputs, iverilog_out and dump.vcd are taken from it and no tool is started
+    Raises SimulationError with COMPILE_FAILED or SIMULATION_FAILED when iverilog or vvp failed
+    '''
+    if not os.path.exists(os.path.join(folder, INSTRUMENTED_TESTBENCH)):
+        instrument_testbench(folder)
+    sim_cache = get_sim_cache()
+    files = {"iverilog_out": os.path.join(folder, "iverilog_out"), "dump.vcd": os.path.join(folder, "dump.vcd")}
+    if sim_cache is not None:
+        key = _simulation_key(folder)
+        if sim_cache.get(key, files):
+            return True
+    if not _compile(folder):
+        raise SimulationError(COMPILE_FAILED)
+    if not run_simulation(folder):
+        raise SimulationError(SIMULATION_FAILED)
+    if sim_cache is not None:
+        sim_cache.put(key, files)
+    return True
+
+
+def instrument_testbench(folder):
+    '''
+    Derive the testbench used for the simulation, tb_instrumented.v, from the generated tb.v
+    tb.v is never changed and the derived file is only written once, so retrying or resuming the simulation does not stack directives
+    scripts.tb_gen.generate_testbench already records the derived file as "testbench" in meta.json
+    '''
+    instrumented = os.path.join(folder, INSTRUMENTED_TESTBENCH)
+    if not os.path.exists(instrumented):
+        with open(os.path.join(folder, "tb.v"), "r") as f:
+            content = f.read()
+        # the testbench generator does not add a timescale to the testbench which causes the wrong time in the simulation output
+        # it also does not add code for creating the vcd file
+        # testbenches instrumented in place by older versions already have both
+        if not content.startswith("`timescale"):
+            content = "`timescale 1ns/1ns\n" + content
+        if "$dumpfile" not in content:
+            # the testbench module is the last one, add the code right before its endmodule
+            head, endmodule, tail = content.rpartition("endmodule")
+            content = head + "initial begin\n$dumpfile(\"dump.vcd\");\n$dumpvars(0, testbench);\nend\n" + endmodule + tail
+        with open(instrumented + ".tmp", "w") as f:
+            f.write(content)
+        os.replace(instrumented + ".tmp", instrumented)
+    return True
+
+
 def compile(folder):
     '''
     Compile testbench and module together using Icarus Verilog
+    The compilation runs in its own scratch workspace, only iverilog_out is copied back into the folder
     '''
-    subprocess_args = ["iverilog", f"{folder}/module.v", f"{folder}/tb.v", "-o", f"{folder}/iverilog_out"]
-    # the testbench generator does not add a timescale to the testbench which causes the wrong time in the simulation output
-    # it also does not add code for creating the vcd file
-    with open(os.path.join(folder, "tb.v"), "r+") as f:
-        content = f.read()
-        f.seek(0, 0)
-        # content always ends with `endmodule` so we can just add the code before that
-        content = content.replace("endmodule", "initial begin\n$dumpfile(\"dump.vcd\");\n$dumpvars(0, testbench);\nend\nendmodule")
-        f.write("`timescale 1ns/1ns\n" + content)
+    instrument_testbench(folder)
+    return _compile(folder)
+
 
+def _compile(folder):
+    scratch = _scratch_dir()
     try:
-        if DEBUG:
-            with open(os.path.join(folder, "iverilog_stderr"), "w") as err:
-                with open(os.path.join(folder, "iverilog_stdout"), "w") as out:
-                    subprocess.run(subprocess_args, check=True, stdout=out, stderr=err, timeout=10)
-        else:
-            subprocess.run(subprocess_args, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=10)
+        shutil.copyfile(os.path.join(folder, "module.v"), os.path.join(scratch, "module.v"))
+        shutil.copyfile(os.path.join(folder, INSTRUMENTED_TESTBENCH), os.path.join(scratch, "tb.v"))
+        _run_tool(COMPILE_ARGS, folder, scratch, "iverilog")
+        _copy_back(os.path.join(scratch, "iverilog_out"), os.path.join(folder, "iverilog_out"))
     except Exception as e:
         if DEBUG:
             with open(os.path.join(folder, "iverilog_err.txt"), "w") as f:
                 f.write(str(e))
         return False
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
     return True
 
 def run_simulation(folder):
     '''
     Run the compiled simulation
+    The simulation runs in its own scratch workspace, only dump.vcd is copied back into the folder
     '''
-    cwd = os.getcwd()
-    os.chdir(folder)
-    subprocess_args = ["vvp", "iverilog_out"]
+    scratch = _scratch_dir()
     try:
-        if DEBUG:
-            with open(os.path.join(folder, "vvp_stderr"), "w") as err:
-                with open(os.path.join(folder, "vvp_stdout"), "w") as out:
-                    subprocess.run(subprocess_args, check=True, stdout=out, stderr=err, timeout=10)
-        else:
-            subprocess.run(subprocess_args, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=10)
+        shutil.copyfile(os.path.join(folder, "iverilog_out"), os.path.join(scratch, "iverilog_out"))
+        _run_tool(SIMULATE_ARGS, folder, scratch, "vvp")
+        _copy_back(os.path.join(scratch, "dump.vcd"), os.path.join(folder, "dump.vcd"))
     except Exception as e:
         if DEBUG:
             with open(os.path.join(folder, "vvp_err.txt"), "w") as f:
                 f.write(str(e))
-        os.chdir(cwd)
         return False
-    os.chdir(cwd)
-    return True
\ No newline at end of file
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return True
@@ -0,0 +1,98 @@
+import os
+import shutil
+import hashlib
+
+'''
+Layout of the module folders inside the dataset folder
+flat = every ds_{id} folder directly inside the dataset folder, as datasets created before the layouts existed
+fanout = ds_{id} folders spread over two levels of 256 folders each, by a hash of the id, so no folder holds more than a few entries per thousand modules
+The layout of a dataset is stored in its catalog, every stage gets the folders of the modules from the Storage of the dataset.
+The tools (gentbvlog, iverilog, vvp, wavedrom) need the files of a module in a real folder, so an archive based layout would have to unpack
+every module anyway; packed output for training is produced by the export stage instead, see scripts.export.
+'''
+
+LAYOUTS = ["flat", "fanout"]
+
+# layout of new datasets
+DEFAULT_LAYOUT = "fanout"
+
+
+def _fanout(id):
+    h = hashlib.blake2b(str(id).encode("utf-8"), digest_size=2).hexdigest()
+    return h[:2], h[2:]
+
+
+def _module_id(name):
+    '''
+    Get the id of a module folder name, None if it is not a module folder
+    '''
+    if name.startswith("ds_") and name[3:].isdigit():
+        return int(name[3:])
+    return None
+
+
+def find_modules(root):
+    '''
+    Find the module folders in the dataset folder in any layout, yields (id, path) tuples
+    '''
+    if not os.path.isdir(root):
+        return
+    for entry in os.scandir(root):
+        if not entry.is_dir():
+            continue
+        id = _module_id(entry.name)
+        if id is not None:
+            yield id, entry.path
+        elif len(entry.name) == 2:
+            for sub in os.scandir(entry.path):
+                if sub.is_dir() and len(sub.name) == 2:
+                    for module in os.scandir(sub.path):
+                        id = _module_id(module.name)
+                        if id is not None and module.is_dir():
+                            yield id, module.path
+
+
+def detect_layout(root):
+    '''
+    Detect the layout of an existing dataset folder from its contents, None if it holds no modules
+    '''
+    for id, path in find_modules(root):
+        return "flat" if os.path.dirname(path) == root.rstrip(os.sep) else "fanout"
+    return None
+
+
+class Storage:
+    '''
+    Maps the ids of the modules to their folders following the layout of the dataset
+    '''
+
+    def __init__(self, root, layout):
+        if layout not in LAYOUTS:
+            raise ValueError(f"unknown layout {layout}, should be one of {LAYOUTS}")
+        self.root = root
+        self.layout = layout
+
+    def module_folder(self, id):
+        '''
+        Get the folder of the module with the given id
+        '''
+        if self.layout == "fanout":
+            return os.path.join(self.root, *_fanout(id), f"ds_{id}")
+        return os.path.join(self.root, f"ds_{id}")
+
+    def create_module(self, id):
+        '''
+        Create the folder of a new module and return it
+        '''
+        folder = self.module_folder(id)
+        os.makedirs(folder)
+        return folder
+
+    def remove_module(self, id):
+        shutil.rmtree(self.module_folder(id), ignore_errors=True)
+
+    def iter_modules(self):
+        '''
+        Iterate over the module folders that exist, yields (id, path) tuples
+        '''
+        return find_modules(self.root)
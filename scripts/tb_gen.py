@@ -1,5 +1,8 @@
 import os
 from scripts import meta_data
+from scripts import telemetry
+from scripts import cache
+from scripts import simulate
 import subprocess
 from shutil import which
 
@@ -16,9 +19,18 @@ def init(max_sim_time):
         print("Be sure to 'source setup_env.sh' inside the utils/vlogtbgen directory")
 
 
+def fingerprint():
+    '''
+    Fingerprint of the parameters the testbenches are generated with, see scripts.catalog.Catalog.iter_ready
+    '''
+    return cache.cache_key("max_sim_time", str(MAX_SIM_TIME))
+
+
 def generate_testbench(folder):
     '''
     Generate testbench for the verilog module in the folder
+    The testbench the simulation uses, derived from tb.v by scripts.simulate.instrument_testbench, is recorded in the meta data here,
+    so the sim stage does not have to load and store meta.json again
     '''
     global MAX_SIM_TIME
     meta = meta_data.MetaData()
@@ -28,6 +40,9 @@ def generate_testbench(folder):
     name = meta.meta["module_name"]
     in_file = os.path.join(folder, "module.v")
     out_file = os.path.join(folder, "tb.v")
+    # the instrumented testbench of an earlier testbench is outdated, see scripts.simulate.instrument_testbench
+    if os.path.exists(os.path.join(folder, simulate.INSTRUMENTED_TESTBENCH)):
+        os.remove(os.path.join(folder, simulate.INSTRUMENTED_TESTBENCH))
     subprocess_args = ["gentbvlog", "-in", in_file, "-top", name, "-out", out_file, "-max_sim_time", f"{MAX_SIM_TIME}"]
     for clk in meta.meta["clocks"]:
         subprocess_args.extend(["-clk", clk])
@@ -37,9 +52,9 @@ def generate_testbench(folder):
         if DEBUG:
             with open(os.path.join(folder, "gentbvlog_stderr"), "w") as err:
                 with open(os.path.join(folder, "gentbvlog_stdout"), "w") as out:
-                    subprocess.run(subprocess_args, stdout=out, stderr=err, timeout=500)
+                    telemetry.run_tool(subprocess_args, stdout=out, stderr=err, timeout=500)
         else:
-            subprocess.run(subprocess_args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=500)
+            telemetry.run_tool(subprocess_args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=500)
     except Exception as e:
         if DEBUG:
             error_file = open(f"{folder}/gentbvlog_err.txt", "w")
@@ -47,7 +62,10 @@ def generate_testbench(folder):
             error_file.close()
         return False
     # check if file was actually created
-    if os.path.exists(f"{folder}/tb.v"):
-        return True
-    return False
+    if not os.path.exists(f"{folder}/tb.v"):
+        return False
+    if meta.meta.get("testbench") != simulate.INSTRUMENTED_TESTBENCH:
+        meta.meta["testbench"] = simulate.INSTRUMENTED_TESTBENCH
+        meta.store()
+    return True
     
\ No newline at end of file
@@ -0,0 +1,123 @@
+import os
+import math
+import time
+import resource
+import threading
+import subprocess
+
+'''
+Telemetry of the pipeline steps
+Every step is measured in the thread or process running it: wall time, cpu time of the python code,
+cpu time and peak memory of the tools it started, and how much the module folder grew.
+The tools are started with run_tool, which collects their resource usage with os.wait4 so it can be attributed to the step,
+even when many steps run their tools at the same time.
+'''
+
+_local = threading.local()
+
+
+def begin():
+    '''
+    Start measuring a step in the current thread
+    '''
+    _local.usage = {"child_user": 0.0, "child_system": 0.0, "max_rss": 0, "tools": 0}
+    _local.cpu_started = time.thread_time()
+
+
+def end():
+    '''
+    Stop measuring the step of the current thread and return its usage
+    max_rss is the peak memory in KB of the largest tool, None for steps without tools
+    the peak of the process would be shared by all steps that ever ran in it, so it says nothing about the step
+    '''
+    usage = getattr(_local, "usage", None)
+    if usage is None:
+        return None
+    usage["cpu"] = time.thread_time() - _local.cpu_started
+    if usage["tools"] == 0:
+        usage["max_rss"] = None
+    _local.usage = None
+    return usage
+
+
+def folder_size(folder):
+    '''
+    Total size of the files in the module folder, including img/
+    '''
+    size = 0
+    try:
+        for entry in os.scandir(folder):
+            if entry.is_dir(follow_symlinks=False):
+                size += folder_size(entry.path)
+            else:
+                size += entry.stat(follow_symlinks=False).st_size
+    except OSError as e:
+        pass
+    return size
+
+
+def run_tool(args, timeout=None, check=False, limits=None, **kwargs):
+    '''
+    Run a tool like subprocess.run, but collect its resource usage for the step running in this thread
+    limits is a dict of resource limits, e.g. {resource.RLIMIT_CPU: 15}, which are set on the tool with resource.prlimit right after it started
+    a preexec_fn would do this in the forked child, which is not safe while other threads are running
+    Output can only be redirected to files, returns the exit code
+    Raises subprocess.TimeoutExpired and, with check, subprocess.CalledProcessError like subprocess.run
+    '''
+    process = subprocess.Popen(args, **kwargs)
+    try:
+        for limit, value in (limits or {}).items():
+            resource.prlimit(process.pid, limit, (value, value))
+    except ProcessLookupError as e:
+        pass # the tool already exited
+    except BaseException as e:
+        process.kill()
+        process.wait()
+        raise
+    timed_out = threading.Event()
+    exited = threading.Event()
+    lock = threading.Lock()
+
+    def kill():
+        with lock:
+            # the tool can exit right before the timer fires, then it did not time out
+            # once it is reaped its pid can be reused by another process, which must not be killed
+            if exited.is_set() or os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is not None:
+                return
+            timed_out.set()
+            process.kill()
+
+    timer = threading.Timer(timeout, kill) if timeout is not None else None
+    if timer is not None:
+        timer.start()
+    try:
+        # wait for the tool to exit without reaping it, it is only reaped once the timer can no longer kill it
+        os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+        with lock:
+            exited.set()
+        _, status, usage = os.wait4(process.pid, 0)
+    finally:
+        if timer is not None:
+            timer.cancel()
+    process.returncode = os.waitstatus_to_exitcode(status)
+    current = getattr(_local, "usage", None)
+    if current is not None:
+        current["child_user"] += usage.ru_utime
+        current["child_system"] += usage.ru_stime
+        current["max_rss"] = max(current["max_rss"], usage.ru_maxrss)
+        current["tools"] += 1
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(args, timeout)
+    if check and process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, args)
+    return process.returncode
+
+
+def percentile(values, fraction):
+    '''
+    Get the percentile of the sorted values, using the nearest rank
+    '''
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, math.ceil(fraction * len(values)) - 1))
+    return values[index]
@@ -0,0 +1,55 @@
+import re
+
+'''
+Single pass lexer used while ingesting verilog code
+It strips comments and splits concatenated files into their modules, with or without their comments, in linear time,
+without being fooled by comment markers inside strings, "//" inside block comments or identifiers like endmodule_x
+'''
+
+# order matters, the first alternative that matches at a position wins
+# - line comments run up to, but not including, the end of the line
+# - block comments run up to the first */, or to the end of the code if they are never closed
+# - strings are matched so comment markers inside them are left alone
+# - endmodule only counts as a keyword when it is not part of a longer (escaped) identifier
+_TOKEN_REGEX = re.compile(r'''
+      (?P<line>//[^\n]*)
+    | (?P<block>/\*.*?(?:\*/|\Z))
+    | (?P<string>"(?:\\.|[^"\\\n])*"?)
+    | (?P<end>(?<![\w$\\])endmodule(?![\w$]))
+''', re.DOTALL | re.VERBOSE)
+
+
+def strip_comments(code):
+    '''
+    Remove all comments from the code
+    '''
+    pieces = []
+    pos = 0
+    for match in _TOKEN_REGEX.finditer(code):
+        kind = match.lastgroup
+        if kind == "string" or kind == "end":
+            continue # kept as is, they are copied together with the code around them
+        pieces.append(code[pos:match.start()])
+        pos = match.end()
+    pieces.append(code[pos:])
+    return "".join(pieces)
+
+
+def iter_modules(code, strip_comments=True):
+    '''
+    Yield the modules in the code one by one, with their comments removed unless strip_comments is False
+    Each module contains all code since the end of the previous module, so compiler directives and comments stay with the module that follows them
+    Code after the last endmodule does not form a complete module and is dropped
+    '''
+    pieces = []
+    pos = 0
+    for match in _TOKEN_REGEX.finditer(code):
+        kind = match.lastgroup
+        if kind == "string" or (not strip_comments and kind != "end"):
+            continue
+        pieces.append(code[pos:match.start()])
+        pos = match.end()
+        if kind == "end":
+            pieces.append("endmodule")
+            yield "".join(pieces)
+            pieces = []
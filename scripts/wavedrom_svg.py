@@ -0,0 +1,164 @@
+from xml.sax.saxutils import escape
+
+'''
+In process renderer for the subset of WaveJSON that generate_wavedroms emits:
+"p" clocks, "0", "1", "x", "z" and "." levels, "=" data segments with their "data" labels and "head.tock".
+It creates SVG, and PNG when cairosvg is installed, without starting any external tool.
+The layout follows the default wavedrom skin, but the output is not meant to be identical to it.
+'''
+
+# bump when the output changes, so cached images made by an older version are not reused
+RENDERER_VERSION = "1"
+
+PERIOD = 40 # width of one wave character
+LANE = 30 # height of one signal lane
+HEIGHT = 20 # height of a wave within its lane
+SLOPE = 3 # width of the transitions between values
+CHAR_WIDTH = 7 # approximate width of a character of the labels
+MARGIN = 10
+
+_STYLE = "text{font-family:Helvetica,Arial,sans-serif;font-size:11px}" \
+         ".w{fill:none;stroke:#000;stroke-width:1}" \
+         ".g{stroke:#888;stroke-width:0.5;stroke-dasharray:1,3}"
+
+
+def _signals(source):
+    '''
+    Flatten the signal list, groups are lists whose first element is their name
+    Empty objects are kept as empty lanes
+    '''
+    signals = []
+    for signal in source.get("signal", []):
+        if isinstance(signal, list):
+            signals.extend(_signals({"signal": signal[1:]}))
+        elif isinstance(signal, dict):
+            signals.append(signal)
+    return signals
+
+
+def _segments(wave, data):
+    '''
+    Split a wave into segments of [state, start, length, label]
+    "." extends the previous segment, "=" starts a data segment which takes the next label
+    '''
+    if isinstance(data, str):
+        data = data.split()
+    labels = iter(data or [])
+    segments = []
+    for i, char in enumerate(wave):
+        if char in ".|":
+            if segments:
+                segments[-1][2] += 1
+            else:
+                segments.append(["x", i, 1, None])
+        elif char in "=2345":
+            segments.append(["=", i, 1, next(labels, "")])
+        else:
+            segments.append([char, i, 1, None])
+    return segments
+
+
+def _level(state, top):
+    '''
+    Get the y coordinate of a single bit state, None for states drawn as a bus
+    '''
+    if state in "1hHP":
+        return top
+    if state in "0lLpnN":
+        return top + HEIGHT
+    if state == "z":
+        return top + HEIGHT / 2
+    return None
+
+
+def _lane(segments, x0, top):
+    '''
+    Create the svg elements of a single lane
+    '''
+    elements = []
+    mid = top + HEIGHT / 2
+    bottom = top + HEIGHT
+    previous = None
+    for state, start, length, label in segments:
+        xs = x0 + start * PERIOD
+        xe = x0 + (start + length) * PERIOD
+        if state in "pPnN":
+            # clocks repeat their shape for every period
+            high_first = state in "nN"
+            path = []
+            for k in range(length):
+                cx = xs + k * PERIOD
+                first, second = (top, bottom) if not high_first else (bottom, top)
+                path.append(f"M{cx},{second}L{cx},{first}L{cx + PERIOD / 2},{first}L{cx + PERIOD / 2},{second}L{cx + PERIOD},{second}")
+            elements.append(f'<path class="w" d="{"".join(path)}"/>')
+        elif state in "=x" or _level(state, top) is None:
+            fill = "#fff" if state == "=" else "#ccc"
+            points = f"{xs},{mid} {xs + SLOPE},{top} {xe - SLOPE},{top} {xe},{mid} {xe - SLOPE},{bottom} {xs + SLOPE},{bottom}"
+            elements.append(f'<polygon class="w" style="fill:{fill}" points="{points}"/>')
+            if label:
+                elements.append(f'<text x="{(xs + xe) / 2}" y="{mid + 4}" text-anchor="middle">{escape(str(label))}</text>')
+        else:
+            y = _level(state, top)
+            previous_y = _level(previous, top) if previous is not None else None
+            if previous_y is not None and previous_y != y and previous not in "pPnN":
+                elements.append(f'<path class="w" d="M{xs - SLOPE},{previous_y}L{xs},{y}"/>')
+            elements.append(f'<path class="w" d="M{xs},{y}L{xe},{y}"/>')
+        previous = state
+    return elements
+
+
+def render_svg(source):
+    '''
+    Render the WaveJSON source, given as a dict, to an svg string
+    '''
+    signals = _signals(source)
+    names = [str(signal.get("name", "")) for signal in signals]
+    periods = max([len(signal.get("wave", "")) for signal in signals] + [1])
+    x0 = MARGIN + CHAR_WIDTH * max([len(name) for name in names] + [0]) + MARGIN
+    tock = source.get("head", {}).get("tock")
+    y0 = MARGIN + (LANE if tock is not None else 0)
+    width = x0 + periods * PERIOD + MARGIN
+    height = y0 + len(signals) * LANE + MARGIN
+
+    elements = [f'<rect width="{width}" height="{height}" style="fill:#fff"/>']
+    for k in range(periods + 1):
+        x = x0 + k * PERIOD
+        elements.append(f'<path class="g" d="M{x},{y0 - 5}L{x},{height - MARGIN}"/>')
+    if tock is not None:
+        for k in range(periods):
+            elements.append(f'<text x="{x0 + k * PERIOD + PERIOD / 2}" y="{y0 - 10}" text-anchor="middle">{int(tock) + k}</text>')
+    for i, signal in enumerate(signals):
+        top = y0 + i * LANE
+        elements.append(f'<text x="{x0 - MARGIN}" y="{top + HEIGHT / 2 + 4}" text-anchor="end">{escape(names[i])}</text>')
+        elements.extend(_lane(_segments(signal.get("wave", ""), signal.get("data")), x0, top))
+
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="0 0 {width} {height}">'
+            f'<style>{_STYLE}</style>' + "".join(elements) + '</svg>')
+
+
+def png_available():
+    '''
+    Check if svgs can be rasterized to png, which requires cairosvg
+    '''
+    try:
+        import cairosvg
+    except Exception as e:
+        return False
+    return True
+
+
+def png_version():
+    '''
+    Name and version of the rasterizer, requires cairosvg
+    '''
+    import cairosvg
+    return f"cairosvg {getattr(cairosvg, '__version__', 'unknown')}"
+
+
+def render_png(source, png_file):
+    '''
+    Render the WaveJSON source to a png file, requires cairosvg
+    '''
+    import cairosvg
+    cairosvg.svg2png(bytestring=render_svg(source).encode("utf-8"), write_to=png_file)
+    return True
@@ -1,6 +1,9 @@
 """Create WaveJSON text string from VCD file."""
+import os
+import re
 import sys
 import json
+from array import array
 
 class _SignalDef:
     def __init__(self, name, sid, length):
@@ -68,30 +71,6 @@ class WaveExtractor:
 
     def _setup(self):
 
-        def create_path_dict(fin):
-            hier_list = []
-            path_list = []
-            path_dict = {}
-            while True:
-                line = fin.readline()
-                if not line:
-                    raise EOFError('Can\'t find word "$enddefinitions".')
-                words = line.split()
-                if not words:
-                    continue
-                if words[0] == '$enddefinitions':
-                    return path_list, path_dict
-                if words[0] == '$scope':
-                    hier_list.append(words[2])
-                elif words[0] == '$var':
-                    path = '/'.join(hier_list + [words[4]])
-                    path_list.append(path)
-                    path_dict[path] = _SignalDef(name=words[4],
-                                                 sid=words[3],
-                                                 length=int(words[2]))
-                elif words[0] == '$upscope':
-                    del hier_list[-1]
-
         def update_path_dict(path_list, path_dict):
             new_path_dict = {}
             for path in path_list:
@@ -101,14 +80,18 @@ class WaveExtractor:
                 new_path_dict[path] = signal_def
             return new_path_dict
 
-        fin = open(self._vcd_file, 'rt')
-        path_list, path_dict = create_path_dict(fin)
+        reader = _VcdReader(self._vcd_file)
+        try:
+            path_list, path_dict = reader.read_header()
+        except Exception:
+            reader.close()
+            raise
         if self._path_list:
             path_dict = update_path_dict(self._path_list, path_dict)
         else:
             self._path_list = path_list
         self._path_dict = path_dict
-        self._fin = fin
+        self._reader = reader
 
     def print_props(self):
         """
@@ -148,7 +131,7 @@ class WaveExtractor:
 
     def execute(self):
         """Perform signal sampling and JSON generation."""
-        fin = self._fin
+        reader = self._reader
         path_list = self._path_list
         path_dict = self._path_dict
         wave_chunk = self._wave_chunk
@@ -160,6 +143,7 @@ class WaveExtractor:
             jsongen = _JsonGenerator(path_list, path_dict, wave_chunk)
             clock_id = path_dict[path_list[0]]._sid
             id_list = [path_dict[path]._sid for path in path_list]
+            changes = reader.changes(id_list, reals=False)
             value_dict = {sid: 'x' for sid in id_list}
             sample_dict = {sid: [] for sid in id_list}
             
@@ -170,75 +154,212 @@ class WaveExtractor:
             fout.write(jsongen.create_header())
 
             while True:
-                origin = sampler.run(fin, clock_id, value_dict, sample_dict)
+                origin = sampler.run(changes, clock_id, value_dict, sample_dict)
                 if len(sample_dict[clock_id]) == 0:
                     break
                 fout.write(jsongen.create_body(origin, sample_dict))
 
             fout.write(jsongen.create_footer())
-            fin.close()
+            reader.close()
             fout.close()
             return 0
         else:
             sampler = _SignalSamplerV2(start_time, end_time)
             signal_dict = {path_dict[path]._sid: path_dict[path] for path in path_list}
-            timestamps = sampler.run(fin, signal_dict)
-            # first check the kind of values in the signal_dict for each signal
-            signal_val_dict = {}
-            for sid in signal_dict:
-                signal_val_dict[sid] = 'b'
-                for timestamp in timestamps:
-                    if timestamps[timestamp][sid] not in ('0', '1', 'x', 'z'):
-                        if '.' in timestamps[timestamp][sid]:
-                            signal_val_dict[sid] = 'r'
-                            break
-                        else:
-                            signal_val_dict[sid] = 'm'
-            
-            # now we know if the signal is a single bit or a multi bit / real signal
-            # this tells us how to format the wave
-
-            wavedrom_json = {"signal": []}
-            timestamps_keys = list(timestamps.keys())
-            for sid in signal_dict:
-                dict_entry = {"name": signal_dict[sid]._name}
-                wave = ""
-                data = []
-                if signal_val_dict[sid] == 'b':
-                    for i, timestamp in enumerate(timestamps_keys):
-                        if i > 0 and timestamps[timestamps_keys[i-1]][sid] == timestamps[timestamps_keys[i]][sid]:
-                            wave += "." # same value as previous
-                        else:
-                            wave += timestamps[timestamp][sid]
-                else:
-                    for i, timestamp in enumerate(timestamps_keys):
-                        if i > 0 and timestamps[timestamps_keys[i-1]][sid] != timestamps[timestamps_keys[i]][sid]:
-                            wave += "="
-                            if signal_val_dict[sid] == 'r':
-                                data.append(timestamps[timestamp][sid])
-                            else: # convert from binary to hex
-                                data_str = hex(int(timestamps[timestamp][sid], 2))[2:]
-                                data.append(data_str)
-                        elif i == 0 and timestamps[timestamp][sid] != 'x':
-                            wave += "="
-                            if signal_val_dict[sid] == 'r':
-                                data.append(timestamps[timestamp][sid])
-                            else: # convert from binary to hex
-                                data_str = hex(int(timestamps[timestamp][sid], 2))[2:]
-                                data.append(data_str)
-                        elif i == 0:
-                            wave += "x"
-                        else:
-                            wave += "."
-                    dict_entry["data"] = data
-                dict_entry["wave"] = wave
-                wavedrom_json["signal"].append(dict_entry)
+            try:
+                times, changes = sampler.run(reader.changes(signal_dict.keys()), signal_dict)
+            finally:
+                reader.close()
+
+            # every signal is classified, encoded and written on its own, using only its own changes
+            # the output is the same as json.dump of {"signal": [...]} would give
             if self._json_file == '':
                 fout = sys.stdout
             else:
                 fout = open(self._json_file, 'wt')
-            json.dump(wavedrom_json, fout)
-        
+            try:
+                fout.write('{"signal": [')
+                for i, sid in enumerate(signal_dict):
+                    dict_entry = {"name": signal_dict[sid]._name}
+                    indexes, values = changes[sid]
+                    kind = _classify(values)
+                    if kind == 'b':
+                        dict_entry["wave"] = _encode_bits(indexes, values, len(times))
+                    else:
+                        wave, data = _encode_data(indexes, values, len(times), kind)
+                        dict_entry["data"] = data
+                        dict_entry["wave"] = wave
+                    if i > 0:
+                        fout.write(', ')
+                    fout.write(json.dumps(dict_entry))
+                fout.write(']}')
+            except Exception:
+                # do not leave a partially written file behind
+                if fout is not sys.stdout:
+                    fout.close()
+                    os.remove(self._json_file)
+                raise
+            if fout is not sys.stdout:
+                fout.close()
+            return 0
+
+
+def _classify(values):
+    """
+    Classify a signal by the values it takes.
+    'b' - Only single bit values.
+    'r' - At least one real value.
+    'm' - Multi bit values.
+    """
+    kind = 'b'
+    for value in values:
+        if value not in ('0', '1', 'x', 'z'):
+            if '.' in value:
+                return 'r'
+            kind = 'm'
+    return kind
+
+
+def _encode_bits(indexes, values, length):
+    """
+    Create the wave of a single bit signal from its changes.
+    The signal is 'x' until its first change.
+    """
+    pieces = []
+    if len(indexes) == 0 or indexes[0] != 0:
+        pieces.append('x')
+        pieces.append('.' * ((indexes[0] if len(indexes) > 0 else length) - 1))
+    for i, index in enumerate(indexes):
+        end = indexes[i + 1] if i + 1 < len(indexes) else length
+        pieces.append(values[i])
+        pieces.append('.' * (end - index - 1))
+    return ''.join(pieces)
+
+
+def _encode_data(indexes, values, length, kind):
+    """
+    Create the wave and data of a multi bit or real signal from its changes.
+    Multi bit values are converted from binary to hex.
+    """
+    pieces = []
+    data = []
+    if len(indexes) == 0 or indexes[0] != 0:
+        pieces.append('x')
+        pieces.append('.' * ((indexes[0] if len(indexes) > 0 else length) - 1))
+    for i, index in enumerate(indexes):
+        end = indexes[i + 1] if i + 1 < len(indexes) else length
+        pieces.append('=')
+        pieces.append('.' * (end - index - 1))
+        if kind == 'r':
+            data.append(values[i])
+        else:
+            data.append(hex(int(values[i], 2))[2:])
+    return ''.join(pieces), data
+
+
+class _VcdReader:
+    '''
+    Reads a VCD file in large blocks instead of line by line.
+    The header is parsed in a single pass over its tokens.
+    Value changes are found with one regular expression which only matches timestamps
+    and changes of the tracked signals, so changes of other signals are skipped without
+    running any python code for them.
+    '''
+
+    BLOCK_SIZE = 1 << 22
+
+    def __init__(self, vcd_file):
+        self._fin = open(vcd_file, 'rb')
+        self._rest = b''
+
+    def close(self):
+        self._fin.close()
+
+    def read_header(self):
+        """
+        Read the definitions at the start of the file.
+        Returns the list of signal paths and a dict mapping the paths to their _SignalDef.
+        """
+        data = b''
+        while True:
+            end = data.find(b'$enddefinitions')
+            if end != -1:
+                break
+            block = self._fin.read(self.BLOCK_SIZE)
+            if not block:
+                raise EOFError('Can\'t find word "$enddefinitions".')
+            data += block
+        # the body starts after the $end of $enddefinitions
+        body = data.find(b'$end', end + len(b'$enddefinitions'))
+        while body == -1:
+            block = self._fin.read(self.BLOCK_SIZE)
+            if not block:
+                raise EOFError('Can\'t find the end of "$enddefinitions".')
+            data += block
+            body = data.find(b'$end', end + len(b'$enddefinitions'))
+        self._rest = data[body + len(b'$end'):]
+
+        hier_list = []
+        path_list = []
+        path_dict = {}
+        words = data[:end].decode('utf-8', 'replace').split()
+        i = 0
+        while i < len(words):
+            word = words[i]
+            if word == '$scope':
+                hier_list.append(words[i + 2])
+                i += 3
+            elif word == '$var':
+                path = '/'.join(hier_list + [words[i + 4]])
+                path_list.append(path)
+                path_dict[path] = _SignalDef(name=words[i + 4],
+                                             sid=words[i + 3],
+                                             length=int(words[i + 2]))
+                i += 5
+            elif word == '$upscope':
+                del hier_list[-1]
+                i += 1
+            else:
+                i += 1
+        return path_list, path_dict
+
+    def changes(self, sids, reals=True):
+        """
+        Generate the value changes of the signals with the given ids.
+        Yields (None, time) for every timestamp and (sid, value) for every
+        change of a tracked signal. Real values are skipped if reals is False.
+        """
+        sids = sorted(set(sids), key=len, reverse=True)
+        id_map = {sid.encode(): sid for sid in sids}
+        alternatives = b'|'.join(re.escape(sid.encode()) for sid in sids) or b'(?!)'
+        vector = b'[bBrR]' if reals else b'[bB]'
+        # a line is either a timestamp, a scalar change or a vector change of a tracked signal
+        # matching the newline in front of the line lets the regex engine skip quickly to the next line
+        regex = re.compile(rb'\n(?:#(\d+)|([01xzXZ])(' + alternatives + rb')|' + vector +
+                           rb'(\S+)[ \t]+(' + alternatives + rb'))[ \t\r]*(?=\n)')
+        rest = self._rest
+        self._rest = b''
+        while True:
+            block = self._fin.read(self.BLOCK_SIZE)
+            if block:
+                data = rest + block
+                cut = data.rfind(b'\n') + 1
+                if cut == 0:
+                    rest = data
+                    continue
+                rest = data[cut:]
+                data = b'\n' + data[:cut]
+            else:
+                data = b'\n' + rest + b'\n'
+            for time, scalar, scalar_id, vector_value, vector_id in regex.findall(data):
+                if time:
+                    yield None, int(time)
+                elif scalar:
+                    yield id_map[scalar_id], scalar.decode().lower()
+                else:
+                    yield id_map[vector_id], vector_value.decode()
+            if not block:
+                return
 
 
 class _SignalSamplerV2():
@@ -255,47 +376,45 @@ class _SignalSamplerV2():
         if self._start_time != 0:
             print("WARNING: Start time is not yet supported in V2 Signal Sampler")
     
-    def run(self, fin, signal_dict):
+    def run(self, changes, signal_dict):
         '''
         Do an entire run instead of chunks as in v1
+        changes should be the value changes of the signals, as generated by _VcdReader.changes
         signal_dict should be in the form {sid: SignalDef}
+        Returns the sampled times as an array and, for every signal, the indexes into the times at which its value changed together with the new values
+        Values which only changed in between two sampled times are not recorded
         '''
-        timestamps = {} # for each signal keep track of the timestamps
+        times = array('q')
+        changes_dict = {sid: (array('q'), []) for sid in signal_dict.keys()}
         value_dict = {sid: 'x' for sid in signal_dict.keys()}
+        sampled_dict = dict(value_dict) # the values at the last sampled time
+        changed = set()
+
+        def sample(now):
+            index = len(times)
+            times.append(now)
+            for sid in changed:
+                value = value_dict[sid]
+                if value != sampled_dict[sid]:
+                    indexes, values = changes_dict[sid]
+                    indexes.append(index)
+                    values.append(value)
+                    sampled_dict[sid] = value
+            changed.clear()
+
         now = 0
-        while True:
-            if self._end_time != 0 and self._end_time < int(now):
-                return timestamps
-            line = fin.readline()
-            if not line:
-                timestamps[now] = value_dict.copy()
-                return timestamps
-            words = line.split()
-            if not words:
-                continue
-            char = words[0][0]
-            if char == '$': # start of vcd keyword, ignore
-                continue
-            if char == '#': # timestamp
-                timestamps[now] = value_dict.copy()
-                now = int(words[0][1:])
-                continue
-            if char in ('0', '1', 'x', 'z'): # single bit value
-                sid = words[0][1:]
-                if sid in value_dict:
-                    value_dict[sid] = char
+        for sid, value in changes:
+            if sid is None: # timestamp, sample the values of the previous time
+                if value != now:
+                    sample(now)
+                    now = value
+                if self._end_time != 0 and self._end_time < now:
+                    return times, changes_dict
                 continue
-            if char == 'b' or char == 'B': # multi bit value
-                sid = words[1]
-                if sid in value_dict:
-                    value_dict[sid] = words[0][1:]
-                continue
-            if char == 'r' or char == 'R': # real value
-                sid = words[1]
-                if sid in value_dict:
-                    value_dict[sid] = words[0][1:]
-                continue
-            raise ValueError('"{0}": Unexpected character.'.format(char))
+            value_dict[sid] = value
+            changed.add(sid)
+        sample(now)
+        return times, changes_dict
 
 
 
@@ -309,55 +428,38 @@ class _SignalSampler():
         self._end_time = end_time
         self._now = 0
 
-    def run(self, fin, clock_id, value_dict, sample_dict):
+    def run(self, changes, clock_id, value_dict, sample_dict):
 
         origin = self._now
         clock_prev = value_dict[clock_id]
         for sid in sample_dict:
             del sample_dict[sid][:]
         data_count = 0
-        while True:
+        if self._end_time != 0 and self._end_time < int(self._now):
+            return origin
+        for sid, value in changes:
+            if sid is not None:
+                value_dict[sid] = value
+                continue
+            # timestamp
+            next_now = value
+            clock = value_dict[clock_id]
+            if clock_prev == '0' and clock == '1':
+                if data_count == 0:
+                    origin = self._now
+            elif self._start_time <= int(origin) and \
+                    clock_prev == '1' and clock == '0':
+                for sid in sample_dict:
+                    sample_dict[sid].append(value_dict[sid])
+                data_count += 1
+                if data_count == self._wave_chunk:
+                    self._now = next_now
+                    return origin
+            self._now = next_now
+            clock_prev = clock
             if self._end_time != 0 and self._end_time < int(self._now):
                 return origin
-            line = fin.readline()
-            if not line:
-                return origin
-            words = line.split()
-            if not words:
-                continue
-            char = words[0][0]
-            if char == '$':
-                continue
-            if char == 'r':
-                continue
-            if char in ('0', '1', 'x', 'z'):
-                sid = words[0][1:]
-                if sid in value_dict:
-                    value_dict[sid] = char
-                continue
-            if char == 'b':
-                sid = words[1]
-                if sid in value_dict:
-                    value_dict[sid] = words[0][1:]
-                continue
-            if char == '#':
-                next_now = words[0][1:]
-                clock = value_dict[clock_id]
-                if clock_prev == '0' and clock == '1':
-                    if data_count == 0:
-                        origin = self._now
-                elif self._start_time <= int(origin) and \
-                        clock_prev == '1' and clock == '0':
-                    for sid in sample_dict:
-                        sample_dict[sid].append(value_dict[sid])
-                    data_count += 1
-                    if data_count == self._wave_chunk:
-                        self._now = next_now
-                        return origin
-                self._now = next_now
-                clock_prev = clock
-                continue
-            raise ValueError('"{0}": Unexpected character.'.format(char))
+        return origin
 
 
 class _JsonGenerator():
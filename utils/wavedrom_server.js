@@ -0,0 +1,101 @@
+#!/usr/bin/env node
+// Long lived wavedrom renderer used by scripts/renderer.py
+// Reads one JSON request per line from stdin:
+//   {"id": 1, "input": "/path/wavedrom.json", "png": "/path/wavedrom.png", "svg": "/path/wavedrom.svg"}
+// and answers every request with one JSON line on stdout:
+//   {"id": 1, "ok": true} or {"id": 1, "ok": false, "error": "..."}
+// "png" and "svg" are both optional. Once the modules are loaded, {"ready": true, "png": "resvg", "version": "..."} is written, "png" being the
+// rasterizer which writes the pngs, null when neither @resvg/resvg-js nor sharp could be loaded, and "version" the versions of wavedrom and
+// the rasterizer, which identify the images the server creates. The modules are resolved through NODE_PATH,
+// which scripts/renderer.py points to the global node_modules where wavedrom-cli is installed.
+'use strict';
+
+const fs = require('fs');
+const path = require('path');
+const readline = require('readline');
+
+const wavedrom = require('wavedrom');
+const onml = wavedrom.onml || require('onml');
+const skin = wavedrom.waveSkin || require('wavedrom/skins/default.js');
+
+function optional(name) {
+    try {
+        return require(name);
+    } catch (e) {
+        return null;
+    }
+}
+
+const resvg = optional('@resvg/resvg-js');
+const sharp = resvg ? null : optional('sharp');
+const rasterizer = resvg ? '@resvg/resvg-js' : (sharp ? 'sharp' : null);
+
+function packageVersion(name) {
+    // not every package exports its package.json, it is looked up from the entry point instead
+    try {
+        let dir = path.dirname(require.resolve(name));
+        while (dir !== path.dirname(dir)) {
+            const file = path.join(dir, 'package.json');
+            if (fs.existsSync(file)) {
+                const info = JSON.parse(fs.readFileSync(file, 'utf8'));
+                if (info.name === name) {
+                    return name + ' ' + info.version;
+                }
+            }
+            dir = path.dirname(dir);
+        }
+    } catch (e) {
+        // the version stays unknown
+    }
+    return name + ' unknown';
+}
+
+function renderSvg(source) {
+    return onml.s(wavedrom.renderAny(0, source, skin));
+}
+
+async function writePng(svg, file) {
+    if (resvg) {
+        fs.writeFileSync(file, new resvg.Resvg(svg).render().asPng());
+    } else if (sharp) {
+        await sharp(Buffer.from(svg)).png().toFile(file);
+    } else {
+        throw new Error('No PNG rasterizer available, install @resvg/resvg-js or sharp');
+    }
+}
+
+async function handle(request) {
+    const source = JSON.parse(fs.readFileSync(request.input, 'utf8'));
+    const svg = renderSvg(source);
+    if (request.svg) {
+        fs.writeFileSync(request.svg, svg);
+    }
+    if (request.png) {
+        await writePng(svg, request.png);
+    }
+}
+
+const version = [packageVersion('wavedrom')].concat(rasterizer ? [packageVersion(rasterizer)] : []).join(', ');
+process.stdout.write(JSON.stringify({ready: true, png: resvg ? 'resvg' : (sharp ? 'sharp' : null), version: version}) + '\n');
+
+const lines = readline.createInterface({input: process.stdin, terminal: false});
+let queue = Promise.resolve();
+lines.on('line', (line) => {
+    if (!line.trim()) {
+        return;
+    }
+    // requests are handled one at a time, in order
+    queue = queue.then(async () => {
+        let request = null;
+        try {
+            request = JSON.parse(line);
+            await handle(request);
+            process.stdout.write(JSON.stringify({id: request.id, ok: true}) + '\n');
+        } catch (e) {
+            process.stdout.write(JSON.stringify({id: request ? request.id : null, ok: false, error: String(e)}) + '\n');
+        }
+    });
+});
+lines.on('close', () => {
+    queue.then(() => process.exit(0));
+});